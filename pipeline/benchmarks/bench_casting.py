@@ -0,0 +1,83 @@
+"""Compare casting resolution with linear scans and with id indexes."""
+import argparse
+import random
+import time
+from typing import List
+
+from watchtower_pipeline import models
+from watchtower_pipeline.kitsu import KitsuWriter
+
+
+class SyntheticKitsuClient:
+    """Serve casting responses from memory."""
+
+    def __init__(self, casting_per_sequence):
+        self.casting_per_sequence = casting_per_sequence
+
+    def get_json(self, path, params=None):
+        sequence_id = path.split('/')[-2]
+        return self.casting_per_sequence[sequence_id]
+
+    def get_json_many(self, paths, workers=8):
+        return [self.get_json(path) for path in paths]
+
+
+def get_project_casting_linear(casting_per_sequence, shots, assets) -> List[models.ShotCasting]:
+    """The previous implementation, scanning the shot and asset lists for each lookup."""
+    shot_castings = []
+    for casting_per_shot in casting_per_sequence.values():
+        for shot_id, cast_assets in casting_per_shot.items():
+            shot = next((s for s in shots if s.id == shot_id), None)
+            shot_casting = models.ShotCasting(shot=shot)
+            for ca in cast_assets:
+                asset = next((a for a in assets if a.id == ca['asset_id']), None)
+                shot_casting.assets.append(asset)
+            shot_castings.append(shot_casting)
+    return shot_castings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--shots", type=int, default=4000)
+    parser.add_argument("--assets", type=int, default=2500)
+    parser.add_argument("--sequences", type=int, default=100)
+    parser.add_argument("--cast", type=int, default=8, help="Assets cast in each shot")
+    args = parser.parse_args()
+
+    random.seed(0)
+    sequences = [models.Sequence(name=f"SQ{i}") for i in range(args.sequences)]
+    shots = [
+        models.Shot(
+            name=f"SH{i}",
+            sequence_id=sequences[i % len(sequences)].id,
+            data=models.ShotData(frame_in=0, frame_out=24),
+        )
+        for i in range(args.shots)
+    ]
+    assets = [models.Asset(name=f"AS{i}", asset_type_id='at') for i in range(args.assets)]
+    casting_per_sequence = {s.id: {} for s in sequences}
+    for shot in shots:
+        casting_per_sequence[shot.sequence_id][shot.id] = [
+            {'asset_id': a.id} for a in random.sample(assets, min(args.cast, len(assets)))
+        ]
+
+    writer = KitsuWriter.__new__(KitsuWriter)
+    writer.kitsu_client = SyntheticKitsuClient(casting_per_sequence)
+    project = models.Project(id='project', name='Project', ratio='16:9', resolution='1920x1080')
+
+    start = time.perf_counter()
+    linear = get_project_casting_linear(casting_per_sequence, shots, assets)
+    linear_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    indexed = writer.get_project_casting(project, sequences, shots, assets)
+    indexed_time = time.perf_counter() - start
+
+    assert [c.to_dict() for c in linear] == [c.to_dict() for c in indexed]
+    print(f"{args.shots} shots, {args.assets} assets, {args.cast} cast assets per shot")
+    print(f"linear scan: {linear_time:.3f}s")
+    print(f"indexed:     {indexed_time:.3f}s ({linear_time / indexed_time:.0f}x faster)")
+
+
+if __name__ == '__main__':
+    main()
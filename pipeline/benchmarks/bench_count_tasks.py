@@ -0,0 +1,82 @@
+"""Compare task counting with nested dicts of lists and with a single Counter."""
+import argparse
+import random
+import time
+from collections import defaultdict
+
+from watchtower_pipeline.writers import ProjectWriter
+
+
+def count_tasks_nested(entities_list, timestamp):
+    """The previous implementation."""
+    task_type_status_dict = defaultdict(lambda: defaultdict(list))
+    for entity in entities_list:
+        episode_id = entity.get('episode_id')
+        for task in entity.get('tasks', []):
+            task_type_id = task.get('task_type_id')
+            task_status_id = task.get('task_status_id')
+            if task_type_id and task_status_id:
+                if task_status_id in task_type_status_dict[(task_type_id, episode_id)]:
+                    task_type_status_dict[(task_type_id, episode_id)][task_status_id][0][
+                        'count'
+                    ] += 1
+                else:
+                    task_type_status_dict[(task_type_id, episode_id)][task_status_id].append(
+                        {'timestamp': timestamp, 'count': 1}
+                    )
+
+    parsed_data = []
+    for (task_type_id, episode_id), status_dict in task_type_status_dict.items():
+        task_statuses = [
+            {
+                'task_status_id': status_id,
+                'data': [{'timestamp': ts['timestamp'], 'count': ts['count']} for ts in tasks],
+            }
+            for status_id, tasks in status_dict.items()
+        ]
+        parsed_data.append(
+            {'task_type_id': task_type_id, 'episode_id': episode_id, 'task_statuses': task_statuses}
+        )
+    return parsed_data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--shots", type=int, default=50000)
+    parser.add_argument("--tasks", type=int, default=10, help="Tasks per shot")
+    parser.add_argument("--episodes", type=int, default=20)
+    args = parser.parse_args()
+
+    random.seed(0)
+    task_types = [f"tt{i}" for i in range(12)]
+    task_statuses = [f"ts{i}" for i in range(8)]
+    shots = [
+        {
+            'episode_id': f"ep{random.randrange(args.episodes)}",
+            'tasks': [
+                {
+                    'task_type_id': random.choice(task_types),
+                    'task_status_id': random.choice(task_statuses),
+                }
+                for _ in range(args.tasks)
+            ],
+        }
+        for _ in range(args.shots)
+    ]
+
+    start = time.perf_counter()
+    nested = count_tasks_nested(shots, 'now')
+    nested_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    counted = ProjectWriter.count_tasks(shots, 'now')
+    counter_time = time.perf_counter() - start
+
+    assert nested == counted
+    print(f"{args.shots} shots, {args.tasks} tasks per shot, {args.episodes} episodes")
+    print(f"nested dicts: {nested_time:.3f}s")
+    print(f"Counter:      {counter_time:.3f}s ({nested_time / counter_time:.1f}x faster)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Compare peak memory of writing shots.json as a list of dicts and streamed."""
+import argparse
+import json
+import pathlib
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict
+
+from watchtower_pipeline import jsonfiles, models
+
+
+def measure(function):
+    tracemalloc.start()
+    start = time.perf_counter()
+    function()
+    duration = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return duration, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--shots", type=int, default=20000)
+    parser.add_argument("--tasks", type=int, default=8, help="Tasks per shot")
+    args = parser.parse_args()
+
+    shots = [
+        models.Shot(
+            name=f"SH{i}",
+            sequence_id='sequence',
+            data=models.ShotData(frame_in=i * 24, frame_out=(i + 1) * 24),
+            tasks=[
+                models.Task(task_type_id=f"tt{t}", task_status_id='ts', assignees=['p1'])
+                for t in range(args.tasks)
+            ],
+        )
+        for i in range(args.shots)
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        list_dst = pathlib.Path(tmp_dir) / 'list' / 'shots.json'
+        list_dst.parent.mkdir()
+        stream_dir = pathlib.Path(tmp_dir) / 'stream'
+
+        def write_list():
+            """The previous implementation."""
+            with open(list_dst, 'w') as outfile:
+                json.dump([asdict(s) for s in shots], outfile, indent=2)
+
+        def write_streamed():
+            manifest = jsonfiles.Manifest(stream_dir)
+            manifest.write_json_list('shots.json', (s.to_dict() for s in shots))
+
+        list_time, list_peak = measure(write_list)
+        stream_time, stream_peak = measure(write_streamed)
+        assert list_dst.read_bytes() == (stream_dir / 'shots.json').read_bytes()
+        # Unchanged: compared while serializing, nothing is written
+        unchanged_time, unchanged_peak = measure(write_streamed)
+
+    mib = 1024 * 1024
+    print(f"{args.shots} shots, {args.tasks} tasks per shot")
+    print(f"list of dicts: {list_time:.2f}s, peak {list_peak / mib:.1f} MiB")
+    print(f"streamed:      {stream_time:.2f}s, peak {stream_peak / mib:.1f} MiB")
+    print(f"unchanged:     {unchanged_time:.2f}s, peak {unchanged_peak / mib:.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Compare the memory used by shots and tasks with the dataclasses and compact models."""
+import argparse
+import json
+import tracemalloc
+import uuid
+
+from watchtower_pipeline import models
+from watchtower_pipeline.kitsu import KitsuWriter
+
+
+def get_shots_payload(shots, tasks, task_types, task_statuses, team) -> str:
+    """A /data/shots/with-tasks response."""
+    task_type_ids = [str(uuid.uuid4()) for _ in range(task_types)]
+    task_status_ids = [str(uuid.uuid4()) for _ in range(task_statuses)]
+    person_ids = [str(uuid.uuid4()) for _ in range(team)]
+    payload = [
+        {
+            'id': str(uuid.uuid4()),
+            'name': f"SH{i:04}",
+            'sequence_id': 'sequence',
+            'data': {'frame_in': i * 24, 'frame_out': (i + 1) * 24},
+            'preview_file_id': None,
+            'tasks': [
+                {
+                    'id': str(uuid.uuid4()),
+                    'task_type_id': task_type_ids[t % task_types],
+                    'task_status_id': task_status_ids[(i + t) % task_statuses],
+                    'assignees': [person_ids[(i + t) % team]],
+                }
+                for t in range(tasks)
+            ],
+        }
+        for i in range(shots)
+    ]
+    return json.dumps(payload)
+
+
+class SyntheticKitsuClient:
+    """Decode the response on every request, like the actual client."""
+
+    base_url = 'http://kitsu/api'
+
+    def __init__(self, payload: str):
+        self.payload = payload
+
+    def get_json(self, path, params=None):
+        return json.loads(self.payload)
+
+
+def measure_shots(writer, project):
+    """Measure the memory used by shots, once the response they were built from is freed."""
+    tracemalloc.start()
+    shots = writer.get_project_shots(project)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return shots, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--shots", type=int, default=10000)
+    parser.add_argument("--tasks", type=int, default=10, help="Tasks per shot")
+    args = parser.parse_args()
+
+    payload = get_shots_payload(args.shots, args.tasks, task_types=12, task_statuses=8, team=40)
+    writer = KitsuWriter.__new__(KitsuWriter)
+    writer.kitsu_client = SyntheticKitsuClient(payload)
+    project = models.Project(id='project', name='Project', ratio='16:9', resolution='1920x1080')
+
+    shots, size = measure_shots(writer, project)
+    writer.compact_models = True
+    compact_shots, compact_size = measure_shots(writer, project)
+    assert [s.to_dict() for s in shots] == [s.to_dict() for s in compact_shots]
+
+    mib = 1024 * 1024
+    print(f"{args.shots} shots, {args.tasks} tasks per shot")
+    print(f"dataclasses: {size / mib:.1f} MiB")
+    print(f"compact:     {compact_size / mib:.1f} MiB ({size / compact_size:.1f}x smaller)")
+
+
+if __name__ == '__main__':
+    main()
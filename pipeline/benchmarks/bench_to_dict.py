@@ -0,0 +1,63 @@
+"""Compare dataclasses.asdict with the hand-written to_dict() of the models."""
+import argparse
+import gc
+import time
+from dataclasses import asdict
+
+from watchtower_pipeline import models
+
+
+def measure(function, entities):
+    # Garbage collection pauses would dominate the timings, with this many objects
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        result = [function(e) for e in entities]
+        return time.perf_counter() - start, result
+    finally:
+        gc.enable()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entities", type=int, default=100000, help="Entities of each type")
+    parser.add_argument("--tasks", type=int, default=8, help="Tasks per shot and asset")
+    args = parser.parse_args()
+
+    def make_tasks():
+        return [
+            models.Task(task_type_id=f"tt{t}", task_status_id='ts', assignees=['p1'])
+            for t in range(args.tasks)
+        ]
+
+    entities_by_type = {
+        'Task': [t for _ in range(args.entities // args.tasks) for t in make_tasks()],
+        'Shot': [
+            models.Shot(
+                name=f"SH{i}",
+                sequence_id='sequence',
+                data=models.ShotData(frame_in=i * 24, frame_out=(i + 1) * 24),
+                tasks=make_tasks(),
+            )
+            for i in range(args.entities)
+        ],
+        'Asset': [
+            models.Asset(name=f"AS{i}", asset_type_id='at', tasks=make_tasks())
+            for i in range(args.entities)
+        ],
+    }
+
+    print(f"{args.entities} entities of each type, {args.tasks} tasks per shot and asset")
+    for entity_type, entities in entities_by_type.items():
+        asdict_time, expected = measure(asdict, entities)
+        to_dict_time, result = measure(lambda e: e.to_dict(), entities)
+        assert result == expected
+        print(
+            f"{entity_type:<6} asdict: {asdict_time:.2f}s, to_dict: {to_dict_time:.2f}s "
+            f"({asdict_time / to_dict_time:.1f}x faster)"
+        )
+
+
+if __name__ == '__main__':
+    main()
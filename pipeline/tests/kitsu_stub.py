@@ -0,0 +1,330 @@
+"""A minimal local stand-in for the Kitsu API, used to test the HTTP layer."""
+
+import base64
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+
+@dataclass
+class StubRequest:
+    method: str
+    path: str
+    query: Dict[str, List[str]]
+    headers: Dict[str, str]
+
+
+# A route handler receives the request and returns (status, headers, body)
+RouteHandler = Callable[[StubRequest], Tuple[int, Dict[str, str], bytes]]
+
+
+@dataclass
+class KitsuStub:
+    """Serve canned responses on a local port.
+
+    Routes are looked up by method and path (the query string is ignored). The stub
+    records every request, and counts the TCP connections it accepted, so tests can
+    check that connections are reused.
+    """
+
+    routes: Dict[Tuple[str, str], RouteHandler] = field(default_factory=dict)
+    requests: List[StubRequest] = field(default_factory=list)
+    connections: int = 0
+
+    def __post_init__(self):
+        self.add_json('/api/auth/login', {'access_token': 'stub-token'}, method='POST')
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api"
+
+    def add_route(self, path, handler: RouteHandler, method='GET'):
+        self.routes[(method, path)] = handler
+
+    def add_json(self, path, payload, method='GET'):
+        body = json.dumps(payload).encode()
+        self.add_route(
+            path, lambda request: (200, {'Content-Type': 'application/json'}, body), method
+        )
+
+    def add_bytes(self, path, body: bytes, headers=None):
+        self.add_route(path, lambda request: (200, dict(headers or {}), body))
+
+    def requests_for(self, path) -> List[StubRequest]:
+        return [r for r in self.requests if r.path == path]
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with stub._lock:
+                    stub.connections += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def _handle(self):
+                url = urlsplit(self.path)
+                length = int(self.headers.get('Content-Length', 0))
+                if length:
+                    self.rfile.read(length)
+                request = StubRequest(
+                    method=self.command,
+                    path=url.path,
+                    query=parse_qs(url.query),
+                    headers=dict(self.headers),
+                )
+                with stub._lock:
+                    stub.requests.append(request)
+                handler = stub.routes.get((self.command, url.path))
+                if handler:
+                    status, headers, body = handler(request)
+                else:
+                    status, headers, body = 404, {}, b'{"error": true, "message": "Not found"}'
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                if 'Content-Length' in headers:
+                    # Simulate an interrupted transfer when the body is shorter
+                    self.close_connection = int(headers['Content-Length']) > len(body)
+                else:
+                    self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(body)
+
+            do_GET = _handle
+            do_POST = _handle
+            do_HEAD = _handle
+
+        return Handler
+
+    def __enter__(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def add_production(stub: KitsuStub, project_id='prj', production_type='tvshow'):
+    """Register the endpoints of a small production with two episodes."""
+    task_types = [
+        {'id': 'tt-anim', 'name': 'Animation', 'color': '#f00', 'for_entity': 'Shot'},
+        {'id': 'tt-model', 'name': 'Modeling', 'color': '#0f0', 'for_entity': 'Asset'},
+        {'id': 'tt-other', 'name': 'Other', 'color': '#00f', 'for_entity': 'Shot'},
+    ]
+    stub.add_json(
+        '/api/data/user/context',
+        {
+            'projects': [
+                {
+                    'id': project_id,
+                    'name': 'Production',
+                    'production_type': production_type,
+                    'resolution': '1920x1080',
+                    'ratio': '16:9',
+                    'fps': '24',
+                    'team': ['p1', 'p2'],
+                    'asset_types': ['at-char'],
+                    'task_types': ['tt-anim', 'tt-model'],
+                    'task_types_priority': {'tt-anim': 2, 'tt-model': 1},
+                    'task_statuses': ['ts-todo', 'ts-done'],
+                }
+            ],
+            'asset_types': [{'id': 'at-char', 'name': 'Characters'}, {'id': 'at-x', 'name': 'X'}],
+            'task_types': task_types,
+            'task_status': [
+                {'id': 'ts-todo', 'name': 'Todo', 'color': '#fff'},
+                {'id': 'ts-done', 'name': 'Done', 'color': '#0f0'},
+                {'id': 'ts-wip', 'name': 'WIP', 'color': '#00f'},
+            ],
+            'persons': [
+                {'id': 'p1', 'full_name': 'Person One'},
+                {'id': 'p2', 'full_name': 'Person Two'},
+                {'id': 'p3', 'full_name': 'Not In Team'},
+            ],
+        },
+    )
+    episodes = [{'id': 'ep1', 'name': 'E01'}, {'id': 'ep2', 'name': 'E02'}]
+    stub.add_json(f'/api/data/projects/{project_id}/episodes', episodes)
+    sequences = [
+        {'id': 'seq1', 'name': 'SQ01', 'episode_id': 'ep1'},
+        {'id': 'seq2', 'name': 'SQ02', 'episode_id': 'ep2'},
+    ]
+
+    def sequences_route(request):
+        episode_id = request.query.get('episode_id', [None])[0]
+        matching = [s for s in sequences if episode_id in (None, s['episode_id'])]
+        return 200, {'Content-Type': 'application/json'}, json.dumps(matching).encode()
+
+    stub.add_route('/api/data/sequences', sequences_route)
+
+    def task(task_id, task_type_id, task_status_id):
+        return {
+            'id': task_id,
+            'task_type_id': task_type_id,
+            'task_status_id': task_status_id,
+            'assignees': ['p1'],
+        }
+
+    stub.add_json(
+        '/api/data/shots/with-tasks',
+        [
+            {
+                'id': 'sh1',
+                'name': 'SH010',
+                'sequence_id': 'seq1',
+                'episode_id': 'ep1',
+                'data': {'frame_in': '1', 'frame_out': '49'},
+                'preview_file_id': 'pf-sh1',
+                'tasks': [task('t1', 'tt-anim', 'ts-done'), task('t2', 'tt-other', 'ts-todo')],
+            },
+            {
+                'id': 'sh2',
+                'name': 'SH020',
+                'sequence_id': 'seq2',
+                'episode_id': 'ep2',
+                'data': {'frame_in': '49', 'frame_out': '97'},
+                'preview_file_id': None,
+                'tasks': [task('t3', 'tt-anim', 'ts-todo')],
+            },
+            {
+                'id': 'sh3',
+                'name': 'SH030',
+                'sequence_id': 'seq2',
+                'episode_id': 'ep2',
+                'data': {},
+                'preview_file_id': None,
+                'tasks': [],
+            },
+        ],
+    )
+    stub.add_json(
+        '/api/data/assets/with-tasks',
+        [
+            {
+                'id': 'as1',
+                'name': 'Hero',
+                'asset_type_id': 'at-char',
+                'canceled': False,
+                'preview_file_id': 'pf-as1',
+                'tasks': [task('t4', 'tt-model', 'ts-done')],
+            },
+            {
+                'id': 'as2',
+                'name': 'Villain',
+                'asset_type_id': 'at-char',
+                'canceled': False,
+                'preview_file_id': None,
+                'tasks': [task('t5', 'tt-model', 'ts-wip')],
+            },
+            {
+                'id': 'as3',
+                'name': 'Canceled',
+                'asset_type_id': 'at-char',
+                'canceled': True,
+                'preview_file_id': None,
+                'tasks': [],
+            },
+        ],
+    )
+    stub.add_json(
+        f'/api/data/projects/{project_id}/sequences/seq1/casting',
+        {'sh1': [{'asset_id': 'as1'}, {'asset_id': 'as2'}]},
+    )
+    stub.add_json(
+        f'/api/data/projects/{project_id}/sequences/seq2/casting',
+        {'sh2': [{'asset_id': 'as2'}]},
+    )
+    stub.add_json(
+        '/api/data/edits/with-tasks',
+        [
+            {
+                'id': 'ed1',
+                'name': 'Edit',
+                'project_id': project_id,
+                'episode_id': 'ep1',
+                'canceled': False,
+                'data': {'frame_start': '101'},
+            }
+        ],
+    )
+    stub.add_json('/api/data/edits/ed1/task-types', [{'id': 'tt-edit', 'name': 'Edit'}])
+    stub.add_json('/api/data/edits/ed1/preview-files', {'tt-edit': [{'id': 'pf-ed1'}]})
+    for preview_file_id in ['pf-sh1', 'pf-as1']:
+        stub.add_bytes(
+            f'/api/pictures/thumbnails/preview-files/{preview_file_id}.png',
+            preview_file_id.encode(),
+        )
+    for person_id in ['p1', 'p2']:
+        stub.add_bytes(f'/api/pictures/thumbnails/persons/{person_id}.png', person_id.encode())
+    stub.add_bytes(f'/api/pictures/thumbnails/projects/{project_id}.png', b'project')
+    stub.add_bytes('/api/movies/low/preview-files/pf-ed1.mp4', b'movie')
+
+
+def add_events(stub: KitsuStub, events: List[Dict]):
+    """Serve /data/events/last from a list of events, which can be changed later."""
+
+    def events_route(request):
+        after = request.query.get('after', [''])[0]
+        limit = int(request.query.get('limit', ['100'])[0])
+        matching = sorted(
+            (e for e in events if e['created_at'] > after),
+            key=lambda e: e['created_at'],
+            reverse=True,
+        )
+        return 200, {'Content-Type': 'application/json'}, json.dumps(matching[:limit]).encode()
+
+    stub.add_route('/api/data/events/last', events_route)
+
+
+def make_jwt(subject: str, lifetime: float, age: float = 0) -> str:
+    """An unsigned JWT valid for lifetime seconds, issued age seconds ago."""
+
+    def encode(data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b'=').decode()
+
+    issued_at = int(time.time() - age)
+    claims = {'sub': subject, 'iat': issued_at, 'exp': issued_at + int(lifetime)}
+    return f"{encode({'alg': 'none'})}.{encode(claims)}."
+
+
+def add_auth(stub: KitsuStub, path: str, lifetime: float = 3600, age: float = 0):
+    """Issue access tokens valid for lifetime seconds (issued age seconds ago), with a
+    refresh token, and only serve path to requests with the latest access token."""
+    tokens = []
+
+    def new_token():
+        tokens.append(make_jwt(f"access-{len(tokens)}", lifetime, age))
+        body = {'access_token': tokens[-1], 'refresh_token': 'refresh'}
+        return 200, {'Content-Type': 'application/json'}, json.dumps(body).encode()
+
+    def refresh(request):
+        if request.headers.get('Authorization') != 'Bearer refresh':
+            return 401, {}, b''
+        return new_token()
+
+    def protected(request):
+        if request.headers.get('Authorization') != f"Bearer {tokens[-1]}":
+            return 401, {}, b''
+        return 200, {'Content-Type': 'application/json'}, b'[]'
+
+    stub.add_route('/api/auth/login', lambda request: new_token(), method='POST')
+    stub.add_route('/api/auth/refresh-token', refresh)
+    stub.add_route(path, protected)
+    return tokens
@@ -0,0 +1,141 @@
+import errno
+import os
+import pathlib
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from watchtower_pipeline import bundling, jsonfiles, writers
+
+
+class TestSyncTree(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.src = pathlib.Path(self.tmp_dir.name) / 'src'
+        self.dst = pathlib.Path(self.tmp_dir.name) / 'dst'
+        (self.src / 'projects/prj').mkdir(parents=True)
+        (self.src / 'projects.json').write_text('[]')
+        (self.src / 'projects/prj/edit.mp4').write_bytes(b'edit')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_copy(self):
+        stats = bundling.sync_tree(self.src, self.dst)
+        self.assertEqual(stats.files, {'copy': 2})
+        self.assertEqual((self.dst / 'projects/prj/edit.mp4').read_bytes(), b'edit')
+
+        # Unchanged files are skipped
+        self.assertEqual(bundling.sync_tree(self.src, self.dst).files, {'skipped': 2})
+
+        (self.src / 'projects.json').write_text('[{}]')
+        stats = bundling.sync_tree(self.src, self.dst)
+        self.assertEqual(stats.files, {'copy': 1, 'skipped': 1})
+        self.assertEqual((self.dst / 'projects.json').read_text(), '[{}]')
+
+    def test_hardlink(self):
+        bundling.sync_tree(self.src, self.dst, mode='hardlink')
+        src_stat = (self.src / 'projects/prj/edit.mp4').stat()
+        self.assertTrue(os.path.samestat(src_stat, (self.dst / 'projects/prj/edit.mp4').stat()))
+
+    def test_delete_removed_files(self):
+        (self.dst / 'projects/prj').mkdir(parents=True)
+        (self.dst / 'projects/prj/notes.txt').write_text('not synchronized')
+        (self.src / 'projects/prj/edit.mp4.part').write_bytes(b'downloading')
+        bundling.sync_tree(self.src, self.dst)
+        self.assertFalse((self.dst / 'projects/prj/edit.mp4.part').exists())
+
+        (self.src / 'projects/prj/edit.mp4').unlink()
+        (self.src / 'projects/other').mkdir()
+        (self.src / 'projects/other/edit.mp4').write_bytes(b'other edit')
+        stats = bundling.sync_tree(self.src, self.dst)
+        self.assertEqual(stats.files, {'copy': 1, 'deleted': 1, 'skipped': 1})
+        self.assertFalse((self.dst / 'projects/prj/edit.mp4').exists())
+        # Files that were not synchronized are left untouched
+        self.assertTrue((self.dst / 'projects/prj/notes.txt').exists())
+
+        shutil.rmtree(self.src / 'projects')
+        bundling.sync_tree(self.src, self.dst)
+        self.assertFalse((self.dst / 'projects/other').exists())
+        self.assertEqual(
+            sorted(p.name for p in self.dst.iterdir()),
+            [bundling.MANIFEST_NAME, 'projects', 'projects.json'],
+        )
+
+    def test_excluded_suffixes(self):
+        (self.src / 'projects/prj/edit.mp4.frames.json').write_text('{}')
+        bundling.sync_tree(self.src, self.dst)
+        self.assertTrue((self.dst / 'projects/prj/edit.mp4.frames.json').exists())
+
+        # Published by a previous synchronization: deleted
+        stats = bundling.sync_tree(self.src, self.dst, excluded_suffixes=('.frames.json',))
+        self.assertEqual(stats.files, {'deleted': 1, 'skipped': 2})
+        self.assertFalse((self.dst / 'projects/prj/edit.mp4.frames.json').exists())
+
+    def test_unsupported_mode_falls_back_to_copy(self):
+        # Cloning is not supported on most test filesystems, force it to fail anyway
+        with mock.patch('fcntl.ioctl', side_effect=OSError(errno.EOPNOTSUPP, 'no')):
+            stats = bundling.sync_tree(self.src, self.dst, mode='reflink')
+        self.assertEqual(stats.files, {'copy': 2})
+        self.assertEqual((self.dst / 'projects/prj/edit.mp4').read_bytes(), b'edit')
+        self.assertEqual(
+            sorted(p.name for p in (self.dst / 'projects/prj').iterdir()), ['edit.mp4']
+        )
+
+
+class TestWatchtowerBundler(unittest.TestCase):
+    def test_bundle(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            destination_path = pathlib.Path(tmp_dir) / 'export'
+            client_path = pathlib.Path(tmp_dir) / 'dist_client_web'
+            client_path.mkdir()
+            (client_path / 'index.html').write_text('<html>')
+            (destination_path / 'data').mkdir(parents=True)
+            (destination_path / 'data/projects.json').write_text('[]')
+            # Only read by the pipeline
+            internal_files = [
+                'projects/prj.state.json',
+                'projects/prj/task_counts.log.jsonl',
+                'projects/prj/task_counts.history.json',
+                'projects/prj/task_counts.history.json.gz',
+                'projects/prj/edit.mp4.frames.json',
+                'projects/prj/edit.mp4.meta.json',
+                'projects/prj/edit.mp4.part.meta.json',
+                'projects/prj/edit.mp4.part',
+            ]
+            (destination_path / 'data/projects/prj').mkdir(parents=True)
+            for name in ['projects/prj/task_counts.json', 'projects/prj/edit.mp4'] + internal_files:
+                (destination_path / 'data' / name).write_text('{}')
+            # Listed by previous versions
+            manifest = jsonfiles.Manifest.load(destination_path / 'data/projects/prj')
+            for name in ['task_counts.json', 'task_counts.history.json']:
+                manifest.files[name] = jsonfiles.ManifestEntry(digest='', size=2)
+            manifest.save()
+            # Written in the bundle by previous versions
+            (destination_path / 'watchtower/data').mkdir(parents=True)
+            (destination_path / 'watchtower/data/removed.json').write_text('{}')
+            bundling.save_manifest(
+                destination_path / 'watchtower/data' / bundling.MANIFEST_NAME, {'removed.json'}
+            )
+
+            with mock.patch('watchtower_pipeline.writers.DIST_CLIENT_WEB_PATH', client_path):
+                writers.WatchtowerBundler.bundle(destination_path, mode='hardlink')
+            bundle_path = destination_path / 'watchtower'
+            self.assertEqual((bundle_path / 'index.html').read_text(), '<html>')
+            self.assertEqual((bundle_path / 'data/projects.json').read_text(), '[]')
+            self.assertEqual(
+                sorted(p.name for p in (bundle_path / 'data/projects/prj').iterdir()),
+                ['edit.mp4', 'manifest.json', 'task_counts.json'],
+            )
+            self.assertFalse((bundle_path / 'data/projects/prj.state.json').exists())
+            manifest = jsonfiles.Manifest.load(bundle_path / 'data/projects/prj')
+            self.assertEqual(list(manifest.files), ['task_counts.json'])
+            # The manifests of the synchronization are not published
+            self.assertEqual(sorted(p.name for p in bundle_path.iterdir()), ['data', 'index.html'])
+            self.assertEqual(
+                sorted(p.name for p in (bundle_path / 'data').iterdir()),
+                ['projects', 'projects.json'],
+            )
+            # Kept, for the next export
+            self.assertTrue((destination_path / 'data/projects.json').exists())
@@ -0,0 +1,70 @@
+import json
+import os
+import pathlib
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+from watchtower_pipeline import ffprobe
+
+
+def make_ffprobe(streams, format=None, nb_read_packets=None):
+    """Fake subprocess.run, answering like ffprobe."""
+    calls = []
+
+    def run(command, **kwargs):
+        calls.append(command)
+        if '-count_packets' in command:
+            stdout = f"{nb_read_packets}\n"
+        else:
+            stdout = json.dumps({'streams': streams, 'format': format or {}})
+        return subprocess.CompletedProcess(command, 0, stdout=stdout.encode())
+
+    return run, calls
+
+
+class TestGetFramesCount(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.movie = pathlib.Path(self.tmp_dir.name) / 'edit.mp4'
+        self.movie.write_bytes(b'movie')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def get_frames_count(self, streams, format=None, nb_read_packets=None):
+        run, calls = make_ffprobe(streams, format, nb_read_packets)
+        with mock.patch('subprocess.run', run):
+            return ffprobe.get_frames_count(self.movie), calls
+
+    def test_nb_frames(self):
+        frames_count, calls = self.get_frames_count([{'nb_frames': '129600'}])
+        self.assertEqual(frames_count, 129600)
+        self.assertEqual(len(calls), 1)
+        self.assertNotIn('-count_packets', calls[0])
+
+    def test_duration(self):
+        stream = {'duration': '5400.000000', 'r_frame_rate': '24/1', 'avg_frame_rate': '24/1'}
+        self.assertEqual(self.get_frames_count([stream])[0], 129600)
+        self.movie.write_bytes(b'other movie')
+        stream = {'r_frame_rate': '24000/1001', 'avg_frame_rate': '24000/1001'}
+        self.assertEqual(self.get_frames_count([stream], {'duration': '10.010000'})[0], 240)
+
+    def test_count_packets(self):
+        # Variable frame rate: the duration does not give the frame count
+        stream = {'duration': '10.0', 'r_frame_rate': '30/1', 'avg_frame_rate': '2997/100'}
+        frames_count, calls = self.get_frames_count([stream], nb_read_packets=299)
+        self.assertEqual(frames_count, 299)
+        self.assertIn('-count_packets', calls[-1])
+
+    def test_cache(self):
+        self.assertEqual(self.get_frames_count([{'nb_frames': '100'}])[0], 100)
+        frames_count, calls = self.get_frames_count([{'nb_frames': '200'}])
+        self.assertEqual(frames_count, 100)
+        self.assertEqual(calls, [])
+
+        # The movie changed
+        stat = self.movie.stat()
+        os.utime(self.movie, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        self.assertEqual(self.get_frames_count([{'nb_frames': '200'}])[0], 200)
@@ -0,0 +1,445 @@
+import json
+import pathlib
+import tempfile
+import threading
+import unittest
+from dataclasses import asdict
+from unittest import mock
+
+import requests
+
+from watchtower_pipeline import models, sessions
+from watchtower_pipeline.writers import PROJECT_DOCUMENTS
+from watchtower_pipeline.kitsu import (
+    AsyncKitsuWriter,
+    Config,
+    KitsuClient,
+    KitsuWriter,
+    ProjectExportState,
+)
+from .kitsu_stub import KitsuStub, add_auth, add_events, add_production, make_jwt
+
+
+def get_stub_client(stub: KitsuStub, **kwargs) -> KitsuClient:
+    config = Config(dotenv=None, base_url=stub.base_url, email='user@example.org', password='pw')
+    return KitsuClient(config=config, **kwargs)
+
+
+class TestKitsuClientSession(unittest.TestCase):
+    def test_connections_are_reused(self):
+        with KitsuStub() as stub:
+            stub.add_json('/api/data/user/context', {'projects': []})
+            client = get_stub_client(stub)
+            for _ in range(5):
+                self.assertEqual(client.get('/data/user/context').json(), {'projects': []})
+
+        self.assertEqual(client.jwt, 'stub-token')
+        self.assertEqual(len(stub.requests_for('/api/data/user/context')), 5)
+        self.assertEqual(
+            stub.requests[-1].headers['Authorization'],
+            'Bearer stub-token',
+        )
+        # Login has its own connection, all following requests share one keep-alive connection
+        self.assertEqual(stub.connections, 2)
+
+    def test_pool_size_is_configurable(self):
+        with KitsuStub() as stub:
+            client = get_stub_client(stub, pool_connections=2, pool_maxsize=4)
+        adapter = client.session.get_adapter(stub.base_url)
+        self.assertEqual(adapter._pool_connections, 2)
+        self.assertEqual(adapter._pool_maxsize, 4)
+
+
+class TestKitsuClientRetry(unittest.TestCase):
+    def get_client(self, stub, **kwargs):
+        client = get_stub_client(stub)
+        client.scheduler = sessions.RequestScheduler(backoff=0, **kwargs)
+        return client
+
+    def test_retry(self):
+        responses = [
+            (503, {}, b''),
+            (429, {'Retry-After': '0'}, b''),
+            (200, {'Content-Type': 'application/json'}, b'[]'),
+        ]
+        with KitsuStub() as stub:
+            stub.add_route('/api/data/shots', lambda request: responses.pop(0))
+            client = self.get_client(stub)
+            self.assertEqual(client.get('/data/shots').json(), [])
+
+        self.assertEqual(len(stub.requests_for('/api/data/shots')), 3)
+        self.assertEqual(client.scheduler.latency.retries, 2)
+        self.assertEqual(len(client.scheduler.latency.latencies), 3)
+
+    def test_errors_are_raised(self):
+        with KitsuStub() as stub:
+            stub.add_route('/api/data/shots', lambda request: (502, {}, b'Bad Gateway'))
+            client = self.get_client(stub, retries=2, failure_threshold=2)
+            for _ in range(2):
+                with self.assertRaises(requests.HTTPError):
+                    client.get('/data/shots')
+            # Each request is one failure, once its retries are exhausted
+            self.assertEqual(len(stub.requests_for('/api/data/shots')), 6)
+
+            # Too many failures: the next request is not sent
+            with self.assertRaises(sessions.CircuitOpenError):
+                client.get('/data/shots')
+            self.assertEqual(len(stub.requests_for('/api/data/shots')), 6)
+
+    def test_failing_project_does_not_open_the_circuit_of_others(self):
+        def get_shots(request):
+            if request.query['project_id'] == ['failing']:
+                return 500, {}, b'Internal Server Error'
+            return 200, {'Content-Type': 'application/json'}, b'[]'
+
+        with KitsuStub() as stub:
+            stub.add_route('/api/data/shots/with-tasks', get_shots)
+            client = self.get_client(stub)
+            for _ in range(client.scheduler.failure_threshold):
+                with self.assertRaises(requests.HTTPError):
+                    client.get('/data/shots/with-tasks', params={'project_id': 'failing'})
+                client.get('/data/shots/with-tasks', params={'project_id': 'prj'})
+            with self.assertRaises(sessions.CircuitOpenError):
+                client.get('/data/shots/with-tasks', params={'project_id': 'failing'})
+            # The other project is still exported
+            self.assertEqual(
+                client.get('/data/shots/with-tasks', params={'project_id': 'prj'}).json(), []
+            )
+
+    def test_client_errors_are_not_retried(self):
+        with KitsuStub() as stub:
+            stub.add_route('/api/data/shots', lambda request: (404, {}, b''))
+            client = self.get_client(stub)
+            with self.assertRaises(requests.HTTPError):
+                client.get('/data/shots')
+        self.assertEqual(len(stub.requests_for('/api/data/shots')), 1)
+
+
+class TestKitsuClientAuth(unittest.TestCase):
+    def test_refresh_before_expiry(self):
+        with KitsuStub() as stub:
+            tokens = add_auth(stub, '/api/data/shots', lifetime=3600, age=3400)
+            client = get_stub_client(stub)
+            # Expires in less than refresh_margin
+            self.assertEqual(client.get('/data/shots').json(), [])
+
+        self.assertEqual(len(tokens), 2)
+        self.assertEqual(client.jwt, tokens[-1])
+        self.assertEqual(len(stub.requests_for('/api/auth/refresh-token')), 1)
+        self.assertEqual(len(stub.requests_for('/api/data/shots')), 1)
+
+    def test_short_lived_tokens(self):
+        with KitsuStub() as stub:
+            # Shorter-lived than refresh_margin: refreshed half-way through their lifetime
+            tokens = add_auth(stub, '/api/data/shots', lifetime=60)
+            client = get_stub_client(stub)
+            for _ in range(3):
+                self.assertEqual(client.get('/data/shots').json(), [])
+            self.assertEqual(len(stub.requests_for('/api/auth/refresh-token')), 0)
+
+            tokens = add_auth(stub, '/api/data/shots', lifetime=60, age=40)
+            client = get_stub_client(stub)
+            self.assertEqual(client.get('/data/shots').json(), [])
+
+        self.assertEqual(len(tokens), 2)
+        self.assertEqual(len(stub.requests_for('/api/auth/refresh-token')), 1)
+
+    def test_refresh_with_one_request_in_flight(self):
+        results = []
+
+        def get_shots(client):
+            results.append(client.get('/data/shots').json())
+            # Rejected with a 401 while the request holds the only slot
+            tokens.append('revoked')
+            results.append(client.get('/data/shots').json())
+
+        with KitsuStub() as stub:
+            tokens = add_auth(stub, '/api/data/shots')
+            client = get_stub_client(stub, max_in_flight=1)
+            # About to expire, refreshed by the first request while it holds the only slot
+            tokens.append(make_jwt('access-old', lifetime=3600, age=3400))
+            client.jwt = tokens[-1]
+            # In a daemon thread, which is abandoned if it blocks
+            thread = threading.Thread(target=get_shots, args=(client,), daemon=True)
+            thread.start()
+            thread.join(timeout=10)
+            self.assertFalse(thread.is_alive(), "The token refresh waited for a free slot")
+
+        self.assertEqual(results, [[], []])
+        self.assertEqual(len(stub.requests_for('/api/auth/refresh-token')), 2)
+
+    def test_retry_after_401(self):
+        with KitsuStub() as stub:
+            tokens = add_auth(stub, '/api/data/shots')
+            client = get_stub_client(stub)
+            # The token is revoked, or expired earlier than announced
+            tokens.append('revoked')
+            self.assertEqual(client.get('/data/shots').json(), [])
+            # Thumbnails downloaded through the session use the new token
+            self.assertEqual(client.session.get(f"{stub.base_url}/data/shots").json(), [])
+
+            # The refresh token is rejected too: log in again
+            stub.add_route('/api/auth/refresh-token', lambda request: (401, {}, b''))
+            tokens.append('revoked')
+            self.assertEqual(client.get('/data/shots').json(), [])
+
+        self.assertEqual(len(stub.requests_for('/api/auth/login')), 2)
+        self.assertEqual(len(stub.requests_for('/api/data/shots')), 5)
+
+
+class TestKitsuResponseCache(unittest.TestCase):
+    def test_shots_are_fetched_once(self):
+        with KitsuStub() as stub:
+            add_production(stub)
+            writer = KitsuWriter(kitsu_client=get_stub_client(stub))
+            project = writer.get_project('prj')
+            shots = writer.get_project_shots(project)
+            task_count = writer.get_task_count(project.id)
+            self.assertEqual(writer.kitsu_client.cache_stats.hits, 1)
+            # Once cleared, project responses are fetched again, but not the user context
+            writer.kitsu_client.clear_cache('prj')
+            writer.get_task_count(project.id)
+            writer.get_project_list()
+
+        self.assertEqual([s.id for s in shots], ['sh1', 'sh2'])
+        self.assertEqual(len(task_count), 3)
+        self.assertEqual(len(stub.requests_for('/api/data/shots/with-tasks')), 2)
+        self.assertEqual(len(stub.requests_for('/api/data/user/context')), 1)
+        self.assertEqual(len(stub.requests_for('/api/data/projects/prj/episodes')), 2)
+        self.assertEqual(writer.kitsu_client.cache_stats.hits, 1)
+
+    def test_clear_cache_of_one_project(self):
+        cached_requests = [
+            ('/data/projects/prj/episodes', None, None),
+            ('/data/edits/edit/preview-files', None, 'prj'),
+            # Its id contains the id of the other project
+            ('/data/projects/prj2/episodes', None, None),
+            ('/data/sequences?project_id=prj2&episode_id=ep1', None, None),
+            ('/data/shots/with-tasks', {'project_id': 'prj2'}, None),
+        ]
+        with KitsuStub() as stub:
+            for path, _, _ in cached_requests:
+                stub.add_json(f"/api{path.partition('?')[0]}", [])
+            client = get_stub_client(stub)
+            for _ in range(2):
+                for path, params, project_id in cached_requests:
+                    client.get_json(path, params=params, project_id=project_id)
+                client.clear_cache('prj')
+
+        self.assertEqual(len(stub.requests_for('/api/data/projects/prj/episodes')), 2)
+        self.assertEqual(len(stub.requests_for('/api/data/edits/edit/preview-files')), 2)
+        self.assertEqual(len(stub.requests_for('/api/data/projects/prj2/episodes')), 1)
+        self.assertEqual(len(stub.requests_for('/api/data/sequences')), 1)
+        self.assertEqual(len(stub.requests_for('/api/data/shots/with-tasks')), 1)
+
+
+class TestKitsuFanOut(unittest.TestCase):
+    def get_project_data(self, stub, fanout_workers):
+        writer = KitsuWriter(kitsu_client=get_stub_client(stub))
+        writer.fanout_workers = fanout_workers
+        project = writer.get_project('prj')
+        sequences = writer.get_project_sequences(project)
+        shots = writer.get_project_shots(project)
+        assets = writer.get_project_assets(project)
+        return (
+            [asdict(e) for e in project.episodes],
+            [asdict(p) for p in writer.get_project_list()],
+            [c.to_dict() for c in writer.get_project_casting(project, sequences, shots, assets)],
+            [e.to_dict() for e in writer.get_project_edits(project)],
+        )
+
+    def test_concurrent_output_matches_serial(self):
+        with KitsuStub() as stub:
+            add_production(stub)
+            serial = self.get_project_data(stub, fanout_workers=1)
+            concurrent = self.get_project_data(stub, fanout_workers=4)
+
+        self.assertEqual(serial, concurrent)
+        episodes, project_list, casting, edits = concurrent
+        self.assertEqual([e['id'] for e in episodes], ['ep1', 'ep2'])
+        self.assertEqual([s['id'] for s in episodes[1]['sequences']], ['seq2'])
+        self.assertEqual(
+            casting,
+            [
+                {'shot_id': 'sh1', 'asset_ids': ['as1', 'as2']},
+                {'shot_id': 'sh2', 'asset_ids': ['as2']},
+            ],
+        )
+        self.assertEqual(edits[0]['frameOffset'], 101)
+
+
+class TestKitsuWriterProject(unittest.TestCase):
+    def test_get_project_filters_context(self):
+        with KitsuStub() as stub:
+            add_production(stub)
+            writer = KitsuWriter(kitsu_client=get_stub_client(stub))
+            project = writer.get_project('prj')
+
+        self.assertEqual([a.id for a in project.asset_types], ['at-char'])
+        # Sorted by priority
+        self.assertEqual([t.id for t in project.task_types], ['tt-model', 'tt-anim'])
+        self.assertEqual([t.id for t in project.task_statuses], ['ts-todo', 'ts-done'])
+        # In the order of the context
+        self.assertEqual([u.id for u in project.team], ['p1', 'p2'])
+        self.assertEqual(
+            writer.user_context_index.get_persons(['p3', 'p1', 'unknown']),
+            [
+                {'id': 'p1', 'full_name': 'Person One'},
+                {'id': 'p3', 'full_name': 'Not In Team'},
+            ],
+        )
+
+    def test_compact_models(self):
+        with KitsuStub() as stub:
+            add_production(stub)
+            writer = KitsuWriter(kitsu_client=get_stub_client(stub))
+            project = writer.get_project('prj')
+            shots = writer.get_project_shots(project)
+            assets = writer.get_project_assets(project)
+            writer.compact_models = True
+            compact_shots = writer.get_project_shots(project)
+            compact_assets = writer.get_project_assets(project)
+
+        self.assertIsInstance(compact_shots[0], models.CompactShot)
+        self.assertIsInstance(compact_assets[0].tasks[0], models.CompactTask)
+        self.assertEqual([s.to_dict() for s in compact_shots], [s.to_dict() for s in shots])
+        self.assertEqual([a.to_dict() for a in compact_assets], [a.to_dict() for a in assets])
+        # Tasks keep their Kitsu id
+        self.assertEqual([t.id for t in shots[0].tasks], ['t1', 't2'])
+
+    def test_count_asset_tasks(self):
+        with KitsuStub() as stub:
+            add_production(stub)
+            writer = KitsuWriter(kitsu_client=get_stub_client(stub))
+            shot_counts = writer.get_task_count('prj')
+            writer.count_asset_tasks = True
+            counts = writer.get_task_count('prj')
+
+        def summarize(task_counts):
+            return [
+                (
+                    c['task_type_id'],
+                    c['episode_id'],
+                    [(s['task_status_id'], s['data'][0]['count']) for s in c['task_statuses']],
+                )
+                for c in task_counts
+            ]
+
+        self.assertEqual(
+            summarize(counts),
+            summarize(shot_counts) + [('tt-model', None, [('ts-done', 1), ('ts-wip', 1)])],
+        )
+
+
+@mock.patch('watchtower_pipeline.ffprobe.get_frames_count', return_value=100)
+class TestKitsuIncrementalExport(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.destination_path = pathlib.Path(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_get_stale_documents(self, get_frames_count):
+        writer = KitsuWriter.__new__(KitsuWriter)
+        events = [
+            {'name': 'task:status-changed'},
+            {'name': 'shot:casting-update'},
+            {'name': 'notification:new'},
+        ]
+        self.assertEqual(
+            writer.get_stale_documents(events), {'shots', 'assets', 'task_counts', 'casting'}
+        )
+        self.assertIsNone(writer.get_stale_documents([{'name': 'unknown:new'}]))
+        writer.events_limit = 3
+        self.assertIsNone(writer.get_stale_documents(events))
+
+    def test_incremental_export(self, get_frames_count):
+        events = [{'name': 'project:update', 'created_at': '2024-01-01T10:00:00'}]
+        with KitsuStub() as stub:
+            add_production(stub)
+            add_events(stub, events)
+            writer = KitsuWriter(kitsu_client=get_stub_client(stub))
+            writer.incremental = True
+
+            # Nothing exported yet, everything is written
+            writer.write_project('prj', self.destination_path)
+            self.assertEqual(len(stub.requests_for('/api/data/shots/with-tasks')), 1)
+            state = ProjectExportState.load(self.destination_path, 'prj')
+            self.assertEqual(state.last_event_at, '2024-01-01T10:00:00')
+            task_counts_path = self.destination_path / 'data/projects/prj/task_counts.json'
+            first_snapshot = json.loads(task_counts_path.read_text())[0]['task_statuses'][0]
+
+            # No changes: only the events and the project are queried
+            request_count = len(stub.requests)
+            writer.write_project('prj', self.destination_path)
+            self.assertEqual(
+                [r.path for r in stub.requests[request_count:]],
+                [
+                    '/api/data/events/last',
+                    '/api/data/projects/prj/episodes',
+                    '/api/data/sequences',
+                    '/api/data/sequences',
+                ],
+            )
+            # Task counts are not counted again, but extended to this export
+            snapshot = json.loads(task_counts_path.read_text())[0]['task_statuses'][0]
+            self.assertEqual(snapshot['data'][0]['count'], first_snapshot['data'][0]['count'])
+            self.assertGreater(
+                snapshot['data'][0]['timestamp'], first_snapshot['data'][0]['timestamp']
+            )
+
+            # Task changes: shots, assets and task counts are exported again
+            events.append({'name': 'task:update', 'created_at': '2024-01-01T11:00:00'})
+            casting_path = self.destination_path / 'data/projects/prj/casting.json'
+            casting_path.unlink()
+            casting_path.touch()
+            writer.write_project('prj', self.destination_path)
+
+        self.assertEqual(len(stub.requests_for('/api/data/shots/with-tasks')), 2)
+        self.assertEqual(len(stub.requests_for('/api/data/projects/prj/sequences/seq1/casting')), 1)
+        self.assertEqual(casting_path.read_text(), '')
+        # Counted again. Both counts are in the same hour, so only the latest one is kept.
+        snapshot = json.loads(task_counts_path.read_text())[0]['task_statuses'][0]
+        self.assertEqual(len(snapshot['data']), 1)
+        self.assertGreater(snapshot['data'][0]['timestamp'], first_snapshot['data'][0]['timestamp'])
+        state = ProjectExportState.load(self.destination_path, 'prj')
+        self.assertEqual(state.last_event_at, '2024-01-01T11:00:00')
+
+
+@mock.patch('watchtower_pipeline.ffprobe.get_frames_count', return_value=100)
+class TestAsyncKitsuWriter(unittest.TestCase):
+    def test_output_matches_kitsu_writer(self, get_frames_count):
+        with tempfile.TemporaryDirectory() as tmp_dir, KitsuStub() as stub:
+            add_production(stub)
+            for writer_class in (KitsuWriter, AsyncKitsuWriter):
+                writer = writer_class(kitsu_client=get_stub_client(stub))
+                writer.write_project('prj', pathlib.Path(tmp_dir) / writer_class.__name__)
+
+            def read_documents(writer_class):
+                project_path = pathlib.Path(tmp_dir) / writer_class.__name__ / 'data/projects/prj'
+                documents = {
+                    path.name: json.loads(path.read_text())
+                    for path in project_path.glob('*.json')
+                    # Task counts are timestamped
+                    if path.stem in PROJECT_DOCUMENTS and path.stem != 'task_counts'
+                }
+                previews = sorted(p.name for p in (project_path / 'previews').iterdir())
+                return documents, previews
+
+            documents, previews = read_documents(AsyncKitsuWriter)
+            self.assertEqual((documents, previews), read_documents(KitsuWriter))
+
+        self.assertEqual(
+            sorted(documents),
+            [
+                'assets.json',
+                'casting.json',
+                'edits.json',
+                'project.json',
+                'sequences.json',
+                'shots.json',
+            ],
+        )
+        self.assertEqual(documents['edits.json'][0]['totalFrames'], 100)
+        self.assertTrue(previews)
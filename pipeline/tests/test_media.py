@@ -0,0 +1,194 @@
+import hashlib
+import pathlib
+import tempfile
+import threading
+import unittest
+
+import requests
+
+from watchtower_pipeline import media, models, sessions
+from .kitsu_stub import KitsuStub
+
+
+def make_shot(name, thumbnail_url):
+    return models.Shot(
+        name=name,
+        sequence_id='seq',
+        data=models.ShotData(frame_in=0, frame_out=24),
+        thumbnailUrl=thumbnail_url,
+    )
+
+
+class TestMediaDownloader(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.base_path = pathlib.Path(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_download_thumbnails(self):
+        attempts = []
+
+        def flaky(request):
+            attempts.append(request)
+            if len(attempts) == 1:
+                return 503, {}, b''
+            return 200, {}, b'flaky'
+
+        with KitsuStub() as stub:
+            stub.add_bytes('/api/a.png', b'a')
+            stub.add_route('/api/flaky.png', flaky)
+            shots = [
+                make_shot('a', f"{stub.base_url}/a.png"),
+                make_shot('same-as-a', f"{stub.base_url}/a.png"),
+                make_shot('flaky', f"{stub.base_url}/flaky.png"),
+                make_shot('missing', f"{stub.base_url}/missing.png"),
+                make_shot('no-thumbnail', None),
+            ]
+            expected_paths = [s.get_thumbnail_destination(pathlib.Path('p')) for s in shots]
+            downloader = media.MediaDownloader(workers=4, backoff=0.01)
+            failed = downloader.download_thumbnails(
+                shots, self.base_path, pathlib.Path('p'), display_progress=False
+            )
+
+        self.assertEqual([job.src_url for job in failed], [f"{stub.base_url}/missing.png"])
+        # Shared thumbnails are downloaded once
+        self.assertEqual(len(stub.requests_for('/api/a.png')), 1)
+        self.assertEqual(len(attempts), 2)
+        for shot, expected_path in zip(shots[:4], expected_paths):
+            self.assertEqual(shot.thumbnailUrl, str(expected_path))
+        self.assertEqual((self.base_path / shots[2].thumbnailUrl).read_bytes(), b'flaky')
+        # Failed downloads point to the local path too: the site cannot load the remote
+        # url, which requires authentication
+        self.assertFalse((self.base_path / shots[3].thumbnailUrl).exists())
+        self.assertIsNone(shots[4].thumbnailUrl)
+
+    def test_failed_downloads_release_connections(self):
+        # Requests wait for a free connection, rather than opening more
+        session = sessions.BoundedSession(pool_connections=1, pool_maxsize=2)
+        results = []
+
+        def download_all(base_url):
+            for i in range(5):
+                with self.assertRaises(requests.HTTPError):
+                    media.fetch_and_save_media(
+                        f"{base_url}/missing-{i}.png",
+                        None,
+                        self.base_path / 'x.png',
+                        session=session,
+                    )
+            dst = self.base_path / 'a.png'
+            results.append(
+                media.fetch_and_save_media(f"{base_url}/a.png", None, dst, session=session)
+            )
+
+        with KitsuStub() as stub:
+            stub.add_bytes('/api/a.png', b'a')
+            # In a daemon thread, which is abandoned if it blocks
+            download = threading.Thread(target=download_all, args=(stub.base_url,), daemon=True)
+            download.start()
+            download.join(timeout=10)
+
+        self.assertFalse(download.is_alive(), "Downloads blocked waiting for a connection")
+        self.assertEqual(results, [True])
+
+    def test_streamed_downloads_count_as_in_flight(self):
+        session = sessions.BoundedSession(max_in_flight=1)
+        with KitsuStub() as stub:
+            stub.add_bytes('/api/a.png', b'a')
+            url = f"{stub.base_url}/a.png"
+            streamed = session.get(url, stream=True)
+            # In a daemon thread, which is abandoned if it blocks
+            request = threading.Thread(target=session.get, args=(url,), daemon=True)
+            request.start()
+            request.join(timeout=0.5)
+            self.assertTrue(request.is_alive(), "The body of the first response is not read yet")
+
+            dst = self.base_path / 'a.png'
+            with streamed:
+                dst.write_bytes(streamed.content)
+            request.join(timeout=5)
+            self.assertFalse(request.is_alive())
+            # Closed again: the slot is only released once
+            streamed.close()
+            self.assertTrue(media.fetch_and_save_media(url, None, dst, session=session, force=True))
+
+
+class TestFetchAndSaveMedia(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dst = pathlib.Path(self.tmp_dir.name) / 'edit.mp4'
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_revalidate(self):
+        upstream = {'etag': '"v1"', 'body': b'version 1'}
+
+        def conditional(request):
+            if request.headers.get('If-None-Match') == upstream['etag']:
+                return 304, {'ETag': upstream['etag']}, b''
+            return 200, {'ETag': upstream['etag']}, upstream['body']
+
+        with KitsuStub() as stub:
+            stub.add_route('/api/edit.mp4', conditional)
+            url = f"{stub.base_url}/edit.mp4"
+            self.assertTrue(media.fetch_and_save_media(url, None, self.dst))
+            # Without revalidation the existing file is kept without any request
+            self.assertFalse(media.fetch_and_save_media(url, None, self.dst))
+            self.assertEqual(len(stub.requests), 1)
+            # Unchanged upstream: a single 304 round trip
+            self.assertFalse(media.fetch_and_save_media(url, None, self.dst, revalidate=True))
+            self.assertEqual(len(stub.requests), 2)
+            self.assertEqual(stub.requests[-1].headers['If-None-Match'], '"v1"')
+            # Changed upstream: the file is replaced
+            upstream.update(etag='"v2"', body=b'version 2')
+            self.assertTrue(media.fetch_and_save_media(url, None, self.dst, revalidate=True))
+
+        self.assertEqual(self.dst.read_bytes(), b'version 2')
+        self.assertEqual(media.MediaCacheEntry.load(self.dst).etag, '"v2"')
+        self.assertEqual(
+            sorted(p.name for p in self.dst.parent.iterdir()), ['edit.mp4', 'edit.mp4.meta.json']
+        )
+
+    def test_resume_interrupted_download(self):
+        body = b'0123456789'
+
+        def interrupted_then_range(request):
+            headers = {'ETag': '"v1"'}
+            if 'Range' not in request.headers:
+                # Announce the full size, but send only the first 4 bytes
+                return 200, {**headers, 'Content-Length': str(len(body))}, body[:4]
+            start = int(request.headers['Range'].split('=')[1].rstrip('-'))
+            self.assertEqual(request.headers['If-Range'], '"v1"')
+            headers['Content-Range'] = f"bytes {start}-{len(body) - 1}/{len(body)}"
+            return 206, headers, body[start:]
+
+        with KitsuStub() as stub:
+            stub.add_route('/api/edit.mp4', interrupted_then_range)
+            url = f"{stub.base_url}/edit.mp4"
+            with self.assertRaises(requests.RequestException):
+                # Small chunks, so that the bytes received before the interruption are kept
+                media.fetch_and_save_media(url, None, self.dst, chunk_size=1)
+            # Nothing is published, the partial download is kept for resuming
+            self.assertFalse(self.dst.exists())
+            self.assertEqual(self.dst.with_name('edit.mp4.part').read_bytes(), body[:4])
+
+            checksum = f"sha256:{hashlib.sha256(body).hexdigest()}"
+            self.assertTrue(media.fetch_and_save_media(url, None, self.dst, checksum=checksum))
+
+        self.assertEqual(stub.requests[-1].headers['Range'], 'bytes=4-')
+        self.assertEqual(self.dst.read_bytes(), body)
+        self.assertEqual(
+            sorted(p.name for p in self.dst.parent.iterdir()), ['edit.mp4', 'edit.mp4.meta.json']
+        )
+
+    def test_checksum_mismatch(self):
+        with KitsuStub() as stub:
+            stub.add_bytes('/api/edit.mp4', b'corrupt')
+            with self.assertRaises(media.DownloadError):
+                media.fetch_and_save_media(
+                    f"{stub.base_url}/edit.mp4", None, self.dst, checksum='md5:0000'
+                )
+        self.assertEqual(list(self.dst.parent.iterdir()), [])
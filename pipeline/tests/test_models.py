@@ -0,0 +1,79 @@
+import json
+import unittest
+from dataclasses import asdict
+
+from watchtower_pipeline import models
+
+
+def make_task(task_id=None):
+    return models.Task(task_status_id='ts', task_type_id='tt', assignees=['p1', 'p2'], id=task_id)
+
+
+class TestToDict(unittest.TestCase):
+    def assertSameAsAsdict(self, entity):
+        # Compared as JSON, to also check the order of keys
+        self.assertEqual(json.dumps(entity.to_dict()), json.dumps(asdict(entity)))
+
+    def test_entities(self):
+        shot = models.Shot(
+            name='SH010',
+            sequence_id='seq',
+            data=models.ShotData(frame_in='1', frame_out='49', custom='value'),
+            tasks=[make_task(), make_task('t2')],
+            thumbnailUrl='data/shots/sh.png',
+        )
+        asset = models.Asset(name='Hero', asset_type_id='at', tasks=[make_task()])
+        for entity in [shot, asset, make_task(), models.Sequence(name='SQ01')]:
+            with self.subTest(entity=type(entity).__name__):
+                self.assertSameAsAsdict(entity)
+
+        # Nothing is shared with the entity
+        shot_dict = shot.to_dict()
+        self.assertIsNot(shot_dict['data'], shot.data)
+        self.assertIsNot(shot_dict['tasks'][0]['assignees'], shot.tasks[0].assignees)
+
+    def test_projects(self):
+        project = models.Project(
+            name='Project',
+            ratio='16:9',
+            resolution='1920x1080',
+            asset_types=[models.AssetType(name='Characters')],
+            task_types=[models.TaskType(name='Animation', color='#f00', for_shots=True)],
+            task_statuses=[models.TaskStatus(name='Done', color='#0f0')],
+            team=[models.User(name='Person', has_avatar=True, thumbnailUrl='p.png')],
+            episodes=[models.Episode(name='E01', sequences=[models.Sequence(name='SQ01')])],
+        )
+        project_list_item = models.ProjectListItem(
+            name='Project', episodes=[models.EpisodeListItem(name='E01')]
+        )
+        for entity in [project, project_list_item]:
+            with self.subTest(entity=type(entity).__name__):
+                self.assertSameAsAsdict(entity)
+
+
+class TestCompactModels(unittest.TestCase):
+    def test_same_output_as_dataclasses(self):
+        data = models.ShotData(frame_in='1', frame_out='49')
+        shot = models.Shot(name='SH010', sequence_id='seq', data=data, id='sh', fps=25)
+        shot.tasks.append(make_task('t1'))
+        compact_shot = models.CompactShot(
+            name='SH010', sequence_id='seq', data=data, id='sh', fps=25
+        )
+        compact_shot.tasks.append(models.CompactTask('ts', 'tt', ['p1', 'p2'], id='t1'))
+        asset = models.Asset(name='Hero', asset_type_id='at', id='as', thumbnailUrl='a.png')
+        compact_asset = models.CompactAsset(
+            name='Hero', asset_type_id='at', id='as', thumbnailUrl='a.png'
+        )
+
+        self.assertEqual(json.dumps(compact_shot.to_dict()), json.dumps(shot.to_dict()))
+        self.assertEqual(json.dumps(compact_asset.to_dict()), json.dumps(asset.to_dict()))
+        for entity in [compact_shot, compact_asset, compact_shot.tasks[0]]:
+            self.assertFalse(hasattr(entity, '__dict__'))
+
+    def test_ids_are_shared(self):
+        # Built at runtime, like strings decoded from JSON, so that they are distinct objects
+        tasks = [models.CompactTask(''.join(['t', 's']), ''.join(['t', 't']), ['p1']) for _ in '12']
+        self.assertIs(tasks[0].task_status_id, tasks[1].task_status_id)
+        self.assertIs(tasks[0].task_type_id, tasks[1].task_type_id)
+        self.assertIsNot(tasks[0].id, None)
+        self.assertNotEqual(tasks[0].id, tasks[1].id)
@@ -0,0 +1,84 @@
+import pathlib
+import struct
+import tempfile
+import unittest
+from unittest import mock
+
+from watchtower_pipeline import ffprobe, mp4
+
+
+def box(box_type: bytes, *children: bytes, large=False) -> bytes:
+    payload = b''.join(children)
+    if large:
+        return struct.pack('>I4sQ', 1, box_type, 16 + len(payload)) + payload
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def track(handler_type: bytes, stts_entries, stsz_count=None) -> bytes:
+    stts_count = sum(count for count, _ in stts_entries)
+    stts = struct.pack('>4xI', len(stts_entries)) + b''.join(
+        struct.pack('>II', count, duration) for count, duration in stts_entries
+    )
+    stsz = struct.pack('>4xII', 0, stts_count if stsz_count is None else stsz_count)
+    return box(
+        b'trak',
+        box(b'tkhd', bytes(84)),
+        box(
+            b'mdia',
+            box(b'hdlr', bytes(8), handler_type, bytes(13)),
+            box(
+                b'minf',
+                box(b'stbl', box(b'stsd', bytes(8)), box(b'stts', stts), box(b'stsz', stsz)),
+            ),
+        ),
+    )
+
+
+def movie(*tracks: bytes, mdat_size=1000, fragmented=False) -> bytes:
+    moov = [box(b'mvhd', bytes(100)), *tracks]
+    if fragmented:
+        moov.append(box(b'mvex'))
+    return b''.join(
+        [
+            box(b'ftyp', b'isom', bytes(4)),
+            box(b'mdat', bytes(mdat_size), large=True),
+            box(b'moov', *moov),
+        ]
+    )
+
+
+class TestMp4(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.movie = pathlib.Path(self.tmp_dir.name) / 'edit.mp4'
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def get_frames_count(self, content: bytes):
+        self.movie.write_bytes(content)
+        return mp4.get_frames_count(self.movie)
+
+    def test_frames_count(self):
+        audio = track(b'soun', [(5000, 1024)])
+        video = track(b'vide', [(100, 512), (29, 1024)])
+        self.assertEqual(self.get_frames_count(movie(audio, video)), 129)
+
+    def test_not_counted(self):
+        self.assertIsNone(self.get_frames_count(b''))
+        self.assertIsNone(self.get_frames_count(b'not a movie'))
+        self.assertIsNone(self.get_frames_count(movie(track(b'soun', [(10, 1024)]))))
+        video = track(b'vide', [])
+        self.assertIsNone(self.get_frames_count(movie(video, fragmented=True)))
+
+    def test_malformed(self):
+        with self.assertRaises(mp4.Mp4Error):
+            self.get_frames_count(movie(track(b'vide', [(100, 512)], stsz_count=99)))
+        with self.assertRaises(mp4.Mp4Error):
+            self.get_frames_count(movie(track(b'vide', [(100, 512)]))[:-10])
+
+    def test_ffprobe_fallback(self):
+        self.movie.write_bytes(movie(track(b'vide', [(240, 512)])))
+        with mock.patch('subprocess.run') as run:
+            self.assertEqual(ffprobe.get_frames_count(self.movie, use_cache=False), 240)
+        run.assert_not_called()
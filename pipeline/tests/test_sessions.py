@@ -0,0 +1,69 @@
+import unittest
+
+from watchtower_pipeline import sessions
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_rate(self):
+        clock = FakeClock()
+        bucket = sessions.TokenBucket(
+            requests_per_second=10, burst=5, clock=clock, sleep=clock.sleep
+        )
+        for _ in range(25):
+            bucket.acquire()
+        # A burst of 5, then one request every 0.1s
+        self.assertAlmostEqual(clock.now, 2.0)
+
+        bucket.pause(3)
+        bucket.acquire()
+        self.assertAlmostEqual(clock.now, 5.0)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_open_and_close(self):
+        clock = FakeClock()
+        breaker = sessions.CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+        breaker.record_failure()
+        breaker.check()
+        breaker.record_failure()
+        with self.assertRaises(sessions.CircuitOpenError):
+            breaker.check()
+
+        clock.sleep(10)
+        breaker.check()
+        # Half-open: only one request is let through, as a probe
+        with self.assertRaises(sessions.CircuitOpenError):
+            breaker.check()
+        # Still failing: open again right away
+        breaker.record_failure()
+        with self.assertRaises(sessions.CircuitOpenError):
+            breaker.check()
+        clock.sleep(10)
+        breaker.check()
+        breaker.record_success()
+        breaker.record_failure()
+        breaker.check()
+        self.assertEqual(breaker.trips, 1)
+
+
+class TestLatencyStats(unittest.TestCase):
+    def test_percentiles(self):
+        stats = sessions.LatencyStats()
+        self.assertIsNone(stats.percentile(50))
+        for ms in range(1, 101):
+            stats.record(ms / 1000)
+        self.assertEqual(stats.percentile(50), 0.05)
+        self.assertEqual(stats.percentile(99), 0.099)
+        self.assertEqual(stats.percentile(100), 0.1)
+        self.assertIn('p90 90ms', str(stats))
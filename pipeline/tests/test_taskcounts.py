@@ -0,0 +1,241 @@
+import json
+import pathlib
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from watchtower_pipeline import jsonfiles, taskcounts
+from watchtower_pipeline.writers import ProjectWriter
+
+
+def make_task_counts(timestamp, done, todo, episode_id='ep01'):
+    """Task counts in the format of task_counts.json."""
+    return [
+        {
+            'task_type_id': 'animation',
+            'episode_id': episode_id,
+            'task_statuses': [
+                {'task_status_id': 'done', 'data': [{'timestamp': timestamp, 'count': done}]},
+                {'task_status_id': 'todo', 'data': [{'timestamp': timestamp, 'count': todo}]},
+            ],
+        }
+    ]
+
+
+def get_data(task_counts, task_status_index=0):
+    return [
+        (d['timestamp'], d['count'])
+        for d in task_counts[0]['task_statuses'][task_status_index]['data']
+    ]
+
+
+class TestTaskCountHistory(unittest.TestCase):
+    def test_unchanged_counts_are_stored_once(self):
+        history = taskcounts.TaskCountHistory()
+        for timestamp, done in [('T01', 1), ('T02', 1), ('T03', 1), ('T04', 2), ('T05', 3)]:
+            history.add_task_counts(make_task_counts(f"2024-01-01{timestamp}:00:00", done, 5))
+
+        series = history.to_dict()['series']
+        self.assertEqual(
+            series[0]['runs'],
+            [
+                ['2024-01-01T01:00:00', '2024-01-01T03:00:00', 1],
+                ['2024-01-01T04:00:00', 2],
+                ['2024-01-01T05:00:00', 3],
+            ],
+        )
+        self.assertEqual(series[1]['runs'], [['2024-01-01T01:00:00', '2024-01-01T05:00:00', 5]])
+        # The first and last snapshot of each run are kept, so that charts do not change
+        self.assertEqual(
+            get_data(history.to_task_counts()),
+            [
+                ('2024-01-01T01:00:00', 1),
+                ('2024-01-01T03:00:00', 1),
+                ('2024-01-01T04:00:00', 2),
+                ('2024-01-01T05:00:00', 3),
+            ],
+        )
+        restored = taskcounts.TaskCountHistory.from_dict(json.loads(json.dumps(history.to_dict())))
+        self.assertEqual(restored, history)
+
+    def test_compact(self):
+        history = taskcounts.TaskCountHistory()
+        now = datetime(2024, 6, 30, 12)
+        # Hourly snapshots over 200 days, with a count changing every hour
+        for hours in reversed(range(200 * 24)):
+            timestamp = (now - timedelta(hours=hours)).isoformat()
+            history.add_task_counts(make_task_counts(timestamp, hours, 5))
+
+        history.compact(taskcounts.RetentionPolicy(hourly=timedelta(days=2), daily=timedelta(30)))
+        data = get_data(history.to_task_counts())
+        timestamps = [datetime.fromisoformat(t) for t, _ in data]
+        hourly = [t for t in timestamps if now - t < timedelta(days=2)]
+        daily = [t for t in timestamps if timedelta(days=2) <= now - t < timedelta(days=30)]
+        weekly = [t for t in timestamps if now - t >= timedelta(days=30)]
+        self.assertEqual(len(hourly), 48)
+        self.assertIn(len(daily), [28, 29])
+        self.assertIn(len(weekly), [25, 26])
+        self.assertEqual(timestamps, sorted(timestamps))
+        self.assertEqual(timestamps[-1], now)
+        # Constant counts are a single run, whatever the resolution
+        self.assertEqual(len(get_data(history.to_task_counts(), task_status_index=1)), 2)
+
+        # Compacting again changes nothing
+        compacted = history.to_dict()
+        history.compact(taskcounts.RetentionPolicy(hourly=timedelta(days=2), daily=timedelta(30)))
+        self.assertEqual(history.to_dict(), compacted)
+
+
+class TestTaskCountLog(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.log = taskcounts.TaskCountLog(pathlib.Path(self.tmp_dir.name) / 'log.jsonl')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_read_from_offset(self):
+        self.assertEqual(self.log.read(), ([], 0))
+        self.log.append(make_task_counts('2024-01-01T10:00:00', 1, 5))
+        entries, offset = self.log.read()
+        self.assertEqual(
+            entries,
+            [
+                {
+                    'timestamp': '2024-01-01T10:00:00',
+                    'counts': [['animation', 'ep01', 'done', 1], ['animation', 'ep01', 'todo', 5]],
+                }
+            ],
+        )
+
+        self.log.append(make_task_counts('2024-01-01T11:00:00', 2, 4))
+        entries, new_offset = self.log.read(offset)
+        self.assertEqual([e['timestamp'] for e in entries], ['2024-01-01T11:00:00'])
+        self.assertEqual(new_offset, self.log.path.stat().st_size)
+
+    def test_interrupted_append(self):
+        self.log.append(make_task_counts('2024-01-01T10:00:00', 1, 5))
+        with open(self.log.path, 'ab') as f:
+            f.write(b'{"timestamp":"2024-01-01T11:00:00","cou')
+        # The partial line is not read, until it is complete
+        entries, offset = self.log.read()
+        self.assertEqual(len(entries), 1)
+
+        self.log.append(make_task_counts('2024-01-01T12:00:00', 3, 3))
+        with self.assertLogs(level='WARNING'):
+            entries, _ = self.log.read(offset)
+        self.assertEqual([e['timestamp'] for e in entries], ['2024-01-01T12:00:00'])
+
+
+class TestMergeTaskCounts(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.destination_path = pathlib.Path(self.tmp_dir.name)
+        self.project_path = self.destination_path / 'data/projects/prj'
+        self.project_path.mkdir(parents=True)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def get_project_writer(self, json_format=jsonfiles.JsonFormat()):
+        project = type('Project', (), {'id': 'prj'})()
+        return ProjectWriter(
+            project, [], [], [], [], [], self.destination_path, json_format=json_format
+        )
+
+    def test_migration(self):
+        # task_counts.json as written before there was a history: one entry per export
+        existing = make_task_counts('2024-01-01T10:00:00', 1, 5)
+        for hour in range(11, 14):
+            snapshot = make_task_counts(f"2024-01-01T{hour}:00:00", 1, 5)
+            for status, new_status in zip(
+                existing[0]['task_statuses'], snapshot[0]['task_statuses']
+            ):
+                status['data'].extend(new_status['data'])
+        (self.project_path / 'task_counts.json').write_text(json.dumps(existing))
+
+        project_writer = self.get_project_writer()
+        project_writer.merge_task_counts(make_task_counts('2024-01-01T14:00:00', 2, 4, 'ep02'))
+        project_writer.write_as_json(['task_counts'])
+
+        task_counts = json.loads((self.project_path / 'task_counts.json').read_text())
+        self.assertEqual([c['episode_id'] for c in task_counts], ['ep01', 'ep02'])
+        self.assertEqual(
+            get_data(task_counts), [('2024-01-01T10:00:00', 1), ('2024-01-01T13:00:00', 1)]
+        )
+        history = json.loads((self.project_path / 'task_counts.history.json').read_text())
+        self.assertEqual(history['version'], taskcounts.HISTORY_VERSION)
+        self.assertEqual(len(history['series']), 4)
+
+    def test_interrupted_export(self):
+        project_writer = self.get_project_writer()
+        project_writer.merge_task_counts(make_task_counts('2024-01-01T10:00:00', 1, 5))
+        project_writer.write_as_json(['task_counts'])
+        # Counted and logged, but interrupted before the history was saved
+        log = taskcounts.TaskCountLog(self.project_path / taskcounts.LOG_NAME)
+        log.append(make_task_counts('2024-01-01T11:00:00', 2, 4))
+
+        project_writer = self.get_project_writer()
+        project_writer.merge_task_counts(make_task_counts('2024-01-01T12:00:00', 3, 3))
+        project_writer.write_as_json(['task_counts'])
+        task_counts = json.loads((self.project_path / 'task_counts.json').read_text())
+        self.assertEqual(
+            get_data(task_counts),
+            [('2024-01-01T10:00:00', 1), ('2024-01-01T11:00:00', 2), ('2024-01-01T12:00:00', 3)],
+        )
+        history = json.loads((self.project_path / 'task_counts.history.json').read_text())
+        log_path = self.project_path / taskcounts.LOG_NAME
+        self.assertEqual(history['log_offset'], log_path.stat().st_size)
+
+    def test_log_is_rotated(self):
+        log_path = self.project_path / taskcounts.LOG_NAME
+        log_sizes = []
+        for hour in range(10, 15):
+            project_writer = self.get_project_writer()
+            project_writer.merge_task_counts(make_task_counts(f"2024-01-01T{hour}:00:00", hour, 5))
+            log_sizes.append(log_path.stat().st_size)
+        # Emptied once the snapshots are in the history
+        self.assertEqual(len(set(log_sizes)), 1)
+        self.assertEqual(taskcounts.TaskCountLog(log_path).read(), ([], log_sizes[0]))
+        self.assertEqual(len(get_data(project_writer.task_counts)), 5)
+
+        # Saved with the offset of the previous log, which was rotated before the history
+        # was saved again: the snapshots of the new log are read from its start
+        log = taskcounts.TaskCountLog(log_path)
+        log.rotate()
+        log.append(make_task_counts('2024-01-01T15:00:00', 15, 5))
+        history = taskcounts.TaskCountHistory.load(self.project_path)
+        history.log_offset = log_path.stat().st_size
+        history.save(self.project_path)
+        log.append(make_task_counts('2024-01-01T16:00:00', 16, 5))
+        project_writer.merge_task_counts(make_task_counts('2024-01-01T17:00:00', 17, 5))
+        self.assertEqual(
+            [count for _, count in get_data(project_writer.task_counts)][-4:], [14, 15, 16, 17]
+        )
+
+    def test_unchanged_counts(self):
+        earlier = (datetime.now() - timedelta(hours=3)).replace(microsecond=0).isoformat()
+        project_writer = self.get_project_writer()
+        project_writer.merge_task_counts(make_task_counts(earlier, 1, 5))
+        project_writer.write_as_json(['task_counts'])
+
+        # Not counted again: the latest counts are extended to this export
+        project_writer = self.get_project_writer()
+        project_writer.merge_task_counts(None)
+        project_writer.write_as_json(['task_counts'])
+        task_counts = json.loads((self.project_path / 'task_counts.json').read_text())
+        data = get_data(task_counts)
+        self.assertEqual([count for _, count in data], [1, 1])
+        self.assertEqual(data[0][0], earlier)
+        self.assertGreater(data[1][0], earlier)
+
+    def test_history_is_not_published(self):
+        project_writer = self.get_project_writer(jsonfiles.JsonFormat(encodings=('gzip',)))
+        project_writer.merge_task_counts(make_task_counts('2024-01-01T10:00:00', 1, 5))
+        project_writer.write_as_json(['task_counts'])
+
+        history_path = self.project_path / f"{taskcounts.HISTORY_NAME}.json"
+        self.assertTrue(history_path.exists())
+        self.assertFalse(history_path.with_name(history_path.name + '.gz').exists())
+        manifest = jsonfiles.Manifest.load(self.project_path)
+        self.assertEqual(sorted(manifest.files), ['task_counts.json', 'task_counts.json.gz'])
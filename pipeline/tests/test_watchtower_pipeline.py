@@ -20,135 +20,6 @@ def test_fetch_tasks():
     print(writer.get_project_list())
 
 
-class TestMergeTaskCountDicts(unittest.TestCase):
-    def test_merge_task_count_dicts(self):
-        initial = [
-            {
-                'task_type_id': 'animation',
-                'episode_id': 'ep01',
-                'task_statuses': [
-                    {
-                        'task_status_id': 'done',
-                        'data': [
-                            {'timestamp': '2020-02-01', 'count': 10},
-                            {'timestamp': '2020-02-02', 'count': 15},
-                        ],
-                    },
-                    {
-                        'task_status_id': 'todo',
-                        'data': [
-                            {'timestamp': '2020-02-01', 'count': 10},
-                            {'timestamp': '2020-02-02', 'count': 5},
-                        ],
-                    },
-                ],
-            }
-        ]
-
-        update = [
-            {
-                'task_type_id': 'animation',
-                'episode_id': 'ep01',
-                'task_statuses': [
-                    {
-                        'task_status_id': 'done',
-                        'data': [
-                            {'timestamp': '2020-02-03', 'count': 17},
-                        ],
-                    },
-                    {
-                        'task_status_id': 'todo',
-                        'data': [{'timestamp': '2020-02-03', 'count': 2}],
-                    },
-                    {
-                        'task_status_id': 'in_progress',
-                        'data': [{'timestamp': '2020-02-03', 'count': 1}],
-                    },
-                ],
-            },
-            {
-                'task_type_id': 'lighting',
-                'episode_id': 'ep01',
-                'task_statuses': [
-                    {
-                        'task_status_id': 'done',
-                        'data': [
-                            {'timestamp': '2020-02-03', 'count': 10},
-                        ],
-                    }
-                ],
-            },
-            {
-                'task_type_id': 'lighting',
-                'episode_id': 'ep02',
-                'task_statuses': [
-                    {
-                        'task_status_id': 'done',
-                        'data': [
-                            {'timestamp': '2020-02-03', 'count': 10},
-                        ],
-                    }
-                ],
-            },
-        ]
-
-        expected_result = [
-            {
-                'task_type_id': 'animation',
-                'episode_id': 'ep01',
-                'task_statuses': [
-                    {
-                        'task_status_id': 'done',
-                        'data': [
-                            {'timestamp': '2020-02-01', 'count': 10},
-                            {'timestamp': '2020-02-02', 'count': 15},
-                            {'timestamp': '2020-02-03', 'count': 17},
-                        ],
-                    },
-                    {
-                        'task_status_id': 'todo',
-                        'data': [
-                            {'timestamp': '2020-02-01', 'count': 10},
-                            {'timestamp': '2020-02-02', 'count': 5},
-                            {'timestamp': '2020-02-03', 'count': 2},
-                        ],
-                    },
-                    {
-                        'task_status_id': 'in_progress',
-                        'data': [{'timestamp': '2020-02-03', 'count': 1}],
-                    },
-                ],
-            },
-            {
-                'task_type_id': 'lighting',
-                'episode_id': 'ep01',
-                'task_statuses': [
-                    {
-                        'task_status_id': 'done',
-                        'data': [
-                            {'timestamp': '2020-02-03', 'count': 10},
-                        ],
-                    }
-                ],
-            },
-            {
-                'task_type_id': 'lighting',
-                'episode_id': 'ep02',
-                'task_statuses': [
-                    {
-                        'task_status_id': 'done',
-                        'data': [
-                            {'timestamp': '2020-02-03', 'count': 10},
-                        ],
-                    }
-                ],
-            },
-        ]
-
-        result = ProjectWriter._merge_task_count_dicts(initial, update)
-        self.assertEqual(result, expected_result)
-
-
 class TestParseTasks(unittest.TestCase):
     def test_parse_tasks(self):
         result = [
@@ -0,0 +1,146 @@
+import gzip
+import json
+import os
+import pathlib
+import tempfile
+import threading
+import unittest
+
+from watchtower_pipeline import jsonfiles, models, writers
+from watchtower_pipeline.example import ExampleWriter
+
+
+class ExportRecorder(ExampleWriter):
+    """Record which projects are exported, and how many at the same time."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.barrier = threading.Barrier(2, timeout=5)
+
+    def get_task_count(self, project_id):
+        return []
+
+    def write_project(self, project_id, destination_path: pathlib.Path):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            if project_id == 'broken':
+                raise RuntimeError("Kitsu is down")
+            # Only returns once two projects are being exported at the same time
+            self.barrier.wait()
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+class TestWriteProjects(unittest.TestCase):
+    def test_parallel_export_isolates_failures(self):
+        writer = ExportRecorder()
+        results = writer.write_projects(['a', 'broken', 'b'], pathlib.Path('.'), jobs=2)
+
+        self.assertEqual([r.project_id for r in results], ['a', 'broken', 'b'])
+        self.assertIsNone(results[0].error)
+        self.assertIsInstance(results[1].error, RuntimeError)
+        self.assertIsNone(results[2].error)
+        self.assertEqual(writer.max_running, 2)
+
+    def test_downloaders_share_the_rate_limit(self):
+        writer = ExportRecorder()
+        writer.download_rate_limit = 2
+        downloaders = [writer.get_media_downloader() for _ in range(2)]
+        self.assertIs(downloaders[0].rate_limiter, downloaders[1].rate_limiter)
+        self.assertEqual(downloaders[0].rate_limiter.interval, 0.5)
+
+
+class TestWriteJson(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.destination_path = pathlib.Path(self.tmp_dir.name)
+        self.dst = self.destination_path / 'data/projects-list/index.json'
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_project_list(self, *project_ids, json_format=jsonfiles.JsonFormat()):
+        projects = [models.ProjectListItem(id=p, name=p) for p in project_ids]
+        writers.ProjectListWriter(projects, self.destination_path, json_format).write_as_json()
+        return json.loads(self.dst.read_text())
+
+    def test_unchanged_documents_are_not_written(self):
+        self.assertEqual([p['id'] for p in self.write_project_list('a')['projects']], ['a'])
+        os.utime(self.dst, (0, 0))
+        self.write_project_list('a')
+        self.assertEqual(self.dst.stat().st_mtime, 0)
+
+        self.assertEqual(len(self.write_project_list('a', 'b')['projects']), 2)
+        self.assertNotEqual(self.dst.stat().st_mtime, 0)
+        self.assertEqual(
+            sorted(p.name for p in self.dst.parent.iterdir()), ['index.json', 'manifest.json']
+        )
+        content = self.dst.read_bytes()
+        manifest = json.loads((self.dst.parent / 'manifest.json').read_text())
+        self.assertEqual(
+            manifest['files']['index.json'],
+            {'digest': jsonfiles.get_digest(content), 'size': len(content)},
+        )
+
+    def test_modified_documents_are_written(self):
+        self.write_project_list('a')
+        # The manifest is up to date, but the document was changed by something else
+        self.dst.write_text(self.dst.read_text().replace('"a"', '"x"'))
+        self.assertEqual([p['id'] for p in self.write_project_list('a')['projects']], ['a'])
+
+    def test_compact_and_precompressed(self):
+        compact_gzip = jsonfiles.JsonFormat(compact=True, encodings=('gzip',))
+        projects = self.write_project_list('a', json_format=compact_gzip)
+        content = self.dst.read_bytes()
+        self.assertEqual(content, json.dumps(projects, separators=(',', ':')).encode())
+        gzip_dst = self.dst.with_name('index.json.gz')
+        self.assertEqual(gzip.decompress(gzip_dst.read_bytes()), content)
+        manifest = jsonfiles.Manifest.load(self.dst.parent)
+        self.assertEqual(sorted(manifest.files), ['index.json', 'index.json.gz'])
+
+        # Compressed variants are left untouched along with the document
+        os.utime(gzip_dst, (0, 0))
+        self.write_project_list('a', json_format=compact_gzip)
+        self.assertEqual(gzip_dst.stat().st_mtime, 0)
+
+        # Variants that are not written anymore are removed, rather than left outdated
+        self.write_project_list('a', 'b')
+        self.assertFalse(gzip_dst.exists())
+        self.assertEqual(list(jsonfiles.Manifest.load(self.dst.parent).files), ['index.json'])
+
+    def test_streamed_list_is_byte_identical(self):
+        lists = [
+            [],
+            [{}],
+            [{'a': [], 'b': {'c': [1, 2.5]}, 'd': 'multi\nline é'}, 1, None, 'text', [[]]],
+        ]
+        for json_format in [jsonfiles.JsonFormat(), jsonfiles.JsonFormat(compact=True)]:
+            for items in lists:
+                with self.subTest(compact=json_format.compact, items=items):
+                    self.assertEqual(
+                        b''.join(json_format.iterencode_list(iter(items))),
+                        json_format.dumps(items),
+                    )
+        self.assertEqual(
+            jsonfiles.JsonFormat().dumps(lists[2]), json.dumps(lists[2], indent=2).encode()
+        )
+
+    def test_streamed_list_is_compared_while_written(self):
+        manifest = jsonfiles.Manifest(self.destination_path)
+        dst = self.destination_path / 'items.json'
+        previous = []
+        for items in [list(range(5)), list(range(5)), list(range(8)), [0, 1, 9], [0, 1], []]:
+            written = manifest.write_json_list('items.json', iter(items))
+            self.assertEqual(written, items != previous)
+            self.assertEqual(json.loads(dst.read_text()), items)
+            self.assertEqual(dst.read_bytes(), jsonfiles.dumps(items))
+            self.assertEqual(
+                manifest.files['items.json'].digest, jsonfiles.get_digest(dst.read_bytes())
+            )
+            previous = items
+        self.assertEqual([p.name for p in self.destination_path.iterdir()], ['items.json'])
@@ -1,6 +1,9 @@
 import argparse
 import pathlib
 from dataclasses import dataclass
+from typing import Optional
+
+from watchtower_pipeline import bundling, jsonfiles
 
 
 @dataclass
@@ -8,6 +11,18 @@ class ParsedArgs:
     bundle: bool
     project_ids: [str]
     destination_path: pathlib.Path
+    download_workers: int = 8
+    download_rate_limit: Optional[float] = None
+    revalidate_media: bool = False
+    jobs: int = 1
+    max_in_flight: Optional[int] = None
+    rate_limit: Optional[float] = None
+    incremental: bool = False
+    json_format: jsonfiles.JsonFormat = jsonfiles.JsonFormat()
+    compact_models: bool = False
+    count_asset_tasks: bool = False
+    bundle_mode: str = 'copy'
+    async_fetch: bool = False
 
 
 def valid_dir_arg(value):
@@ -24,6 +39,13 @@ def valid_dir_arg(value):
 def parse_args(args):
     parser = argparse.ArgumentParser(description="Generate Watchtower content.")
     parser.add_argument("-b", "--bundle", action=argparse.BooleanOptionalAction)
+    parser.add_argument(
+        "--bundle-mode",
+        choices=bundling.MODES,
+        default='copy',
+        help="How to transfer data into the bundle: copy files, or hardlink or reflink them "
+        "when the filesystem supports it, and copy them otherwise",
+    )
     parser.add_argument(
         "-p",
         "--projects",
@@ -33,11 +55,97 @@ def parse_args(args):
         help="Optional list of projects",
     )
     parser.add_argument("-d", "--destination", type=valid_dir_arg)
+    parser.add_argument(
+        "-w",
+        "--download-workers",
+        type=int,
+        default=8,
+        help="Number of thumbnails to download at the same time",
+    )
+    parser.add_argument(
+        "--download-rate-limit",
+        type=float,
+        help="Maximum number of download requests per second sent to each host",
+    )
+    parser.add_argument(
+        "--revalidate",
+        action=argparse.BooleanOptionalAction,
+        help="Check if previously downloaded media changed upstream",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of projects to export at the same time",
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        help="Maximum number of HTTP requests in progress at the same time, across all projects. "
+        "A media download is in progress until its transfer is complete.",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        help="Maximum number of requests per second sent to the data source API",
+    )
+    parser.add_argument(
+        "-i",
+        "--incremental",
+        action=argparse.BooleanOptionalAction,
+        help="Only export what changed since the previous export",
+    )
+    parser.add_argument(
+        "--compact",
+        action=argparse.BooleanOptionalAction,
+        help="Write JSON files without indentation",
+    )
+    parser.add_argument(
+        "--precompress",
+        action="append",
+        choices=jsonfiles.ENCODINGS.keys(),
+        default=[],
+        help="Also write compressed copies of JSON files (.json.gz for gzip, .json.br for br), "
+        "for the web server to serve directly. Can be used more than once.",
+    )
+    parser.add_argument(
+        "--compact-models",
+        action=argparse.BooleanOptionalAction,
+        help="Use less memory for shots, assets and tasks, for very large productions",
+    )
+    parser.add_argument(
+        "--count-asset-tasks",
+        action=argparse.BooleanOptionalAction,
+        help="Include the tasks of assets in the task counts, not only the tasks of shots",
+    )
+    parser.add_argument(
+        "--async-fetch",
+        action=argparse.BooleanOptionalAction,
+        help="Fetch the sequences, shots, assets and edits of a project at the same time "
+        "(Kitsu only)",
+    )
     args = parser.parse_args(args)
+    if 'br' in args.precompress and 'br' not in jsonfiles.get_available_encodings():
+        parser.error("--precompress br requires the brotli package (pip install brotli)")
     destination_path = args.destination or pathlib.Path.cwd()
 
     return ParsedArgs(
         bundle=args.bundle,
         project_ids=[] or args.projects,
         destination_path=destination_path,
+        download_workers=args.download_workers,
+        download_rate_limit=args.download_rate_limit,
+        revalidate_media=bool(args.revalidate),
+        jobs=args.jobs,
+        max_in_flight=args.max_in_flight,
+        rate_limit=args.rate_limit,
+        incremental=bool(args.incremental),
+        json_format=jsonfiles.JsonFormat(
+            compact=bool(args.compact), encodings=tuple(dict.fromkeys(args.precompress))
+        ),
+        compact_models=bool(args.compact_models),
+        count_asset_tasks=bool(args.count_asset_tasks),
+        bundle_mode=args.bundle_mode,
+        async_fetch=bool(args.async_fetch),
     )
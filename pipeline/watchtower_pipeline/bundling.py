@@ -0,0 +1,195 @@
+"""Synchronization of directory trees into the Watchtower bundle.
+
+The source, such as the data directory, is a persistent staging area: it is kept
+between exports, so that downloaded media are not downloaded again. Only the changes
+are applied to the destination:
+- files whose size and modification time already match are skipped
+- the others are transferred in parallel, according to a mode:
+  - copy: copy the file (with its modification time, so that it is skipped next time)
+  - hardlink: link the file, so that it is stored once
+  - reflink: clone the file (on filesystems with copy-on-write, such as Btrfs or XFS)
+  Files that cannot be linked or cloned (for instance across filesystems) are copied
+  instead.
+- files removed from the source since the previous synchronization are deleted. They
+  are listed in a manifest (by default in the destination, which can be kept elsewhere
+  when the destination is published), so that other files are left untouched.
+"""
+
+import errno
+import json
+import logging
+import os
+import pathlib
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+MODES = ('copy', 'hardlink', 'reflink')
+# Default manifest of the files written by the synchronization, in the destination
+MANIFEST_NAME = '.sync-manifest.json'
+# Files being written in the source, which are not ready to be published
+EXCLUDED_SUFFIXES = ('.part', '.tmp')
+# Linux ioctl cloning a file, from linux/fs.h
+FICLONE = 0x40049409
+# Errors meaning that the filesystem cannot link or clone a file
+UNSUPPORTED_ERRNOS = {
+    errno.EXDEV,
+    errno.EPERM,
+    errno.EMLINK,
+    errno.EOPNOTSUPP,
+    errno.ENOTTY,
+    errno.EINVAL,
+}
+
+
+@dataclass
+class SyncStats:
+    # Number of files by outcome: one of the modes, skipped or deleted
+    files: Dict[str, int] = field(default_factory=dict)
+    transferred_bytes: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def add(self, outcome: str, size: int = 0):
+        with self.lock:
+            self.files[outcome] = self.files.get(outcome, 0) + 1
+            self.transferred_bytes += size
+
+    def __str__(self):
+        counts = ', '.join(f"{count} {outcome}" for outcome, count in sorted(self.files.items()))
+        return f"{counts or 'no files'} ({self.transferred_bytes / 1024 / 1024:.1f} MiB)"
+
+
+def load_manifest(path: pathlib.Path) -> Set[str]:
+    try:
+        return set(json.loads(path.read_text())['files'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return set()
+
+
+def save_manifest(path: pathlib.Path, files: Set[str]):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    tmp_path.write_text(json.dumps({'files': sorted(files)}))
+    os.replace(tmp_path, path)
+
+
+def iter_files(src: pathlib.Path, excluded_suffixes: Tuple[str, ...] = ()):
+    """Yield the paths, relative to src, of the files to synchronize: all of them, but the
+    ones being written and the ones whose name ends with one of excluded_suffixes."""
+    excluded_suffixes = EXCLUDED_SUFFIXES + tuple(excluded_suffixes)
+    for dirpath, _, filenames in os.walk(src):
+        relative_dir = pathlib.Path(dirpath).relative_to(src)
+        for filename in filenames:
+            if not filename.endswith(excluded_suffixes):
+                yield (relative_dir / filename).as_posix()
+
+
+def delete_file(dst: pathlib.Path, relative_path: str):
+    """Delete a file, and the directories it leaves empty."""
+    path = dst / relative_path
+    path.unlink(missing_ok=True)
+    for parent in list(path.relative_to(dst).parents)[:-1]:
+        try:
+            (dst / parent).rmdir()
+        except OSError:
+            # Not empty, or already deleted
+            break
+
+
+def is_up_to_date(src_stat: os.stat_result, dst: pathlib.Path) -> bool:
+    try:
+        dst_stat = dst.stat()
+    except FileNotFoundError:
+        return False
+    return dst_stat.st_size == src_stat.st_size and dst_stat.st_mtime_ns == src_stat.st_mtime_ns
+
+
+def reflink(src: pathlib.Path, dst: pathlib.Path):
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "Cloning files is not supported", str(dst))
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        except OSError:
+            dst_file.close()
+            dst.unlink()
+            raise
+    shutil.copystat(src, dst)
+
+
+def transfer_file(src: pathlib.Path, dst: pathlib.Path, mode: str) -> str:
+    """Transfer a file, replacing dst. Returns the mode used, which is copy if the
+    requested mode is not supported for this file."""
+    if mode != 'copy':
+        tmp_dst = dst.with_name(f"{dst.name}.tmp")
+        try:
+            if mode == 'hardlink':
+                tmp_dst.unlink(missing_ok=True)
+                os.link(src, tmp_dst)
+            elif mode == 'reflink':
+                reflink(src, tmp_dst)
+            os.replace(tmp_dst, dst)
+            return mode
+        except OSError as e:
+            if e.errno not in UNSUPPORTED_ERRNOS:
+                raise
+            logging.debug(f"Could not {mode} {src} to {dst} ({e}), copying it")
+    # Replaced atomically, in case dst is a hardlink to a file of the source tree
+    tmp_dst = dst.with_name(f"{dst.name}.tmp")
+    shutil.copy2(src, tmp_dst)
+    os.replace(tmp_dst, dst)
+    return 'copy'
+
+
+def sync_tree(
+    src: pathlib.Path,
+    dst: pathlib.Path,
+    mode: str = 'copy',
+    workers: int = 8,
+    excluded_suffixes: Tuple[str, ...] = (),
+    manifest_path: Optional[pathlib.Path] = None,
+) -> SyncStats:
+    """Synchronize dst with src: transfer new and modified files, and delete the files
+    removed from src since the previous synchronization.
+
+    Files whose name ends with one of excluded_suffixes are not transferred, and deleted
+    from dst if a previous synchronization transferred them. The files transferred are
+    listed in manifest_path, dst / MANIFEST_NAME by default.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown transfer mode {mode}, expected one of {', '.join(MODES)}")
+    stats = SyncStats()
+    dst.mkdir(parents=True, exist_ok=True)
+    manifest_path = manifest_path or dst / MANIFEST_NAME
+    previous_files = load_manifest(manifest_path)
+    files = set(iter_files(src, excluded_suffixes))
+    # Saved first, so that the files transferred by an interrupted synchronization are
+    # deleted by the next one if they are removed from src in the meantime
+    save_manifest(manifest_path, previous_files | files)
+
+    def transfer(relative_path: str):
+        src_path = src / relative_path
+        dst_path = dst / relative_path
+        src_stat = src_path.stat()
+        if is_up_to_date(src_stat, dst_path):
+            stats.add('skipped')
+            return
+        dst_path.parent.mkdir(parents=True, exist_ok=True)
+        stats.add(transfer_file(src_path, dst_path, mode), src_stat.st_size)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Raise the first error, if any
+        list(executor.map(transfer, sorted(files)))
+
+    for relative_path in sorted(previous_files - files):
+        delete_file(dst, relative_path)
+        stats.add('deleted')
+    save_manifest(manifest_path, files)
+    return stats
@@ -189,9 +189,16 @@ def main(args):
     parsed_args = argparser.parse_args(args)
     destination_path = parsed_args.destination_path
 
-    ExampleWriter().write_all(destination_path)
+    example_writer = ExampleWriter()
+    example_writer.download_workers = parsed_args.download_workers
+    example_writer.download_rate_limit = parsed_args.download_rate_limit
+    example_writer.revalidate_media = parsed_args.revalidate_media
+    example_writer.json_format = parsed_args.json_format
+    example_writer.write_all(destination_path, jobs=parsed_args.jobs)
     if parsed_args.bundle:
-        writers.WatchtowerBundler.bundle(destination_path)
+        writers.WatchtowerBundler.bundle(
+            destination_path, mode=parsed_args.bundle_mode, workers=parsed_args.download_workers
+        )
 
 
 if __name__ == "__main__":
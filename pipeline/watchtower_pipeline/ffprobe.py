@@ -1,20 +1,123 @@
+import json
+import logging
+import os
 import pathlib
 import subprocess
+from dataclasses import asdict, dataclass
+from fractions import Fraction
+from typing import Dict, Optional
 
+from watchtower_pipeline import mp4
 
-def get_frames_count(input_path: pathlib.Path) -> int:
-    ffprobe_command = [
-        'ffprobe',
-        '-v',
-        'error',
-        '-select_streams',
-        'v:0',
+# Sidecar file storing the frame count of a movie
+CACHE_SUFFIX = '.frames.json'
+
+
+@dataclass
+class FramesCountCacheEntry:
+    """Frame count of a movie, valid as long as its size and modification time match."""
+
+    size: int
+    mtime_ns: int
+    frames_count: int
+
+    @staticmethod
+    def get_path(input_path: pathlib.Path) -> pathlib.Path:
+        return input_path.with_name(f"{input_path.name}{CACHE_SUFFIX}")
+
+    @classmethod
+    def load(cls, input_path: pathlib.Path) -> Optional['FramesCountCacheEntry']:
+        try:
+            return cls(**json.loads(cls.get_path(input_path).read_text()))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def save(self, input_path: pathlib.Path):
+        path = self.get_path(input_path)
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        tmp_path.write_text(json.dumps(asdict(self)))
+        os.replace(tmp_path, path)
+
+    def matches(self, stat: os.stat_result) -> bool:
+        return self.size == stat.st_size and self.mtime_ns == stat.st_mtime_ns
+
+
+def run_ffprobe(input_path: pathlib.Path, *args: str) -> str:
+    ffprobe_command = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', *args, f'{input_path}']
+    result = subprocess.run(ffprobe_command, stdout=subprocess.PIPE, check=True)
+    return result.stdout.decode('utf-8')
+
+
+def get_frames_count_from_metadata(input_path: pathlib.Path) -> Optional[int]:
+    """Get the frame count from the container metadata, without reading the whole file.
+
+    It is the number of frames of the stream if the container stores it (as MP4 and MOV
+    do), or derived from the duration for constant frame rate streams.
+    """
+    probe = json.loads(
+        run_ffprobe(
+            input_path,
+            '-show_entries',
+            'stream=nb_frames,duration,r_frame_rate,avg_frame_rate:format=duration',
+            '-of',
+            'json',
+        )
+    )
+    streams = probe.get('streams') or [{}]
+    stream: Dict = streams[0]
+    nb_frames = stream.get('nb_frames')
+    if nb_frames and nb_frames.isdigit() and int(nb_frames) > 0:
+        return int(nb_frames)
+
+    duration = stream.get('duration') or probe.get('format', {}).get('duration')
+    frame_rate = stream.get('avg_frame_rate')
+    # The duration only gives an exact count with a constant frame rate
+    if not duration or not frame_rate or frame_rate != stream.get('r_frame_rate'):
+        return None
+    try:
+        frames_count = round(Fraction(duration) * Fraction(frame_rate))
+    except (ValueError, ZeroDivisionError):
+        return None
+    return frames_count or None
+
+
+def count_packets(input_path: pathlib.Path) -> int:
+    """Count the frames by reading every packet of the file, which is slow for long movies."""
+    result = run_ffprobe(
+        input_path,
         '-count_packets',
         '-show_entries',
         'stream=nb_read_packets',
         '-of',
         'csv=p=0',
-        f'{input_path}',
-    ]
-    result = subprocess.run(ffprobe_command, stdout=subprocess.PIPE).stdout.decode('utf-8')
+    )
     return int(result)
+
+
+def get_frames_count(input_path: pathlib.Path, use_cache=True) -> int:
+    """Get the number of frames of the first video stream of a movie.
+
+    MP4 and MOV movies are read in-process, ffprobe is only needed for other containers.
+    The count is cached in a sidecar file, so an unchanged movie is not probed again.
+    """
+    stat = input_path.stat()
+    if use_cache:
+        cache_entry = FramesCountCacheEntry.load(input_path)
+        if cache_entry and cache_entry.matches(stat):
+            return cache_entry.frames_count
+
+    try:
+        frames_count = mp4.get_frames_count(input_path)
+    except mp4.Mp4Error as e:
+        logging.warning(f"Could not read the frame count of {input_path}: {e}")
+        frames_count = None
+    if frames_count is None:
+        frames_count = get_frames_count_from_metadata(input_path)
+    if frames_count is None:
+        logging.info(f"No frame count in the metadata of {input_path}, counting packets")
+        frames_count = count_packets(input_path)
+
+    FramesCountCacheEntry(
+        size=stat.st_size, mtime_ns=stat.st_mtime_ns, frames_count=frames_count
+    ).save(input_path)
+    return frames_count
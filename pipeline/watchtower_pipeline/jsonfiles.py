@@ -0,0 +1,347 @@
+"""Write JSON documents to disk, leaving unchanged ones untouched.
+
+Rewriting a document with the same content still bumps its modification time, which
+invalidates browser and CDN caches, and makes sync tools upload it again. Documents are
+compared with their previous content, and only changed ones are written, through a
+temporary file renamed over the destination, so readers never see a partial file.
+
+Large lists are serialized and compared one item at a time, so that neither the whole
+document nor a copy of the data as dicts needs to be held in memory.
+
+Documents can also be written in a compact form, and with precompressed siblings (for
+example shots.json.gz next to shots.json), for web servers to serve directly.
+
+Each directory of documents has a manifest listing the hash and size of every file, for
+deploy tooling to find out what changed without reading the files.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import zlib
+from dataclasses import asdict, dataclass, field
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+HASH_ALGORITHM = 'sha256'
+MANIFEST_NAME = 'manifest.json'
+TEMPORARY_SUFFIX = '.tmp'
+# Size of the blocks read when copying or compressing files
+BLOCK_SIZE = 1024 * 1024
+
+
+class BrotliCompressor:
+    """Wrap brotli.Compressor with the interface of zlib compression objects."""
+
+    def __init__(self):
+        self._compressor = brotli.Compressor()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.finish()
+
+
+@dataclass(frozen=True)
+class Encoding:
+    suffix: str
+    # Returns an object with compress() and flush() methods, like zlib.compressobj()
+    get_compressor: Callable[[], Any]
+
+
+# Precompressed variants of the documents, by name of the HTTP content coding. The
+# output must be deterministic, so that unchanged documents compress to unchanged files
+# (the gzip header written by zlib has no timestamp).
+ENCODINGS = {
+    'gzip': Encoding('.gz', lambda: zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)),
+    'br': Encoding('.br', BrotliCompressor),
+}
+
+
+def get_available_encodings() -> Tuple[str, ...]:
+    """Get the encodings that can be used, brotli being an optional dependency."""
+    return tuple(name for name in ENCODINGS if name != 'br' or brotli is not None)
+
+
+@dataclass(frozen=True)
+class JsonFormat:
+    """How documents are written."""
+
+    # Without indentation and spaces, to make documents smaller
+    compact: bool = False
+    # Names of the precompressed variants to write next to every document
+    encodings: Tuple[str, ...] = ()
+
+    def __post_init__(self):
+        unavailable = set(self.encodings) - set(get_available_encodings())
+        if unavailable:
+            raise ValueError(
+                f"Unavailable encodings: {', '.join(sorted(unavailable))}. "
+                "The brotli package is needed for 'br'."
+            )
+
+    def get_encoder(self) -> json.JSONEncoder:
+        if self.compact:
+            return json.JSONEncoder(separators=(',', ':'))
+        return json.JSONEncoder(indent=2)
+
+    def dumps(self, data: Any) -> bytes:
+        return self.get_encoder().encode(data).encode()
+
+    def iterencode(self, data: Any) -> Iterator[bytes]:
+        yield self.dumps(data)
+
+    def iterencode_list(self, items: Iterable[Any]) -> Iterator[bytes]:
+        """Encode items as a JSON array, one item at a time.
+
+        The output is the same as dumps(list(items)), but only one item is serialized at
+        a time, and items can be produced lazily.
+        """
+        encoder = self.get_encoder()
+        if self.compact:
+            start, separator, end = '[', ',', ']'
+        else:
+            start, separator, end = '[\n  ', ',\n  ', '\n]'
+        is_empty = True
+        for item in items:
+            text = encoder.encode(item)
+            if not self.compact:
+                # Items are nested one level deeper than when encoded alone. Newlines are
+                # escaped in strings, so they only appear between tokens.
+                text = text.replace('\n', '\n  ')
+            yield ((start if is_empty else separator) + text).encode()
+            is_empty = False
+        yield b'[]' if is_empty else end.encode()
+
+
+def dumps(data: Any) -> bytes:
+    """Serialize data the way documents are stored by default."""
+    return json.dumps(data, indent=2).encode()
+
+
+def get_digest(content: bytes) -> str:
+    """Get a digest of content, as 'algorithm:hexdigest'."""
+    return f"{HASH_ALGORITHM}:{hashlib.new(HASH_ALGORITHM, content).hexdigest()}"
+
+
+def write_atomic(dst: pathlib.Path, content: bytes):
+    """Replace dst with content, without ever exposing a partially written file."""
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dst = dst.with_name(dst.name + TEMPORARY_SUFFIX)
+    try:
+        tmp_dst.write_bytes(content)
+        os.replace(tmp_dst, dst)
+    except BaseException:
+        tmp_dst.unlink(missing_ok=True)
+        raise
+
+
+def has_content(path: pathlib.Path, content: bytes) -> bool:
+    """Check if the file at path exists and has the given content."""
+    try:
+        return path.stat().st_size == len(content) and path.read_bytes() == content
+    except FileNotFoundError:
+        return False
+
+
+def copy_prefix(src: BinaryIO, dst: BinaryIO, size: int):
+    """Copy the first size bytes of src to dst."""
+    src.seek(0)
+    while size > 0:
+        block = src.read(min(size, BLOCK_SIZE))
+        if not block:
+            break
+        dst.write(block)
+        size -= len(block)
+
+
+def compress(src: BinaryIO, encoding: str) -> Iterator[bytes]:
+    compressor = ENCODINGS[encoding].get_compressor()
+    for block in iter(lambda: src.read(BLOCK_SIZE), b''):
+        yield compressor.compress(block)
+    yield compressor.flush()
+
+
+@dataclass
+class StagedFile:
+    """New content for a file, kept in a temporary file until published.
+
+    There is no temporary file if the content is the same as the current one.
+    """
+
+    path: pathlib.Path
+    digest: str
+    size: int
+    changed: bool
+
+    @property
+    def tmp_path(self) -> pathlib.Path:
+        return self.path.with_name(self.path.name + TEMPORARY_SUFFIX)
+
+    @classmethod
+    def stage(cls, path: pathlib.Path, chunks: Iterable[bytes]) -> 'StagedFile':
+        """Compare chunks of content with the current content of path, as they are
+        produced. A temporary file is only written from the first difference on."""
+        hasher = hashlib.new(HASH_ALGORITHM)
+        size = 0
+        tmp_path = path.with_name(path.name + TEMPORARY_SUFFIX)
+        tmp_file = None
+        try:
+            current_file = open(path, 'rb')
+        except FileNotFoundError:
+            current_file = None
+
+        def open_tmp_file():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = open(tmp_path, 'wb')
+            if current_file:
+                # Everything until here is the same as the current content
+                copy_prefix(current_file, tmp_file, size)
+            return tmp_file
+
+        try:
+            for chunk in chunks:
+                if tmp_file is None and (
+                    current_file is None or current_file.read(len(chunk)) != chunk
+                ):
+                    tmp_file = open_tmp_file()
+                if tmp_file:
+                    tmp_file.write(chunk)
+                hasher.update(chunk)
+                size += len(chunk)
+            if tmp_file is None and (current_file is None or current_file.read(1)):
+                # The file does not exist, or its current content is longer
+                tmp_file = open_tmp_file()
+        except BaseException:
+            if tmp_file:
+                tmp_file.close()
+                tmp_file = None
+                tmp_path.unlink(missing_ok=True)
+            raise
+        finally:
+            if current_file:
+                current_file.close()
+            if tmp_file:
+                tmp_file.close()
+
+        return cls(
+            path=path,
+            digest=f"{HASH_ALGORITHM}:{hasher.hexdigest()}",
+            size=size,
+            changed=tmp_file is not None,
+        )
+
+    def open(self) -> BinaryIO:
+        """Open the new content for reading."""
+        return open(self.tmp_path if self.changed else self.path, 'rb')
+
+    def publish(self):
+        """Replace the file with its new content."""
+        if self.changed and self.tmp_path.exists():
+            os.replace(self.tmp_path, self.path)
+
+    def discard(self):
+        self.tmp_path.unlink(missing_ok=True)
+
+
+@dataclass
+class ManifestEntry:
+    digest: str
+    size: int
+
+
+@dataclass
+class Manifest:
+    """The files of a directory, with their digest and size."""
+
+    directory: pathlib.Path
+    json_format: JsonFormat = JsonFormat()
+    files: Dict[str, ManifestEntry] = field(default_factory=dict)
+
+    @property
+    def path(self) -> pathlib.Path:
+        return self.directory / MANIFEST_NAME
+
+    @classmethod
+    def load(cls, directory: pathlib.Path, json_format: JsonFormat = JsonFormat()) -> 'Manifest':
+        manifest = cls(directory=directory, json_format=json_format)
+        try:
+            files = json.loads(manifest.path.read_text())['files']
+            manifest.files = {name: ManifestEntry(**entry) for name, entry in files.items()}
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return manifest
+
+    def save(self):
+        files = {name: asdict(entry) for name, entry in sorted(self.files.items())}
+        content = dumps({'files': files})
+        if not has_content(self.path, content):
+            write_atomic(self.path, content)
+
+    def add(self, staged: StagedFile):
+        self.files[staged.path.name] = ManifestEntry(digest=staged.digest, size=staged.size)
+
+    def remove(self, name):
+        """Remove a file that is not written anymore."""
+        self.files.pop(name, None)
+        (self.directory / name).unlink(missing_ok=True)
+
+    def write_encoded(self, staged: StagedFile, encoding: str):
+        """Write the precompressed variant of a staged document."""
+        encoded_name = staged.path.name + ENCODINGS[encoding].suffix
+        if (
+            not staged.changed
+            and encoded_name in self.files
+            and (self.directory / encoded_name).exists()
+        ):
+            # Compressing is costly, and the variant was written with the document
+            return
+        with staged.open() as src:
+            encoded = StagedFile.stage(self.directory / encoded_name, compress(src, encoding))
+        encoded.publish()
+        self.add(encoded)
+
+    def write_chunks(self, name, chunks: Iterable[bytes]) -> bool:
+        """Write the document called name from chunks of content, if its content changed.
+
+        Returns True if the document was written. The manifest is updated, but only
+        saved by calling save().
+        """
+        # Compare with the file itself rather than with the manifest, which could be
+        # outdated if the file was modified or removed by something else
+        staged = StagedFile.stage(self.directory / name, chunks)
+        try:
+            # Variants are written first: if writing is interrupted, the document is still
+            # outdated on the next run, and everything is written again
+            for encoding in ENCODINGS:
+                if encoding in self.json_format.encodings:
+                    self.write_encoded(staged, encoding)
+                else:
+                    # An outdated variant would be served instead of the document
+                    self.remove(name + ENCODINGS[encoding].suffix)
+            staged.publish()
+        finally:
+            staged.discard()
+        if not staged.changed:
+            logging.debug(f"{staged.path} is unchanged")
+        self.add(staged)
+        return staged.changed
+
+    def write_json(self, name, data: Any) -> bool:
+        """Write data as the JSON document called name, if its content changed."""
+        return self.write_chunks(name, self.json_format.iterencode(data))
+
+    def write_json_list(self, name, items: Iterable[Any]) -> bool:
+        """Write items as the JSON array called name, if its content changed.
+
+        Items are serialized one by one, and can be produced lazily, for example by a
+        generator, to avoid holding all of them in memory.
+        """
+        return self.write_chunks(name, self.json_format.iterencode_list(items))
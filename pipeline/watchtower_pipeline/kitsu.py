@@ -1,4 +1,6 @@
 #!/usr/bin/env python3
+import asyncio
+import base64
 import datetime
 
 import json
@@ -6,10 +8,14 @@ import logging
 import pathlib
 import requests
 import sys
-from dataclasses import dataclass
-from typing import List, Optional, Dict
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Any, Collection, List, Optional, Dict, Set, Tuple
 
-from watchtower_pipeline import models, writers, ffprobe, argparser
+from watchtower_pipeline import models, writers, ffprobe, argparser, sessions, media
 
 logging.basicConfig(
     level=logging.INFO,
@@ -53,60 +59,405 @@ class Config:
                 sys.exit(1)
 
 
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+
+
+def get_jwt_times(token: str) -> Tuple[Optional[float], Optional[float]]:
+    """Get the issue and expiry times (Unix timestamps) of a JWT, without verifying it.
+
+    Either is None if the token does not have it.
+    """
+    try:
+        payload = token.split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        times = [claims.get(claim) for claim in ('iat', 'exp')]
+        return tuple(float(t) if t is not None else None for t in times)
+    except (AttributeError, IndexError, TypeError, ValueError):
+        return None, None
+
+
+def get_request_project_id(path: str, params: Optional[Dict] = None) -> Optional[str]:
+    """Get the id of the project an API request is about, from its project_id parameter
+    (in params or in the query of path) or from a /data/projects/<id> path."""
+    if params and params.get('project_id'):
+        return params['project_id']
+    url = urllib.parse.urlsplit(path)
+    query_project_ids = urllib.parse.parse_qs(url.query).get('project_id')
+    if query_project_ids:
+        return query_project_ids[0]
+    parts = url.path.strip('/').split('/')
+    if len(parts) > 2 and parts[:2] == ['data', 'projects']:
+        return parts[2]
+    return None
+
+
+class BearerAuth(requests.auth.AuthBase):
+    def __init__(self, token: str):
+        self.token = token
+
+    def __call__(self, request):
+        request.headers['Authorization'] = f"Bearer {self.token}"
+        return request
+
+
+class KitsuAuth(requests.auth.AuthBase):
+    """Authenticate requests with the access token of a KitsuClient.
+
+    The token is refreshed shortly before it expires, and a request rejected with a 401
+    is sent once more with a refreshed token. Set on the session of the client, it also
+    applies to media downloads sharing the session.
+    """
+
+    def __init__(self, client: 'KitsuClient'):
+        self.client = client
+
+    def __call__(self, request):
+        if self.client.jwt is None:
+            # Not logged in yet
+            return request
+        request.headers['Authorization'] = f"Bearer {self.client.get_jwt()}"
+        request.register_hook('response', self.handle_401)
+        return request
+
+    def handle_401(self, response: requests.Response, **kwargs):
+        if response.status_code != 401 or getattr(response.request, 'is_auth_retry', False):
+            return response
+        sent_token = response.request.headers.get('Authorization', '').partition(' ')[2]
+        self.client.refresh_jwt(expired_jwt=sent_token)
+        # Release the connection before sending the request again
+        response.content
+        response.close()
+        request = response.request.copy()
+        request.headers['Authorization'] = f"Bearer {self.client.jwt}"
+        request.is_auth_retry = True
+        retried = response.connection.send(request, **kwargs)
+        retried.history.append(response)
+        retried.request = request
+        return retried
+
+
 @dataclass
 class KitsuClient:
-    """Client to query the Kitsu API."""
+    """Client to query the Kitsu API.
+
+    All requests go through a single pooled session, so connections to Kitsu are kept
+    alive and reused for the whole run. pool_maxsize caps the number of connections
+    opened to the Kitsu host at the same time. Only logging in and refreshing the access
+    token use a separate session.
+    """
 
     config: Config = None
     jwt: str = None
+    refresh_token: Optional[str] = None
+    # Refresh the access token when it expires in less than this (in seconds), or in less
+    # than half its lifetime for short-lived tokens
+    refresh_margin: float = 300
+    pool_connections: int = 10
+    pool_maxsize: int = 10
+    # Optional cap on concurrent requests, shared by everything using the session
+    max_in_flight: Optional[int] = None
+    # Optional rate limit of API requests, and timeout of each request (in seconds)
+    requests_per_second: Optional[float] = None
+    timeout: float = 60
+    session: Optional[requests.Session] = None
+    # Rate limit, retries and circuit breaker of API requests
+    scheduler: Optional[sessions.RequestScheduler] = None
+    cache_stats: CacheStats = field(default_factory=CacheStats)
 
     @property
     def headers(self):
-        return {'Authorization': f"Bearer {self.jwt}"}
+        return {'Authorization': f"Bearer {self.get_jwt()}"}
+
+    def get_jwt(self) -> str:
+        """Get the access token, refreshed first if it is about to expire."""
+        jwt = self.jwt
+        issued_at, expiry = get_jwt_times(jwt)
+        if expiry is None:
+            return jwt
+        if issued_at is None:
+            # Count the lifetime of tokens without an issue time from their first use
+            if self._jwt_first_use[0] != jwt:
+                self._jwt_first_use = (jwt, time.time())
+            issued_at = self._jwt_first_use[1]
+        # Refresh short-lived tokens half-way, rather than before every request
+        margin = min(self.refresh_margin, (expiry - issued_at) / 2)
+        if expiry - time.time() < margin:
+            self.refresh_jwt(expired_jwt=jwt)
+        return self.jwt
 
     @property
     def base_url(self):
         return self.config.base_url
 
     def get(self, path, params=None):
-        return requests.get(
-            f"{self.base_url}{path}", params=params, headers=self.headers, allow_redirects=True
+        """Get a response from the API, retrying on server errors and rate limiting.
+
+        Raises requests.HTTPError if the final response is an error, and
+        sessions.CircuitOpenError if requests to this endpoint keep failing.
+        """
+        response = self.scheduler.request(
+            lambda: self.session.get(
+                f"{self.base_url}{path}",
+                params=params,
+                allow_redirects=True,
+                timeout=self.timeout,
+            ),
+            # One circuit breaker per endpoint, so that a failing one, for instance for a
+            # single project, does not hold back the others
+            key=(path, tuple(sorted((params or {}).items()))),
         )
+        response.raise_for_status()
+        return response
+
+    def get_json(self, path, params=None, project_id: Optional[str] = None):
+        """Get the decoded JSON response for path, fetching it at most once per run.
+
+        The response is cached as related to project_id, by default the project found in
+        path or params (see get_request_project_id), and cleared with it by clear_cache.
+        The returned data is shared between callers and must not be modified.
+        """
+        key = (path, tuple(sorted((params or {}).items())))
+        with self._cache_lock:
+            if key in self._cache:
+                self.cache_stats.hits += 1
+                return self._cache[key]
+            self.cache_stats.misses += 1
+        data = self.get(path, params=params).json()
+        project_id = project_id or get_request_project_id(path, params)
+        with self._cache_lock:
+            self._cache[key] = data
+            if project_id:
+                self._project_cache_keys.setdefault(project_id, set()).add(key)
+        return data
+
+    def get_json_many(
+        self, paths: List[str], workers: int = 8, project_id: Optional[str] = None
+    ) -> List[Any]:
+        """Fetch several endpoints with up to `workers` concurrent requests.
+
+        The results are returned in the same order as paths.
+        """
+        if workers <= 1 or len(paths) <= 1:
+            return [self.get_json(path, project_id=project_id) for path in paths]
+        with ThreadPoolExecutor(max_workers=min(workers, len(paths))) as executor:
+            return list(
+                executor.map(lambda path: self.get_json(path, project_id=project_id), paths)
+            )
+
+    def clear_cache(self, project_id: Optional[str] = None):
+        """Drop cached responses, only the ones related to project_id if specified."""
+        with self._cache_lock:
+            if not project_id:
+                self._cache.clear()
+                self._project_cache_keys.clear()
+                return
+            for key in self._project_cache_keys.pop(project_id, set()):
+                self._cache.pop(key, None)
 
     def fetch_jwt(self, email, password) -> str:
         payload = {
             'email': email,
             'password': password,
         }
-        r_jwt = requests.post(f"{self.config.base_url}/auth/login", data=payload)
+        r_jwt = self._auth_session.post(
+            f"{self.config.base_url}/auth/login", data=payload, timeout=self.timeout
+        )
         r_jwt = r_jwt.json()
         if 'error' in r_jwt:
             logging.error(r_jwt['message'])
             exit()
+        self.refresh_token = r_jwt.get('refresh_token')
         return r_jwt['access_token']
 
+    def refresh_jwt(self, expired_jwt: Optional[str] = None):
+        """Get a new access token with the refresh token, or by logging in again.
+
+        Concurrent callers refresh the token once: if it changed since expired_jwt was
+        read, it is not refreshed again.
+
+        Authentication requests go through their own session, outside the cap on requests
+        in flight: a refresh is triggered by a request which already holds a slot.
+        """
+        with self._auth_lock:
+            if expired_jwt is not None and self.jwt != expired_jwt:
+                return
+            if self.refresh_token:
+                try:
+                    response = self._auth_session.get(
+                        f"{self.config.base_url}/auth/refresh-token",
+                        auth=BearerAuth(self.refresh_token),
+                        timeout=self.timeout,
+                    )
+                    response.raise_for_status()
+                    self.jwt = response.json()['access_token']
+                    logging.debug("Refreshed the Kitsu access token")
+                    return
+                except (requests.RequestException, ValueError, KeyError) as e:
+                    logging.info(f"Could not refresh the Kitsu access token ({e}), logging in")
+            self.jwt = self.fetch_jwt(self.config.email, self.config.password)
+
     def __post_init__(self):
+        self._cache: Dict[Tuple[str, tuple], Any] = {}
+        # Keys of the cached responses related to each project
+        self._project_cache_keys: Dict[str, Set[Tuple[str, tuple]]] = {}
+        self._cache_lock = threading.Lock()
+        self._auth_lock = threading.Lock()
+        self._jwt_first_use: Tuple[Optional[str], float] = (None, 0)
+        # Not authenticated with the current token, which might be the expired one
+        self._auth_session = requests.Session()
         if not self.config:
             self.config = Config()
+        if not self.session:
+            self.session = sessions.BoundedSession(
+                pool_connections=self.pool_connections,
+                pool_maxsize=self.pool_maxsize,
+                max_in_flight=self.max_in_flight,
+            )
+        if not self.scheduler:
+            self.scheduler = sessions.RequestScheduler(requests_per_second=self.requests_per_second)
+        self.session.auth = KitsuAuth(self)
         self.jwt = self.fetch_jwt(self.config.email, self.config.password)
 
 
+def index_dicts_by_id(items: List[Dict]) -> Dict[str, Dict]:
+    index = {}
+    for item in items:
+        index.setdefault(item['id'], item)
+    return index
+
+
+@dataclass
+class UserContextIndex:
+    """Lookup tables over the user context, built once per run.
+
+    In a studio-wide Kitsu the context lists thousands of persons and hundreds of
+    projects, so it should not be scanned for every lookup.
+    """
+
+    projects_by_id: Dict[str, Dict]
+    task_types_by_id: Dict[str, Dict]
+    # Map person id to its position in the context and the person itself
+    persons_by_id: Dict[str, Tuple[int, Dict]]
+    tvshows: List[Dict]
+
+    @classmethod
+    def from_context(cls, ctx) -> 'UserContextIndex':
+        persons_by_id = {}
+        for position, person in enumerate(ctx['persons']):
+            persons_by_id.setdefault(person['id'], (position, person))
+        return cls(
+            projects_by_id=index_dicts_by_id(ctx['projects']),
+            task_types_by_id=index_dicts_by_id(ctx['task_types']),
+            persons_by_id=persons_by_id,
+            tvshows=[p for p in ctx['projects'] if p['production_type'] == 'tvshow'],
+        )
+
+    def get_persons(self, person_ids) -> List[Dict]:
+        """Get the persons matching person_ids, in the order of the context."""
+        persons = [self.persons_by_id[i] for i in set(person_ids) if i in self.persons_by_id]
+        return [person for _, person in sorted(persons, key=lambda p: p[0])]
+
+
+# Types of Kitsu events, and the project documents they affect. Events of persons, task
+# types and statuses have no project, so they are not listed with the events of a project:
+# the project document, which depends on them, is built again by every export.
+EVENT_DOCUMENTS = {
+    'project': set(writers.PROJECT_DOCUMENTS),
+    'episode': {'project'},
+    'sequence': {'project', 'sequences', 'casting'},
+    'shot': {'shots', 'casting', 'task_counts'},
+    'asset': {'assets', 'casting'},
+    'task': {'shots', 'assets', 'task_counts'},
+    'comment': {'shots', 'assets', 'task_counts'},
+    'preview-file': {'shots', 'assets', 'edits'},
+    'edit': {'edits'},
+}
+# Types of Kitsu events that do not affect exported data
+IGNORED_EVENT_TYPES = {
+    'notification',
+    'news',
+    'playlist',
+    'build-job',
+    'schedule-item',
+    'time-spent',
+    'day-off',
+    'chat',
+}
+
+
+@dataclass
+class ProjectExportState:
+    """Saved next to the project data after each export, to allow incremental exports."""
+
+    # Creation time (as reported by Kitsu) of the latest event included in the export
+    last_event_at: Optional[str] = None
+
+    @staticmethod
+    def get_path(destination_path: pathlib.Path, project_id) -> pathlib.Path:
+        return destination_path / f"data/projects/{project_id}{writers.EXPORT_STATE_SUFFIX}"
+
+    @classmethod
+    def load(cls, destination_path: pathlib.Path, project_id) -> Optional['ProjectExportState']:
+        try:
+            return cls(**json.loads(cls.get_path(destination_path, project_id).read_text()))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def save(self, destination_path: pathlib.Path, project_id):
+        path = self.get_path(destination_path, project_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(asdict(self), indent=2))
+
+
 class KitsuWriter(writers.AbstractWriter):
     kitsu_client: KitsuClient
     user_context = None
+    user_context_index: UserContextIndex = None
+    # Number of concurrent requests for per-episode, per-sequence and per-edit endpoints
+    fanout_workers: int = 8
+    # Only export the documents affected by changes since the previous export
+    incremental: bool = False
+    # Maximum number of events fetched for an incremental export. If there are more
+    # changes than that, the project is exported again in full.
+    events_limit: int = 5000
+    # Use the memory-compact classes for assets, shots and their tasks (see CompactTask)
+    compact_models: bool = False
+    # Include the tasks of assets in the task counts, not only the tasks of shots
+    count_asset_tasks: bool = False
 
     @property
     def request_headers(self) -> Optional[Dict]:
         return self.kitsu_client.headers
 
+    def get_media_downloader(self) -> media.MediaDownloader:
+        # Share the connection pool with the API client, thumbnails come from the same host
+        return media.MediaDownloader(
+            session=self.kitsu_client.session,
+            workers=self.download_workers,
+            rate_limiter=self.get_download_rate_limiter(),
+        )
+
     def get_project_list(self) -> List[models.ProjectListItem]:
         # Project
         projects = []
+        tvshows = self.user_context_index.tvshows
+        episodes_per_project = dict(
+            zip(
+                [p['id'] for p in tvshows],
+                self.kitsu_client.get_json_many(
+                    [f"/data/projects/{p['id']}/episodes" for p in tvshows],
+                    workers=self.fanout_workers,
+                ),
+            )
+        )
         for project in self.user_context['projects']:
             episodes = []
             if project['production_type'] == 'tvshow':
-                r_episodes = self.kitsu_client.get(f"/data/projects/{project['id']}/episodes")
-                for episode in r_episodes.json():
+                r_episodes = episodes_per_project[project['id']]
+                for episode in r_episodes:
                     episodes.append(
                         models.EpisodeListItem(
                             id=episode['id'],
@@ -127,14 +478,18 @@ class KitsuWriter(writers.AbstractWriter):
         # Fetch episodes, if available
         episodes = []
         if project['production_type'] == 'tvshow':
-            r_episodes = self.kitsu_client.get(f"/data/projects/{project['id']}/episodes")
+            r_episodes = self.kitsu_client.get_json(f"/data/projects/{project['id']}/episodes")
+            sequences_per_episode = self.kitsu_client.get_json_many(
+                [
+                    f"/data/sequences?project_id={project['id']}&episode_id={episode['id']}"
+                    for episode in r_episodes
+                ],
+                workers=self.fanout_workers,
+            )
 
-            for episode in r_episodes.json():
+            for episode, r_sequences in zip(r_episodes, sequences_per_episode):
                 sequences = []
-                r_sequences = self.kitsu_client.get(
-                    f"/data/sequences?project_id={project['id']}&episode_id={episode['id']}"
-                )
-                for sequence in r_sequences.json():
+                for sequence in r_sequences:
                     sequences.append(
                         models.Sequence(
                             name=sequence['name'],
@@ -163,19 +518,17 @@ class KitsuWriter(writers.AbstractWriter):
             return sorted_ids
 
         ctx = self.user_context
+        ctx_index = self.user_context_index
         # Get the project from the contex
-        project_from_context = next(
-            filter(lambda item: item['id'] == project_id, ctx['projects']), None
-        )
+        project_from_context = ctx_index.projects_by_id.get(project_id)
         # Filter asset_types for project. If the project does not explicitly specify 'asset_types'
         # we use the ones from the context
         if 'asset_types' not in project_from_context:
             filtered_asset_types = ctx['asset_types']
         else:
+            asset_type_ids = set(project_from_context['asset_types'])
             filtered_asset_types = [
-                item
-                for item in ctx['asset_types']
-                if item['id'] in project_from_context['asset_types']
+                item for item in ctx['asset_types'] if item['id'] in asset_type_ids
             ]
 
         asset_types = [
@@ -195,7 +548,7 @@ class KitsuWriter(writers.AbstractWriter):
             if 'task_types_priority' in project_from_context:
                 task_type_ids = get_sorted_ids(project_from_context['task_types_priority'])
             for task_type_id in task_type_ids:
-                task_type = next(filter(lambda t: t['id'] == task_type_id, ctx['task_types']), None)
+                task_type = ctx_index.task_types_by_id.get(task_type_id)
                 if task_type:
                     filtered_task_types.append(task_type)
         task_types = [
@@ -212,10 +565,9 @@ class KitsuWriter(writers.AbstractWriter):
         if 'task_statuses' not in project_from_context:
             filtered_task_statuses = ctx['task_status']  # This is a discrepancy in the Kitsu API
         else:
+            task_status_ids = set(project_from_context['task_statuses'])
             filtered_task_statuses = [
-                item
-                for item in ctx['task_status']
-                if item['id'] in project_from_context['task_statuses']
+                item for item in ctx['task_status'] if item['id'] in task_status_ids
             ]
 
         task_statuses = [
@@ -234,8 +586,7 @@ class KitsuWriter(writers.AbstractWriter):
                 thumbnailUrl=f"{self.kitsu_client.base_url}/pictures/thumbnails/persons/{item['id']}.png",
                 has_avatar=True,
             )
-            for item in ctx['persons']
-            if item['id'] in project_from_context['team']
+            for item in ctx_index.get_persons(project_from_context['team'])
         ]
 
         # Build the Project
@@ -253,18 +604,29 @@ class KitsuWriter(writers.AbstractWriter):
             episodes=self.get_episodes(project_from_context),
         )
 
+    def get_task(self, task: Dict) -> models.Task:
+        task_class = models.CompactTask if self.compact_models else models.Task
+        return task_class(
+            task_status_id=task['task_status_id'],
+            task_type_id=task['task_type_id'],
+            assignees=task['assignees'],
+            # Keep the Kitsu id, rather than generating a new one on every export
+            id=task.get('id'),
+        )
+
     def get_project_assets(self, project) -> List[models.Asset]:
-        r_assets = self.kitsu_client.get(
+        r_assets = self.kitsu_client.get_json(
             '/data/assets/with-tasks', params={'project_id': project.id}
         )
         assets_list = []
 
-        for a in r_assets.json():
+        for a in r_assets:
             if a['canceled']:
                 continue
             logging.debug(f"Processing asset {a['name']}")
 
-            asset = models.Asset(
+            asset_class = models.CompactAsset if self.compact_models else models.Asset
+            asset = asset_class(
                 id=a['id'],
                 asset_type_id=a['asset_type_id'],
                 name=a['name'],
@@ -275,34 +637,33 @@ class KitsuWriter(writers.AbstractWriter):
 
             # Format data as expected by edit breakdown
             for task in a['tasks']:
-                asset.tasks.append(
-                    models.Task(
-                        task_status_id=task['task_status_id'],
-                        task_type_id=task['task_type_id'],
-                        assignees=task['assignees'],
-                    )
-                )
+                asset.tasks.append(self.get_task(task))
             assets_list.append(asset)
         return assets_list
 
     def get_project_sequences(self, project) -> List[models.Sequence]:
-        r_sequences = self.kitsu_client.get('/data/sequences', params={'project_id': project.id})
+        r_sequences = self.kitsu_client.get_json(
+            '/data/sequences', params={'project_id': project.id}
+        )
         sequences_list = []
-        for sequence in r_sequences.json():
+        for sequence in r_sequences:
             sequences_list.append(models.Sequence(name=sequence['name'], id=sequence['id']))
         return sequences_list
 
     def get_project_shots(self, project: models.Project) -> List[models.Shot]:
-        r_shots = self.kitsu_client.get('/data/shots/with-tasks', params={'project_id': project.id})
+        r_shots = self.kitsu_client.get_json(
+            '/data/shots/with-tasks', params={'project_id': project.id}
+        )
         shots = []
 
-        for s in r_shots.json():
+        for s in r_shots:
             logging.debug(f"Processing shot {s['name']}")
             if 'frame_in' not in s['data'] or not s['data']['frame_in']:
                 logging.debug("Skipping shot with no frame_in data")
                 continue
 
-            shot = models.Shot(
+            shot_class = models.CompactShot if self.compact_models else models.Shot
+            shot = shot_class(
                 id=s['id'],
                 name=s['name'],
                 sequence_id=s['sequence_id'],
@@ -315,21 +676,20 @@ class KitsuWriter(writers.AbstractWriter):
                 shot.thumbnailUrl = f"{self.kitsu_client.base_url}/pictures/thumbnails/preview-files/{s['preview_file_id']}.png"
             # Format data as expected by edit breakdown
             for task in s['tasks']:
-                shot.tasks.append(
-                    (
-                        models.Task(
-                            task_status_id=task['task_status_id'],
-                            task_type_id=task['task_type_id'],
-                            assignees=task['assignees'],
-                        )
-                    )
-                )
+                shot.tasks.append(self.get_task(task))
             shots.append(shot)
         return shots
 
     def get_task_count(self, project_id):
-        r_shots = self.kitsu_client.get('/data/shots/with-tasks', params={'project_id': project_id})
-        return writers.ProjectWriter.count_tasks(r_shots.json(), datetime.datetime.now())
+        r_shots = self.kitsu_client.get_json(
+            '/data/shots/with-tasks', params={'project_id': project_id}
+        )
+        r_assets = []
+        if self.count_asset_tasks:
+            r_assets = self.kitsu_client.get_json(
+                '/data/assets/with-tasks', params={'project_id': project_id}
+            )
+        return writers.ProjectWriter.count_tasks(r_shots, datetime.datetime.now(), r_assets)
 
     def get_project_casting(
         self,
@@ -339,21 +699,20 @@ class KitsuWriter(writers.AbstractWriter):
         assets: List[models.Asset],
     ) -> List[models.ShotCasting]:
         shot_castings = []
-        for sequence in sequences:
-            r_casting = self.kitsu_client.get(
-                f"/data/projects/{project.id}/sequences/{sequence.id}/casting"
-            )
-            casting_per_shot = r_casting.json()
+        # Index shots and assets once, instead of scanning the lists for every cast entry
+        shots_by_id = models.index_by_id(shots)
+        assets_by_id = models.index_by_id(assets)
+        casting_per_sequence = self.kitsu_client.get_json_many(
+            [f"/data/projects/{project.id}/sequences/{s.id}/casting" for s in sequences],
+            workers=self.fanout_workers,
+        )
+        for casting_per_shot in casting_per_sequence:
             if not casting_per_shot:
                 continue
             for shot_id, cast_assets in casting_per_shot.items():
-                # Lookup shot in the Shots list
-                shot = next((s for s in shots if s.id == shot_id), None)
-                shot_casting = models.ShotCasting(shot=shot)
+                shot_casting = models.ShotCasting(shot=shots_by_id.get(shot_id))
                 for ca in cast_assets:
-                    # Lookup each cast asset in the Assets list
-                    asset = next((a for a in assets if a.id == ca['asset_id']), None)
-                    shot_casting.assets.append(asset)
+                    shot_casting.assets.append(assets_by_id.get(ca['asset_id']))
                 shot_castings.append(shot_casting)
 
         return shot_castings
@@ -361,24 +720,36 @@ class KitsuWriter(writers.AbstractWriter):
     def get_project_edits(self, project: models.Project):
         logging.info(f"Getting edits for %s" % project.name)
         # Get first edit (if exists)
-        r_edits = self.kitsu_client.get('/data/edits/with-tasks', params={'project_id': project.id})
+        r_edits = self.kitsu_client.get_json(
+            '/data/edits/with-tasks', params={'project_id': project.id}
+        )
         edits = []
-        for e in r_edits.json():
-            if e['canceled']:
-                continue
-            # Get preview-files from the first task found (usually only one)
-            r_previews = self.kitsu_client.get(f"/data/edits/{e['id']}/preview-files")
-            # Get the Edit task types (so we can identify the task of type "Edit")
-            r_task_types = self.kitsu_client.get(f"/data/edits/{e['id']}/task-types")
+        active_edits = [e for e in r_edits if not e['canceled']]
+        # Get preview-files from the first task found (usually only one), and the Edit task
+        # types (so we can identify the task of type "Edit")
+        edit_responses = self.kitsu_client.get_json_many(
+            [
+                path
+                for e in active_edits
+                for path in (
+                    f"/data/edits/{e['id']}/preview-files",
+                    f"/data/edits/{e['id']}/task-types",
+                )
+            ],
+            workers=self.fanout_workers,
+            project_id=project.id,
+        )
+        for i, e in enumerate(active_edits):
+            r_previews, r_task_types = edit_responses[2 * i : 2 * i + 2]
             edit_task_id = None
-            for task_type in r_task_types.json():
+            for task_type in r_task_types:
                 if task_type['name'] != 'Edit':
                     continue
                 # Save the edit task id, so we look it up when listing the preview-files
                 edit_task_id = task_type['id']
             # Get the first preview (last revision)
             latest_preview = None
-            for task_type_id, preview_list in r_previews.json().items():
+            for task_type_id, preview_list in r_previews.items():
                 if edit_task_id != task_type_id:
                     continue
                 latest_preview = preview_list[0]
@@ -412,6 +783,92 @@ class KitsuWriter(writers.AbstractWriter):
             )
         return edits
 
+    def get_events(self, project_id, after: Optional[str] = None, limit=None) -> List[Dict]:
+        """Get the Kitsu events of a project (most recent first), optionally only the ones
+        created after a timestamp."""
+        params = {'project_id': project_id, 'limit': limit or self.events_limit}
+        if after:
+            params['after'] = after
+        return self.kitsu_client.get('/data/events/last', params=params).json()
+
+    def get_stale_documents(self, events: List[Dict]) -> Optional[Set[str]]:
+        """Get the project documents affected by events.
+
+        Returns None if the events do not allow an incremental update, and the whole
+        project should be exported again.
+        """
+        if len(events) >= self.events_limit:
+            # Some events might be missing
+            return None
+        documents = set()
+        for event in events:
+            entity_type, _, action = event['name'].partition(':')
+            if action == 'casting-update':
+                documents.add('casting')
+            elif entity_type in EVENT_DOCUMENTS:
+                documents.update(EVENT_DOCUMENTS[entity_type])
+            elif entity_type not in IGNORED_EVENT_TYPES:
+                logging.debug(f"Unknown event {event['name']}, exporting everything")
+                return None
+        return documents
+
+    def write_project_incremental(self, project_id, destination_path: pathlib.Path):
+        """Only rebuild the documents affected by the Kitsu events that happened since the
+        previous export. The first export of a project is always a full one."""
+        state = ProjectExportState.load(destination_path, project_id)
+        has_documents = all(
+            (destination_path / f"data/projects/{project_id}/{name}.json").is_file()
+            for name in writers.PROJECT_DOCUMENTS
+        )
+        documents = None
+        if state and state.last_event_at and has_documents:
+            events = self.get_events(project_id, after=state.last_event_at)
+            documents = self.get_stale_documents(events)
+            last_event_at = max((e['created_at'] for e in events), default=state.last_event_at)
+        else:
+            # Query the last event before exporting, so that changes happening during the
+            # export are picked up by the next one
+            latest_events = self.get_events(project_id, limit=1)
+            last_event_at = (
+                latest_events[0]['created_at']
+                if latest_events
+                else datetime.datetime.utcnow().isoformat()
+            )
+
+        if documents is None:
+            logging.info(f"Exporting all data of project {project_id}")
+            super().write_project(project_id, destination_path)
+        else:
+            if documents:
+                logging.info(f"Exporting {', '.join(sorted(documents))} of project {project_id}")
+            else:
+                logging.info(f"No changes in project {project_id} since {state.last_event_at}")
+            # The project document is always built again: it also depends on persons, task
+            # types and statuses, whose events are not related to a project. Task counts
+            # are extended to this export, even if they did not change.
+            super().write_project(
+                project_id,
+                destination_path,
+                documents | {'project', 'task_counts'},
+                count_tasks='task_counts' in documents,
+            )
+        ProjectExportState(last_event_at=last_event_at).save(destination_path, project_id)
+
+    def write_project(
+        self,
+        project_id,
+        destination_path: pathlib.Path,
+        documents: Optional[Collection[str]] = None,
+    ):
+        try:
+            if self.incremental and documents is None:
+                self.write_project_incremental(project_id, destination_path)
+            else:
+                super().write_project(project_id, destination_path, documents)
+        finally:
+            # Cached responses are only reused within the export of a project
+            self.kitsu_client.clear_cache(project_id)
+
     # def write_project(self, project_id, destination_path):
     #     project_writer = self._get_project_writer(project_id, destination_path)
     #     # project_writer.download_previews(self.request_headers)
@@ -422,21 +879,134 @@ class KitsuWriter(writers.AbstractWriter):
 
     def __init__(self, kitsu_client: Optional[KitsuClient] = None):
         self.kitsu_client = kitsu_client or KitsuClient()
-        self.user_context = self.kitsu_client.get('/data/user/context').json()
+        self.user_context = self.kitsu_client.get_json('/data/user/context')
+        self.user_context_index = UserContextIndex.from_context(self.user_context)
+
+
+class AsyncKitsuWriter(KitsuWriter):
+    """KitsuWriter fetching the data of a project concurrently, with asyncio.
+
+    Sequences, shots, assets and edits are requested at the same time, and thumbnails
+    are downloaded while casting and task counts are being built. Requests go through
+    the pooled session of the client, in worker threads, and the output is the same as
+    with KitsuWriter.
+    """
+
+    # Number of data sources fetched at the same time
+    max_concurrency: int = 4
+
+    async def _run(self, semaphore: asyncio.Semaphore, function, *args, **kwargs):
+        async with semaphore:
+            return await asyncio.to_thread(function, *args, **kwargs)
+
+    async def write_project_documents_async(
+        self,
+        project_id,
+        destination_path: pathlib.Path,
+        documents: Collection[str],
+        count_tasks: bool = True,
+    ):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        sources = set().union(*(writers.DOCUMENT_SOURCES[d] for d in documents))
+        project = await self._run(semaphore, self.get_project, project_id)
+
+        async def get_source(name, function):
+            return await self._run(semaphore, function, project) if name in sources else []
+
+        edits_task = asyncio.ensure_future(get_source('edits', self.get_project_edits))
+        sequences, shots, assets = await asyncio.gather(
+            get_source('sequences', self.get_project_sequences),
+            get_source('shots', self.get_project_shots),
+            get_source('assets', self.get_project_assets),
+        )
+        project_writer = writers.ProjectWriter(
+            project=project,
+            shots=shots,
+            assets=assets,
+            sequences=sequences,
+            edits=[],
+            casting=[],
+            destination_path=destination_path,
+            json_format=self.json_format,
+        )
+        # Thumbnails only depend on shots, assets and the team
+        previews_task = asyncio.ensure_future(
+            asyncio.to_thread(
+                project_writer.download_previews,
+                self.request_headers,
+                downloader=self.get_media_downloader(),
+                revalidate=self.revalidate_media,
+            )
+        )
+        task_count_task = None
+        if 'task_counts' in documents and count_tasks:
+            # Once shots (and assets) are fetched, so that responses come from the cache
+            task_count_task = asyncio.ensure_future(
+                self._run(semaphore, self.get_task_count, project_id)
+            )
+        if 'casting' in documents:
+            project_writer.casting = await self._run(
+                semaphore, self.get_project_casting, project, sequences, shots, assets
+            )
+        project_writer.edits = await edits_task
+        if 'edits' in documents:
+            edits_download = asyncio.to_thread(
+                project_writer.download_edits,
+                self.request_headers,
+                revalidate=self.revalidate_media,
+                downloader=self.get_media_downloader(),
+            )
+            await asyncio.gather(previews_task, edits_download)
+        else:
+            await previews_task
+        if 'task_counts' in documents:
+            current_task_count = await task_count_task if task_count_task else None
+            project_writer.merge_task_counts(current_task_count, self.task_count_retention)
+        project_writer.write_as_json(documents)
+
+    def _write_project_documents(
+        self,
+        project_id,
+        destination_path: pathlib.Path,
+        documents: Collection[str],
+        count_tasks: bool = True,
+    ):
+        asyncio.run(
+            self.write_project_documents_async(project_id, destination_path, documents, count_tasks)
+        )
 
 
 def main(args):
     parsed_args = argparser.parse_args(args)
     destination_path = parsed_args.destination_path
 
-    kitsu_writer = KitsuWriter()
+    kitsu_client = KitsuClient(
+        max_in_flight=parsed_args.max_in_flight, requests_per_second=parsed_args.rate_limit
+    )
+    writer_class = AsyncKitsuWriter if parsed_args.async_fetch else KitsuWriter
+    kitsu_writer = writer_class(kitsu_client=kitsu_client)
+    kitsu_writer.download_workers = parsed_args.download_workers
+    kitsu_writer.download_rate_limit = parsed_args.download_rate_limit
+    kitsu_writer.revalidate_media = parsed_args.revalidate_media
+    kitsu_writer.incremental = parsed_args.incremental
+    kitsu_writer.json_format = parsed_args.json_format
+    kitsu_writer.compact_models = parsed_args.compact_models
+    kitsu_writer.count_asset_tasks = parsed_args.count_asset_tasks
     if parsed_args.project_ids:
-        for project_id in parsed_args.project_ids:
-            kitsu_writer.write_project(project_id, destination_path)
+        results = kitsu_writer.write_projects(
+            parsed_args.project_ids, destination_path, jobs=parsed_args.jobs
+        )
     else:
-        kitsu_writer.write_all(destination_path)
+        results = kitsu_writer.write_all(destination_path, jobs=parsed_args.jobs)
         if parsed_args.bundle:
-            writers.WatchtowerBundler.bundle(destination_path)
+            writers.WatchtowerBundler.bundle(
+                destination_path, mode=parsed_args.bundle_mode, workers=parsed_args.download_workers
+            )
+    cache_stats = kitsu_client.cache_stats
+    logging.info(f"Kitsu responses: {cache_stats.misses} fetched, {cache_stats.hits} from cache")
+    logging.info(f"Kitsu latency: {kitsu_client.scheduler.latency}")
+    if any(result.error for result in results):
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,435 @@
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from tqdm import tqdm
+
+# Status codes worth retrying, every other HTTP error is reported right away
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# Sidecar file storing the validators of a downloaded file
+CACHE_SUFFIX = '.meta.json'
+# Suffix of files being written
+PARTIAL_SUFFIX = '.part'
+DEFAULT_CHUNK_SIZE = 1024 * 1024  # 1 Mebibyte
+
+
+@dataclass
+class MediaCacheEntry:
+    """Validators of a downloaded file, stored in a sidecar file next to it.
+
+    They are used to revalidate the file with a conditional GET, so that an unchanged
+    file costs a single 304 response instead of a full download.
+    """
+
+    url: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    content_length: Optional[int] = None
+
+    @staticmethod
+    def get_path(dst: pathlib.Path) -> pathlib.Path:
+        return dst.with_name(f"{dst.name}{CACHE_SUFFIX}")
+
+    @property
+    def validator(self) -> Optional[str]:
+        """The strongest available validator, as used in an If-Range header."""
+        return self.etag or self.last_modified
+
+    @classmethod
+    def from_response(
+        cls, url, response: requests.Response, content_length: Optional[int] = None
+    ) -> 'MediaCacheEntry':
+        return cls(
+            url=url,
+            etag=response.headers.get('etag'),
+            last_modified=response.headers.get('last-modified'),
+            content_length=content_length,
+        )
+
+    @classmethod
+    def load(cls, dst: pathlib.Path) -> Optional['MediaCacheEntry']:
+        try:
+            return cls(**json.loads(cls.get_path(dst).read_text()))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def save(self, dst: pathlib.Path):
+        path = self.get_path(dst)
+        tmp_path = path.with_name(f"{path.name}{PARTIAL_SUFFIX}")
+        tmp_path.write_text(json.dumps(asdict(self)))
+        os.replace(tmp_path, path)
+
+    def get_conditional_headers(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def matches(self, url, dst: pathlib.Path) -> bool:
+        """Check that the entry describes dst as downloaded from url."""
+        if self.url != url:
+            return False
+        return self.content_length is None or self.content_length == dst.stat().st_size
+
+
+class DownloadError(requests.RequestException):
+    """The downloaded content is incomplete or does not match the expected checksum."""
+
+
+def parse_content_range(content_range: str) -> Tuple[int, Optional[int]]:
+    """Parse a 'bytes 100-199/200' header into its start and total size."""
+    try:
+        unit, _, byte_range = content_range.partition(' ')
+        span, _, total = byte_range.partition('/')
+        start = int(span.partition('-')[0])
+        return start, None if total == '*' else int(total)
+    except (AttributeError, ValueError):
+        raise DownloadError(f"Invalid Content-Range header: {content_range}")
+
+
+def get_file_digest(path: pathlib.Path, algorithm='sha256', chunk_size=DEFAULT_CHUNK_SIZE) -> str:
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def verify_checksum(path: pathlib.Path, checksum: str):
+    """Check the file against a checksum formatted as '<algorithm>:<hex digest>'.
+
+    The algorithm can be omitted, in which case sha256 is used.
+    """
+    algorithm, _, expected = checksum.rpartition(':')
+    actual = get_file_digest(path, algorithm or 'sha256')
+    if actual.lower() != expected.lower():
+        raise DownloadError(f"Checksum mismatch for {path}: expected {expected}, got {actual}")
+
+
+def fetch_and_save_media(
+    src_url,
+    headers,
+    dst: pathlib.Path,
+    force=False,
+    display_progress=False,
+    session: Optional[requests.Session] = None,
+    revalidate=False,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    resume=True,
+    checksum: Optional[str] = None,
+) -> bool:
+    """Download src_url to dst, and return True if dst was (re)written.
+
+    An existing dst is kept as is, unless:
+    - force is set, then it is downloaded again
+    - revalidate is set, then a conditional GET based on the validators stored by the
+      previous download checks if the file changed upstream
+
+    The file is streamed in chunks of chunk_size bytes to a '.part' file, which is moved to
+    dst only once complete (and, if a checksum is given, verified). If resume is set and a
+    previous attempt was interrupted, the download continues from where it stopped with
+    an HTTP Range request. An incomplete or corrupt download raises DownloadError, and dst
+    is never replaced by a partial file.
+    """
+    request_headers = dict(headers or {})
+    if dst.is_file() and not force:
+        if not revalidate:
+            return False
+        cache_entry = MediaCacheEntry.load(dst)
+        if cache_entry and cache_entry.matches(src_url, dst):
+            request_headers.update(cache_entry.get_conditional_headers())
+    tmp_dst = dst.with_name(f"{dst.name}{PARTIAL_SUFFIX}")
+    resume_from = 0
+    if resume and tmp_dst.is_file():
+        partial_entry = MediaCacheEntry.load(tmp_dst)
+        if partial_entry and partial_entry.url == src_url and partial_entry.validator:
+            resume_from = tmp_dst.stat().st_size
+            request_headers['Range'] = f"bytes={resume_from}-"
+            # If the file changed upstream since, the server sends the whole file instead
+            request_headers['If-Range'] = partial_entry.validator
+    response = (session or requests).get(src_url, headers=request_headers, stream=True)
+    if response.status_code == 304:
+        response.close()
+        logging.debug(f"Not modified {src_url}")
+        return False
+    if response.status_code == 416 and resume_from:
+        # The partial file does not match upstream anymore, start from scratch
+        response.close()
+        discard_partial_download(tmp_dst)
+        return fetch_and_save_media(
+            src_url,
+            headers,
+            dst,
+            force=force,
+            display_progress=display_progress,
+            session=session,
+            revalidate=revalidate,
+            chunk_size=chunk_size,
+            resume=False,
+            checksum=checksum,
+        )
+    # Release the connection to the pool whatever happens, a leaked one would block the
+    # requests waiting for a free connection
+    with response:
+        response.raise_for_status()
+        if response.status_code == 206:
+            start, total_size_in_bytes = parse_content_range(response.headers.get('content-range'))
+            if start != resume_from:
+                discard_partial_download(tmp_dst)
+                raise DownloadError(f"Unexpected range start {start} for {src_url}")
+            mode = 'ab'
+            logging.debug(f"Resuming {src_url} from byte {resume_from}")
+        else:
+            resume_from = 0
+            content_length = response.headers.get('content-length')
+            total_size_in_bytes = int(content_length) if content_length else None
+            mode = 'wb'
+        # With a content encoding the size on disk does not match the transferred size
+        if response.headers.get('content-encoding', 'identity') != 'identity':
+            total_size_in_bytes = None
+        cache_entry = MediaCacheEntry.from_response(
+            src_url, response, content_length=total_size_in_bytes
+        )
+        resumable = resume and bool(cache_entry.validator)
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        if resumable:
+            cache_entry.save(tmp_dst)
+        # Set a variable that semantically matches tqdm API (the inverse of what we want our API to do)
+        disable_progress = not display_progress
+        progress_bar = tqdm(
+            desc='Downloading edit',
+            initial=resume_from,
+            total=total_size_in_bytes or 0,
+            unit='iB',
+            unit_scale=True,
+            disable=disable_progress,
+            ascii=' >=',
+        )
+        try:
+            with open(tmp_dst, mode) as file:
+                for data in response.iter_content(chunk_size):
+                    progress_bar.update(len(data))
+                    file.write(data)
+        except BaseException:
+            # Keep what was downloaded so far if the next attempt can resume from it
+            if not resumable:
+                discard_partial_download(tmp_dst)
+            raise
+        finally:
+            progress_bar.close()
+        downloaded_size = tmp_dst.stat().st_size
+        if total_size_in_bytes is not None and downloaded_size != total_size_in_bytes:
+            if downloaded_size > total_size_in_bytes:
+                discard_partial_download(tmp_dst)
+            raise DownloadError(
+                f"Incomplete download of {src_url}: "
+                f"{downloaded_size} of {total_size_in_bytes} bytes"
+            )
+        if checksum:
+            try:
+                verify_checksum(tmp_dst, checksum)
+            except DownloadError:
+                discard_partial_download(tmp_dst)
+                raise
+        # Replace the file in one step, readers see either the old or the new version
+        os.replace(tmp_dst, dst)
+        cache_entry.save(dst)
+        MediaCacheEntry.get_path(tmp_dst).unlink(missing_ok=True)
+        return True
+
+
+def discard_partial_download(tmp_dst: pathlib.Path):
+    tmp_dst.unlink(missing_ok=True)
+    MediaCacheEntry.get_path(tmp_dst).unlink(missing_ok=True)
+
+
+def get_backoff_delay(attempt: int, backoff: float) -> float:
+    """Exponential backoff with full jitter, attempt starts at 0."""
+    return random.uniform(0, backoff * 2**attempt)
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and error.response.status_code in RETRY_STATUS_CODES
+    return isinstance(
+        error,
+        (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+            DownloadError,
+        ),
+    )
+
+
+class HostRateLimiter:
+    """Space out requests to the same host, so that at most requests_per_second start
+    every second. Requests to different hosts do not affect each other."""
+
+    def __init__(self, requests_per_second: Optional[float] = None):
+        self.interval = 1 / requests_per_second if requests_per_second else 0
+        self._next_slot: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        if not self.interval:
+            return
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+@dataclass
+class DownloadJob:
+    src_url: str
+    dst: pathlib.Path
+    # Called once the file is available at dst
+    on_success: List[Callable[[], None]] = field(default_factory=list)
+
+
+class MediaDownloader:
+    """Download many files concurrently, using a pool of worker threads.
+
+    - workers: how many downloads run at the same time
+    - requests_per_second: optional per-host rate limit, or rate_limiter: a
+      HostRateLimiter shared with other downloaders
+    - retries: how many times a failed download is attempted again, waiting with an
+      exponential backoff (starting from `backoff` seconds) between attempts
+    """
+
+    def __init__(
+        self,
+        session: Optional[requests.Session] = None,
+        workers: int = 8,
+        requests_per_second: Optional[float] = None,
+        retries: int = 3,
+        backoff: float = 0.5,
+        rate_limiter: Optional[HostRateLimiter] = None,
+    ):
+        self.session = session or requests.Session()
+        self.workers = max(1, workers)
+        self.rate_limiter = rate_limiter or HostRateLimiter(requests_per_second)
+        self.retries = retries
+        self.backoff = backoff
+
+    def fetch(
+        self,
+        job: DownloadJob,
+        headers: Optional[Dict] = None,
+        force=False,
+        revalidate=False,
+        **kwargs,
+    ) -> bool:
+        """Download a single job, retrying on failure.
+
+        Extra keyword arguments are passed to fetch_and_save_media. Since interrupted
+        downloads are resumed, a retry only fetches the missing part of the file.
+        """
+        for attempt in range(self.retries + 1):
+            self.rate_limiter.wait(job.src_url)
+            try:
+                return fetch_and_save_media(
+                    job.src_url,
+                    headers,
+                    job.dst,
+                    force=force,
+                    session=self.session,
+                    revalidate=revalidate,
+                    **kwargs,
+                )
+            except requests.RequestException as e:
+                if attempt == self.retries or not is_retryable(e):
+                    raise
+                delay = get_backoff_delay(attempt, self.backoff)
+                logging.debug(f"Retrying {job.src_url} in {delay:.2f}s ({e})")
+                time.sleep(delay)
+
+    def download(
+        self,
+        jobs: List[DownloadJob],
+        headers: Optional[Dict] = None,
+        force=False,
+        desc="Downloading",
+        display_progress=True,
+        revalidate=False,
+    ) -> List[DownloadJob]:
+        """Download all jobs and return the ones that failed.
+
+        The on_success callbacks run in the calling thread, in the order jobs complete.
+        """
+        failed = []
+        progress_bar = tqdm(total=len(jobs), desc=desc, disable=not display_progress, ascii=' >=')
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {
+                executor.submit(self.fetch, job, headers, force, revalidate): job for job in jobs
+            }
+            for future in as_completed(futures):
+                job = futures[future]
+                progress_bar.update(1)
+                try:
+                    future.result()
+                except requests.RequestException as e:
+                    logging.error(f"Error downloading {job.src_url}: {e}")
+                    failed.append(job)
+                    continue
+                for callback in job.on_success:
+                    callback()
+        progress_bar.close()
+        return failed
+
+    def download_thumbnails(
+        self,
+        entities,
+        base_path: pathlib.Path,
+        path: Optional[pathlib.Path] = None,
+        headers: Optional[Dict] = None,
+        force=False,
+        desc="Downloading thumbnails",
+        display_progress=True,
+        revalidate=False,
+    ) -> List[DownloadJob]:
+        """Download the thumbnails of entities using StaticPreviewMixin.
+
+        Like StaticPreviewMixin.download_and_assign_thumbnail, each entity's thumbnailUrl
+        is replaced with the local path, which the static site can load without
+        authentication. This also happens when the download fails: the file of a previous
+        export may still be there, and the next export starts from the remote url again.
+        Entities sharing the same thumbnail only trigger one download.
+        """
+        jobs: Dict[pathlib.Path, DownloadJob] = {}
+        destinations = []
+        for entity in entities:
+            dst_url = entity.get_thumbnail_destination(path)
+            if not dst_url:
+                continue
+            dst = base_path / dst_url
+            if dst not in jobs:
+                jobs[dst] = DownloadJob(src_url=entity.thumbnailUrl, dst=dst)
+            destinations.append((entity, dst_url))
+        failed = self.download(
+            list(jobs.values()),
+            headers=headers,
+            force=force,
+            desc=desc,
+            display_progress=display_progress,
+            revalidate=revalidate,
+        )
+        for entity, dst_url in destinations:
+            entity.thumbnailUrl = str(dst_url)
+        return failed
@@ -2,14 +2,14 @@ import datetime
 import hashlib
 import logging
 import pathlib
-import requests
 from urllib.parse import urlparse
-from tqdm import tqdm
 import sys
 import uuid
 from dataclasses import dataclass, asdict, field
 from typing import Any, Dict, List, TypedDict, Optional
 
+from watchtower_pipeline.media import fetch_and_save_media
+
 
 logging.basicConfig(
     level=logging.INFO,
@@ -18,33 +18,18 @@ logging.basicConfig(
 )
 
 
-def fetch_and_save_media(src_url, headers, dst: pathlib.Path, force=False, display_progress=False):
-    if dst.is_file() and not force:
-        return
-    response = requests.get(src_url, headers=headers, stream=True)
-    total_size_in_bytes = int(response.headers.get('content-length', 0))
-    block_size = 1024  # 1 Kibibyte
-    # Set a variable that semantically matches tqdm API (the inverse of what we want our API to do)
-    disable_progress = not display_progress
-    progress_bar = tqdm(
-        desc='Downloading edit',
-        total=total_size_in_bytes,
-        unit='iB',
-        unit_scale=True,
-        disable=disable_progress,
-        ascii=' >=',
-    )
-    dst.parent.mkdir(parents=True, exist_ok=True)
-    with open(dst, 'wb') as file:
-        for data in response.iter_content(block_size):
-            progress_bar.update(len(data))
-            file.write(data)
-    progress_bar.close()
-    if display_progress and total_size_in_bytes != 0 and progress_bar.n != total_size_in_bytes:
-        logging.error(f"Error downloading {src_url}")
+def index_by_id(entities) -> Dict[str, Any]:
+    """Map the id of each entity to the entity. For duplicate ids, the first one wins,
+    like a linear search of the list would."""
+    index = {}
+    for entity in entities:
+        index.setdefault(entity.id, entity)
+    return index
 
 
 class StaticPreviewMixin:
+    # No instance attributes, so that slotted subclasses do not get a __dict__
+    __slots__ = ()
     thumbnailUrl = None
 
     @staticmethod
@@ -65,6 +50,25 @@ class StaticPreviewMixin:
         filename = f'{file_id}.png'
         return pathlib.Path('data') / path / file_id[:2] / filename
 
+    def get_thumbnail_destination(
+        self, path: Optional[pathlib.Path] = None
+    ) -> Optional[pathlib.Path]:
+        """Get the local path (relative to the site root) for the thumbnail.
+
+        Returns None if there is nothing to download, because there is no thumbnail or
+        because self.thumbnailUrl already points to a local file.
+        """
+        src_url = self.thumbnailUrl
+        if not src_url:
+            return None
+        result = urlparse(src_url)
+        if not all([result.scheme, result.netloc]):
+            logging.debug("Skipping local url. This file was already processed.")
+            return None
+        if not path:
+            path = pathlib.Path('')
+        return self.generate_preview_file_path(self.hash_filename(src_url), path)
+
     def download_and_assign_thumbnail(
         self,
         base_path: pathlib.Path,
@@ -80,15 +84,9 @@ class StaticPreviewMixin:
         """
         src_url = self.thumbnailUrl
         logging.debug(f"Downloading {self.name}, {src_url}")
-        if not src_url:
-            return
-        result = urlparse(src_url)
-        if not all([result.scheme, result.netloc]):
-            logging.debug("Skipping local url. This file was already processed.")
+        dst_url = self.get_thumbnail_destination(path)
+        if not dst_url:
             return
-        if not path:
-            path = pathlib.Path('')
-        dst_url = self.generate_preview_file_path(self.hash_filename(src_url), path)
         dst = base_path / dst_url
         fetch_and_save_media(src_url, requests_headers, dst, force=force)
         setattr(self, 'thumbnailUrl', str(dst_url))
@@ -115,6 +113,9 @@ class AssetType(IdMixin):
 
     id: Optional[str] = None
 
+    def to_dict(self) -> Dict[str, Any]:
+        return {'name': self.name, 'id': self.id}
+
 
 @dataclass
 class TaskType(IdMixin):
@@ -124,6 +125,9 @@ class TaskType(IdMixin):
     for_shots: bool = False
     id: Optional[str] = None
 
+    def to_dict(self) -> Dict[str, Any]:
+        return {'name': self.name, 'color': self.color, 'for_shots': self.for_shots, 'id': self.id}
+
 
 @dataclass
 class TaskStatus(IdMixin):
@@ -132,6 +136,9 @@ class TaskStatus(IdMixin):
     color: str  # A hex color
     id: Optional[str] = None
 
+    def to_dict(self) -> Dict[str, Any]:
+        return {'name': self.name, 'color': self.color, 'id': self.id}
+
 
 @dataclass
 class User(StaticPreviewMixin, IdMixin):
@@ -155,6 +162,9 @@ class User(StaticPreviewMixin, IdMixin):
 
 @dataclass
 class JsonMixin:
+    """Generic serialization. The models written in bulk define their own to_dict(), with
+    the same output as asdict() but without its recursive introspection and deep copies."""
+
     def to_dict(self) -> Dict[str, Any]:
         return asdict(self)
 
@@ -179,6 +189,14 @@ class Task:
     def __post_init__(self):
         self.id = self.id or self.get_new_uuid()
 
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'task_status_id': self.task_status_id,
+            'task_type_id': self.task_type_id,
+            'assignees': list(self.assignees),
+            'id': self.id,
+        }
+
 
 @dataclass
 class Asset(StaticPreviewMixin, IdMixin):
@@ -189,6 +207,15 @@ class Asset(StaticPreviewMixin, IdMixin):
     id: Optional[str] = None
     thumbnailUrl: Optional[str] = None
 
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'asset_type_id': self.asset_type_id,
+            'tasks': [t.to_dict() for t in self.tasks],
+            'id': self.id,
+            'thumbnailUrl': self.thumbnailUrl,
+        }
+
 
 class ShotData(TypedDict):
     """Shot metadata (usually custom defined in the production tracker)"""
@@ -215,6 +242,114 @@ class Shot(StaticPreviewMixin, IdMixin):
         self.startFrame = int(self.data['frame_in'])
         self.durationSeconds = (int(self.data['frame_out']) - self.startFrame) / self.fps
 
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'sequence_id': self.sequence_id,
+            'data': dict(self.data),
+            'tasks': [t.to_dict() for t in self.tasks],
+            'startFrame': self.startFrame,
+            'durationSeconds': self.durationSeconds,
+            'id': self.id,
+            'thumbnailUrl': self.thumbnailUrl,
+            'fps': self.fps,
+        }
+
+
+class CompactMixin:
+    """Comparison and representation for classes with __slots__, in the style of the
+    dataclasses they stand in for."""
+
+    __slots__ = ()
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{self.__class__.__name__}({fields})"
+
+
+class CompactTask(CompactMixin):
+    """A memory-compact Task, for productions with many tasks.
+
+    Instances have no __dict__, and their ids are interned: all the tasks share a single
+    copy of each task type, status and assignee id. A new id is only generated if none
+    is given.
+    """
+
+    __slots__ = ('task_status_id', 'task_type_id', 'assignees', 'id')
+
+    def __init__(self, task_status_id: str, task_type_id: str, assignees=(), id=None):
+        self.task_status_id = sys.intern(task_status_id)
+        self.task_type_id = sys.intern(task_type_id)
+        self.assignees = tuple(sys.intern(a) for a in assignees)
+        self.id = id or Task.get_new_uuid()
+
+    to_dict = Task.to_dict
+
+
+class CompactAsset(CompactMixin, StaticPreviewMixin):
+    """A memory-compact Asset, usually with CompactTask tasks."""
+
+    __slots__ = ('name', 'asset_type_id', 'tasks', 'id', 'thumbnailUrl')
+
+    def __init__(
+        self,
+        name: str,
+        asset_type_id: str,
+        tasks: Optional[List[CompactTask]] = None,
+        id: Optional[str] = None,
+        thumbnailUrl: Optional[str] = None,
+    ):
+        self.name = name
+        self.asset_type_id = sys.intern(asset_type_id)
+        self.tasks = tasks if tasks is not None else []
+        self.id = id or IdMixin.get_new_uuid()
+        self.thumbnailUrl = thumbnailUrl
+
+    to_dict = Asset.to_dict
+
+
+class CompactShot(CompactMixin, StaticPreviewMixin):
+    """A memory-compact Shot, usually with CompactTask tasks."""
+
+    __slots__ = (
+        'name',
+        'sequence_id',
+        'data',
+        'tasks',
+        'startFrame',
+        'durationSeconds',
+        'id',
+        'thumbnailUrl',
+        'fps',
+    )
+
+    def __init__(
+        self,
+        name: str,
+        sequence_id: str,
+        data: ShotData,
+        tasks: Optional[List[CompactTask]] = None,
+        id: Optional[str] = None,
+        thumbnailUrl: Optional[str] = None,
+        fps: float = 24,
+    ):
+        self.name = name
+        self.sequence_id = sys.intern(sequence_id)
+        self.data = data
+        self.tasks = tasks if tasks is not None else []
+        self.id = id or IdMixin.get_new_uuid()
+        self.thumbnailUrl = thumbnailUrl
+        self.fps = fps
+        self.startFrame = int(data['frame_in'])
+        self.durationSeconds = (int(data['frame_out']) - self.startFrame) / fps
+
+    to_dict = Shot.to_dict
+
 
 @dataclass
 class ShotCasting:
@@ -233,6 +368,9 @@ class ShotCasting:
 class Sequence(IdMixin):
     id: Optional[str] = None
 
+    def to_dict(self) -> Dict[str, Any]:
+        return {'name': self.name, 'id': self.id}
+
 
 @dataclass
 class Edit(IdMixin):
@@ -245,6 +383,8 @@ class Edit(IdMixin):
     sourceName: Optional[str] = None
     totalFrames: int = 0
     sourceType: str = 'video/mp4'
+    # Optional '<algorithm>:<hex digest>' of the source file, verified after download
+    checksum: Optional[str] = None
 
     def __post_init__(self):
         if not self.sourceName:
@@ -267,6 +407,13 @@ class Episode(IdMixin):
     # edit: Edit = None
     id: Optional[str] = None
 
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'sequences': [s.to_dict() for s in self.sequences],
+            'id': self.id,
+        }
+
 
 @dataclass
 class EpisodeListItem(IdMixin):
@@ -274,6 +421,9 @@ class EpisodeListItem(IdMixin):
 
     id: Optional[str] = None
 
+    def to_dict(self) -> Dict[str, Any]:
+        return {'name': self.name, 'id': self.id}
+
 
 @dataclass
 class ProjectListItem(StaticPreviewMixin, IdMixin):
@@ -283,6 +433,14 @@ class ProjectListItem(StaticPreviewMixin, IdMixin):
     thumbnailUrl: Optional[str] = None
     episodes: List[EpisodeListItem] = field(default_factory=list)
 
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'id': self.id,
+            'thumbnailUrl': self.thumbnailUrl,
+            'episodes': [e.to_dict() for e in self.episodes],
+        }
+
 
 @dataclass
 class Project(StaticPreviewMixin, IdMixin):
@@ -299,6 +457,30 @@ class Project(StaticPreviewMixin, IdMixin):
     fps: float = 24
     episodes: List[Episode] = field(default_factory=list)
 
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'ratio': self.ratio,
+            'resolution': self.resolution,
+            'asset_types': [a.to_dict() for a in self.asset_types],
+            'task_types': [t.to_dict() for t in self.task_types],
+            'task_statuses': [t.to_dict() for t in self.task_statuses],
+            # All the User fields, unlike User.to_dict()
+            'team': [
+                {
+                    'name': u.name,
+                    'has_avatar': u.has_avatar,
+                    'id': u.id,
+                    'thumbnailUrl': u.thumbnailUrl,
+                }
+                for u in self.team
+            ],
+            'id': self.id,
+            'thumbnailUrl': self.thumbnailUrl,
+            'fps': self.fps,
+            'episodes': [e.to_dict() for e in self.episodes],
+        }
+
 
 @dataclass
 class TaskStatusCountSnapshot:
@@ -0,0 +1,108 @@
+"""Frame count of MP4 and MOV movies, read from their sample tables.
+
+Only the box headers on the way to the sample tables of the first video track are read,
+through a memory map, so the frame count of a long movie is read in milliseconds and
+without ffprobe.
+"""
+
+import mmap
+import pathlib
+import struct
+from typing import Iterator, Optional, Tuple
+
+# Payload start and end of a box
+Span = Tuple[int, int]
+# Types of the boxes an MP4 or MOV file can start with
+FIRST_BOX_TYPES = {b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide', b'pnot'}
+
+
+class Mp4Error(ValueError):
+    """The file looks like an MP4 or MOV movie, but is malformed."""
+
+
+def iter_boxes(data, start: int, end: int) -> Iterator[Tuple[bytes, int, int]]:
+    """Yield the type, payload start and end of the boxes between start and end."""
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        header_size = 8
+        if size == 1:
+            # 64 bits size, following the type
+            (size,) = struct.unpack_from('>Q', data, offset + 8)
+            header_size = 16
+        elif size == 0:
+            # Extends to the end of the file
+            size = end - offset
+        if size < header_size or offset + size > end:
+            raise Mp4Error(f"Invalid size of the {box_type!r} box at {offset}")
+        yield box_type, offset + header_size, offset + size
+        offset += size
+
+
+def get_box(data, span: Span, *path: bytes) -> Optional[Span]:
+    """Get the first box at path (a list of box types) within span."""
+    for box_type in path:
+        span = next(((s, e) for t, s, e in iter_boxes(data, *span) if t == box_type), None)
+        if span is None:
+            return None
+    return span
+
+
+def get_video_frames_count(data) -> Optional[int]:
+    """Get the number of samples of the first video track, or None if there is no
+    video track with a sample table."""
+    if data[4:8] not in FIRST_BOX_TYPES:
+        return None
+    moov = get_box(data, (0, len(data)), b'moov')
+    if moov is None:
+        return None
+    # Fragmented movies store their samples in moof boxes, after the sample tables
+    if get_box(data, moov, b'mvex'):
+        return None
+    for box_type, start, end in iter_boxes(data, *moov):
+        if box_type != b'trak':
+            continue
+        mdia = get_box(data, (start, end), b'mdia')
+        hdlr = mdia and get_box(data, mdia, b'hdlr')
+        # Version and flags, pre-defined, then the handler type
+        if not hdlr or data[hdlr[0] + 8 : hdlr[0] + 12] != b'vide':
+            continue
+        stbl = get_box(data, mdia, b'minf', b'stbl')
+        stts = stbl and get_box(data, stbl, b'stts')
+        if not stts:
+            return None
+        # Version and flags, entry count, then (sample count, sample duration) entries
+        (entry_count,) = struct.unpack_from('>I', data, stts[0] + 4)
+        entries_end = stts[0] + 8 + entry_count * 8
+        if entries_end > stts[1]:
+            raise Mp4Error("Truncated stts box")
+        frames_count = sum(
+            count for count, _ in struct.iter_unpack('>II', data[stts[0] + 8 : entries_end])
+        )
+        stsz = get_box(data, stbl, b'stsz')
+        if stsz:
+            # Version and flags, sample size, then the sample count
+            (sample_count,) = struct.unpack_from('>I', data, stsz[0] + 8)
+            if sample_count != frames_count:
+                raise Mp4Error(f"stts has {frames_count} samples, but stsz {sample_count}")
+        return frames_count
+    return None
+
+
+def get_frames_count(input_path: pathlib.Path) -> Optional[int]:
+    """Get the number of frames of the first video track of an MP4 or MOV movie.
+
+    Returns None if the file is not such a movie, or if its frames are not counted in
+    sample tables. Raises Mp4Error if it is malformed.
+    """
+    with open(input_path, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file
+            return None
+    with data:
+        try:
+            return get_video_frames_count(data)
+        except struct.error as e:
+            raise Mp4Error(f"Truncated box: {e}") from e
@@ -0,0 +1,312 @@
+import email.utils
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Hashable, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from watchtower_pipeline import media
+
+
+class BoundedSession(requests.Session):
+    """A requests Session backed by a shared keep-alive connection pool.
+
+    Connections are reused across requests, so only the first request to a host pays for
+    the TCP and TLS handshakes. Two limits can be configured:
+    - pool_connections: the number of per-host pools kept alive
+    - pool_maxsize: the maximum number of connections open to a single host. When all of
+      them are busy, further requests wait for one to be released.
+    Optionally, max_in_flight caps the number of requests in progress across all hosts.
+    A streamed response (stream=True, as for media downloads) counts as in progress until
+    it is closed, so it must be closed, for instance with a with statement.
+    """
+
+    def __init__(
+        self,
+        pool_connections: int = 10,
+        pool_maxsize: int = 10,
+        max_in_flight: Optional[int] = None,
+    ):
+        super().__init__()
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=True,
+        )
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+        self._in_flight = threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+
+    def request(self, method, url, *args, **kwargs):
+        if not self._in_flight:
+            return super().request(method, url, *args, **kwargs)
+        self._in_flight.acquire()
+        try:
+            response = super().request(method, url, *args, **kwargs)
+        except BaseException:
+            self._in_flight.release()
+            raise
+        if not kwargs.get('stream'):
+            self._in_flight.release()
+            return response
+        # The body is still to be transferred: release the slot once the response is closed
+        close = response.close
+        # Held until the slot is released, so that closing again does not release it twice
+        release_once = threading.Lock()
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                if release_once.acquire(blocking=False):
+                    self._in_flight.release()
+
+        response.close = close_and_release
+        return response
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised instead of sending a request while the circuit breaker is open."""
+
+
+class TokenBucket:
+    """Rate limit: on average requests_per_second requests, in bursts of up to burst."""
+
+    def __init__(
+        self,
+        requests_per_second: Optional[float] = None,
+        burst: Optional[int] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.rate = requests_per_second
+        self.capacity = burst or max(1, int(requests_per_second or 1))
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = float(self.capacity)
+        self._updated_at = clock()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, duration: float):
+        """Hold back all requests for duration seconds, as asked by the server."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, self.clock() + duration)
+
+    def acquire(self):
+        """Wait for a token."""
+        while True:
+            with self._lock:
+                now = self.clock()
+                wait = self._paused_until - now
+                if wait <= 0 and not self.rate:
+                    return
+                if wait <= 0:
+                    elapsed = now - self._updated_at
+                    self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+                    self._updated_at = now
+                    # Tolerate rounding errors, which would otherwise wait for nothing
+                    if self._tokens >= 1 - 1e-9:
+                        self._tokens = max(0.0, self._tokens - 1)
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            self.sleep(wait)
+
+
+class CircuitBreaker:
+    """Stop sending requests after failure_threshold consecutive failures.
+
+    Once open, requests fail right away for reset_timeout seconds. A single request is
+    then let through as a probe, while the others still fail right away: if it fails,
+    the circuit opens again, if it succeeds, the circuit closes.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        # Whether the probe request of the half-open circuit is in progress
+        self.probing = False
+        # Number of times the circuit opened
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    def check(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            remaining = self.reset_timeout - (self.clock() - self.opened_at)
+            if remaining <= 0 and not self.probing:
+                self.probing = True
+                return
+            raise CircuitOpenError(
+                f"Circuit open after {self.failures} consecutive failures, "
+                + (f"retrying in {remaining:.0f}s" if remaining > 0 else "probing")
+            )
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    self.trips += 1
+                self.opened_at = self.clock()
+                self.probing = False
+
+
+class LatencyStats:
+    """Latency of requests, reported as percentiles."""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.latencies.append(seconds)
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """Nearest-rank percentile, in seconds."""
+        with self._lock:
+            latencies = sorted(self.latencies)
+        if not latencies:
+            return None
+        rank = max(1, math.ceil(percent / 100 * len(latencies)))
+        return latencies[rank - 1]
+
+    def __str__(self):
+        if not self.latencies:
+            return "no requests"
+        percentiles = ', '.join(
+            f"p{p} {self.percentile(p) * 1000:.0f}ms" for p in (50, 90, 99, 100)
+        )
+        return f"{len(self.latencies)} requests ({self.retries} retried): {percentiles}"
+
+
+def get_retry_after(response: requests.Response) -> Optional[float]:
+    """Get the delay, in seconds, asked for by a Retry-After header."""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class RequestScheduler:
+    """Send requests through a rate limit, circuit breakers and retries.
+
+    Requests failing with a connection error, a timeout or a status in
+    RETRY_STATUS_CODES are retried up to `retries` times, after a jittered exponential
+    backoff (starting from `backoff` seconds, up to `max_backoff`) or the delay asked by
+    a Retry-After header. A 429 response holds back all requests for that delay.
+
+    There is one circuit breaker per endpoint (the key of the request), and a request
+    counts as one failure once its retries are exhausted: an endpoint failing
+    persistently does not hold back requests to the other ones.
+    """
+
+    def __init__(
+        self,
+        requests_per_second: Optional[float] = None,
+        retries: int = 4,
+        backoff: float = 0.5,
+        max_backoff: float = 60,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30,
+    ):
+        self.rate_limiter = TokenBucket(requests_per_second)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.circuit_breakers: Dict[Hashable, CircuitBreaker] = {}
+        self.latency = LatencyStats()
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+
+    def get_circuit_breaker(self, key: Hashable = None) -> CircuitBreaker:
+        with self._lock:
+            if key not in self.circuit_breakers:
+                self.circuit_breakers[key] = CircuitBreaker(
+                    self.failure_threshold, self.reset_timeout
+                )
+            return self.circuit_breakers[key]
+
+    def request(
+        self, send: Callable[[], requests.Response], key: Hashable = None
+    ) -> requests.Response:
+        """Send a request with send(), retrying it if needed. The last response is
+        returned even if it is an error, for the caller to check.
+
+        Raises CircuitOpenError without sending it if the circuit of key is open.
+        """
+        circuit_breaker = self.get_circuit_breaker(key)
+        circuit_breaker.check()
+        try:
+            response = self._request_with_retries(send)
+        except Exception:
+            circuit_breaker.record_failure()
+            raise
+        if response.status_code in media.RETRY_STATUS_CODES:
+            circuit_breaker.record_failure()
+        else:
+            circuit_breaker.record_success()
+        return response
+
+    def _request_with_retries(self, send: Callable[[], requests.Response]) -> requests.Response:
+        for attempt in range(self.retries + 1):
+            self.rate_limiter.acquire()
+            start = time.perf_counter()
+            try:
+                response = send()
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.retries:
+                    raise
+                delay = media.get_backoff_delay(attempt, self.backoff)
+                logging.debug(f"Retrying request in {delay:.2f}s ({e})")
+            else:
+                self.latency.record(time.perf_counter() - start)
+                if response.status_code not in media.RETRY_STATUS_CODES:
+                    return response
+                if attempt == self.retries:
+                    return response
+                retry_after = get_retry_after(response)
+                delay = media.get_backoff_delay(attempt, self.backoff)
+                if retry_after is not None:
+                    delay = retry_after
+                if response.status_code == 429:
+                    self.rate_limiter.pause(min(delay, self.max_backoff))
+                logging.debug(f"Retrying {response.url} in {delay:.2f}s ({response.status_code})")
+            self.latency.record_retry()
+            time.sleep(min(delay, self.max_backoff))
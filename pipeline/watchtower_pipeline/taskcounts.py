@@ -0,0 +1,369 @@
+"""History of task counts, stored compactly.
+
+Every export adds a snapshot of the task counts (by task type, episode and status) to
+the history of the project. Rather than keeping every snapshot:
+- consecutive snapshots with the same count are stored once, as a run with the time of
+  its first and last snapshot
+- older snapshots are downsampled: hourly for recent ones, then daily, then weekly (see
+  RetentionPolicy)
+
+Snapshots are first appended to a log, task_counts.log.jsonl. The history, saved as
+task_counts.history.json, records how much of the log it includes, so every export only
+reads the snapshots added since the previous one. If an export is interrupted, the next
+one picks up the snapshots it missed. Once the history is saved, the log is emptied,
+and starts again with a new id, so it does not grow with every export.
+
+task_counts.json, in the format read by the web client, is built from the history with
+the first and last snapshot of every run, so that charts look the same as with all
+snapshots. The first export with a history migrates the existing task_counts.json.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import pathlib
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from watchtower_pipeline import jsonfiles
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where concurrent exports are not locked out
+    fcntl = None
+
+# Name of the history, next to task_counts.json. Only read by the pipeline, it is not
+# listed in the manifest of the project documents.
+HISTORY_NAME = 'task_counts.history'
+HISTORY_VERSION = 1
+LOG_NAME = 'task_counts.log.jsonl'
+
+# Task type id, episode id and task status id
+SeriesKey = Tuple[str, Optional[str], str]
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
+    # Snapshots more recent than this are kept at an hourly resolution
+    hourly: timedelta = timedelta(days=2)
+    # Then at a daily resolution, and at a weekly resolution once older than this
+    daily: timedelta = timedelta(days=90)
+
+    def get_bucket(self, timestamp: datetime, now: datetime) -> tuple:
+        """Get the time bucket of a snapshot. Only the latest snapshot of each bucket is
+        kept."""
+        age = now - timestamp
+        if age < self.hourly:
+            return ('hour', timestamp.date(), timestamp.hour)
+        if age < self.daily:
+            return ('day', timestamp.date())
+        year, week, _ = timestamp.isocalendar()
+        return ('week', year, week)
+
+
+@dataclass
+class Run:
+    """Consecutive snapshots with the same count."""
+
+    first: str  # ISO timestamps
+    last: str
+    count: int
+
+    def get_points(self) -> Iterator[Tuple[str, int]]:
+        yield self.first, self.count
+        if self.last != self.first:
+            yield self.last, self.count
+
+    def to_list(self) -> list:
+        if self.last == self.first:
+            return [self.first, self.count]
+        return [self.first, self.last, self.count]
+
+    @classmethod
+    def from_list(cls, value: list) -> 'Run':
+        if len(value) == 2:
+            return cls(first=value[0], last=value[0], count=value[1])
+        return cls(first=value[0], last=value[1], count=value[2])
+
+
+class TaskCountLog:
+    """Log of task count snapshots, with one JSON object per line:
+    {"timestamp": ..., "counts": [[task_type_id, episode_id, task_status_id, count], ...]}
+
+    Snapshots are appended, until the log is emptied by rotate(). It then starts with a
+    {"log_id": ...} line, which tells it apart from the previous log.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+
+    @contextlib.contextmanager
+    def lock(self):
+        """Prevent concurrent exports from interleaving appends and reads."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'ab') as f:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def append(self, task_counts: List[Dict]):
+        """Append snapshots in the format of task_counts.json, one line per timestamp."""
+        counts_by_timestamp = defaultdict(list)
+        for task_count in task_counts:
+            for task_status in task_count['task_statuses']:
+                for snapshot in task_status['data']:
+                    counts_by_timestamp[snapshot['timestamp']].append(
+                        [
+                            task_count['task_type_id'],
+                            task_count['episode_id'],
+                            task_status['task_status_id'],
+                            snapshot['count'],
+                        ]
+                    )
+        lines = [
+            json.dumps({'timestamp': timestamp, 'counts': counts}, separators=(',', ':')) + '\n'
+            for timestamp, counts in counts_by_timestamp.items()
+        ]
+        content = ''.join(lines).encode()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'a+b') as f:
+            if f.seek(0, os.SEEK_END):
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    # A previous append was interrupted. Terminate its partial line, which
+                    # is skipped when reading, rather than corrupting this one.
+                    content = b'\n' + content
+            # Opened in append mode: written at the end, whatever the position
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def get_id(self) -> Optional[str]:
+        """Get the id of the log, None if it was never rotated."""
+        try:
+            with open(self.path, 'rb') as f:
+                header = json.loads(f.readline())
+        except (OSError, ValueError):
+            return None
+        return header.get('log_id') if isinstance(header, dict) else None
+
+    def rotate(self) -> Tuple[str, int]:
+        """Empty the log, once all its snapshots are saved elsewhere.
+
+        Returns the id of the new log, and its size. Truncated in place, so that the
+        file stays locked.
+        """
+        log_id = uuid.uuid4().hex
+        header = (json.dumps({'log_id': log_id}) + '\n').encode()
+        with open(self.path, 'r+b') as f:
+            f.truncate(0)
+            f.write(header)
+            f.flush()
+            os.fsync(f.fileno())
+        return log_id, len(header)
+
+    def read(self, offset: int = 0) -> Tuple[List[Dict], int]:
+        """Read the snapshots after offset (in bytes).
+
+        Returns the snapshots, and the offset of the end of the last complete line.
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                if offset > os.fstat(f.fileno()).st_size:
+                    logging.warning(f"{self.path} is shorter than expected, reading it again")
+                    offset = 0
+                f.seek(offset)
+                content = f.read()
+        except FileNotFoundError:
+            return [], 0
+        # An incomplete last line is being written, or was interrupted
+        end = content.rfind(b'\n') + 1
+        entries = []
+        for line in content[:end].splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                logging.warning(f"Skipping invalid line in {self.path}: {line[:100]!r}")
+                continue
+            if 'log_id' not in entry:
+                entries.append(entry)
+        return entries, offset + end
+
+
+@dataclass
+class TaskCountHistory:
+    # The runs of every series, in the order in which series were first counted
+    series: Dict[SeriesKey, List[Run]] = field(default_factory=dict)
+    # How much of the log (in bytes) is included in the history, and the id of that log
+    log_offset: int = 0
+    log_id: Optional[str] = None
+
+    def add(self, key: SeriesKey, timestamp: str, count: int):
+        runs = self.series.setdefault(key, [])
+        if runs and runs[-1].count == count:
+            runs[-1].last = timestamp
+        else:
+            runs.append(Run(first=timestamp, last=timestamp, count=count))
+
+    def add_task_counts(self, task_counts: List[Dict]):
+        """Add snapshots in the format of task_counts.json, as built by
+        ProjectWriter.count_tasks."""
+        for task_count in task_counts:
+            for task_status in task_count['task_statuses']:
+                key = (
+                    task_count['task_type_id'],
+                    task_count['episode_id'],
+                    task_status['task_status_id'],
+                )
+                for snapshot in task_status['data']:
+                    self.add(key, snapshot['timestamp'], snapshot['count'])
+
+    def add_log_entry(self, entry: Dict):
+        """Add a snapshot read from a TaskCountLog."""
+        for task_type_id, episode_id, task_status_id, count in entry['counts']:
+            self.add((task_type_id, episode_id, task_status_id), entry['timestamp'], count)
+
+    def read_log(self, log: TaskCountLog):
+        """Add the snapshots of the log which are not in the history yet."""
+        log_id = log.get_id()
+        if log_id != self.log_id:
+            # Rotated since the history was saved: none of its snapshots are included
+            self.log_id, self.log_offset = log_id, 0
+        entries, self.log_offset = log.read(self.log_offset)
+        for entry in entries:
+            self.add_log_entry(entry)
+
+    def get_latest_task_counts(self, timestamp: str) -> List[Dict]:
+        """Get the counts of the latest snapshot, taken again at timestamp, in the format
+        of task_counts.json. Series missing from the latest snapshot are left out."""
+        latest = max((runs[-1].last for runs in self.series.values() if runs), default=None)
+        snapshot = TaskCountHistory()
+        for key, runs in self.series.items():
+            if runs and runs[-1].last == latest:
+                snapshot.add(key, timestamp, runs[-1].count)
+        return snapshot.to_task_counts()
+
+    def compact(self, retention: RetentionPolicy = RetentionPolicy()):
+        """Downsample snapshots according to the retention policy.
+
+        Ages are relative to the latest snapshot, rather than to the current time.
+        """
+        timestamps = [run.last for runs in self.series.values() for run in runs]
+        if not timestamps:
+            return
+        now = max(datetime.fromisoformat(t) for t in timestamps)
+        for key, runs in self.series.items():
+            latest_by_bucket = {}
+            for timestamp, count in (p for run in runs for p in run.get_points()):
+                bucket = retention.get_bucket(datetime.fromisoformat(timestamp), now)
+                # Snapshots are in chronological order, so the latest one wins
+                latest_by_bucket[bucket] = (timestamp, count)
+            self.series[key] = []
+            for timestamp, count in latest_by_bucket.values():
+                self.add(key, timestamp, count)
+
+    def to_task_counts(self) -> List[Dict]:
+        """Get the history in the format of task_counts.json."""
+        task_counts = {}
+        for (task_type_id, episode_id, task_status_id), runs in self.series.items():
+            task_count = task_counts.get((task_type_id, episode_id))
+            if task_count is None:
+                task_count = task_counts[(task_type_id, episode_id)] = {
+                    'task_type_id': task_type_id,
+                    'episode_id': episode_id,
+                    'task_statuses': [],
+                }
+            task_count['task_statuses'].append(
+                {
+                    'task_status_id': task_status_id,
+                    'data': [
+                        {'timestamp': timestamp, 'count': count}
+                        for run in runs
+                        for timestamp, count in run.get_points()
+                    ],
+                }
+            )
+        return list(task_counts.values())
+
+    def to_dict(self) -> Dict:
+        return {
+            'version': HISTORY_VERSION,
+            'log_offset': self.log_offset,
+            'log_id': self.log_id,
+            'series': [
+                {
+                    'task_type_id': task_type_id,
+                    'episode_id': episode_id,
+                    'task_status_id': task_status_id,
+                    'runs': [run.to_list() for run in runs],
+                }
+                for (task_type_id, episode_id, task_status_id), runs in self.series.items()
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'TaskCountHistory':
+        if data.get('version') != HISTORY_VERSION:
+            raise ValueError(f"Unsupported task count history version {data.get('version')}")
+        history = cls(log_offset=data.get('log_offset', 0), log_id=data.get('log_id'))
+        for series in data['series']:
+            key = (series['task_type_id'], series['episode_id'], series['task_status_id'])
+            history.series[key] = [Run.from_list(run) for run in series['runs']]
+        return history
+
+    def save(self, project_path: pathlib.Path):
+        content = json.dumps(self.to_dict(), separators=(',', ':')).encode()
+        jsonfiles.write_atomic(project_path / f"{HISTORY_NAME}.json", content)
+
+    @classmethod
+    def load(cls, project_path: pathlib.Path) -> 'TaskCountHistory':
+        """Load the history of a project, migrating it from task_counts.json if needed."""
+        history_path = project_path / f"{HISTORY_NAME}.json"
+        if history_path.is_file():
+            return cls.from_dict(json.loads(history_path.read_text()))
+        history = cls()
+        task_counts_path = project_path / 'task_counts.json'
+        if task_counts_path.is_file():
+            logging.info(f"Migrating {task_counts_path} to {history_path.name}")
+            history.add_task_counts(json.loads(task_counts_path.read_text()))
+        return history
+
+
+def update_history(
+    project_path: pathlib.Path,
+    new_counts: Optional[List[Dict]],
+    retention: RetentionPolicy = RetentionPolicy(),
+) -> TaskCountHistory:
+    """Log new counts (in the format of task_counts.json), bring the history of the
+    project up to date with the log, and save it.
+
+    If new_counts is None, the counts did not change: the latest snapshot is logged again,
+    at the current time, so that the history extends to this export.
+
+    The log is then emptied. If the export is interrupted before, the next update reads
+    the snapshots missing from the saved history from the log.
+    """
+    log = TaskCountLog(project_path / LOG_NAME)
+    with log.lock():
+        history = TaskCountHistory.load(project_path)
+        # The latest snapshot might only be in the log
+        history.read_log(log)
+        if new_counts is None:
+            new_counts = history.get_latest_task_counts(datetime.now().isoformat())
+        log.append(new_counts)
+        history.read_log(log)
+        history.compact(retention)
+        history.save(project_path)
+        # All the snapshots of the log are saved in the history
+        history.log_id, history.log_offset = log.rotate()
+        history.save(project_path)
+    return history
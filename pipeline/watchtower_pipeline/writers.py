@@ -1,56 +1,83 @@
-import json
+import itertools
 import logging
+import os
 import pathlib
-
-import shutil
+import threading
+import time
 
 from abc import ABC, abstractmethod
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
 from datetime import datetime
-from dataclasses import dataclass, asdict, field
-from tqdm import tqdm
-from typing import Dict, List, Optional
-
-from watchtower_pipeline import models, ffprobe
+from dataclasses import dataclass, field
+from typing import Collection, Dict, Iterable, List, Optional
+
+from watchtower_pipeline import models, bundling, ffprobe, jsonfiles, media, taskcounts
+
+# The built web client, included in the bundle
+DIST_CLIENT_WEB_PATH = pathlib.Path(__file__).parent.parent / 'dist_client_web'
+# State of the incremental export of a project, next to its folder (see
+# kitsu.ProjectExportState)
+EXPORT_STATE_SUFFIX = '.state.json'
+# Files of the data folder only read by the pipeline, which are not published in the
+# bundle. Their precompressed variants, written by previous versions, are left out too.
+PIPELINE_FILE_SUFFIXES = tuple(
+    suffix + encoding_suffix
+    for suffix in (
+        # Also covers the sidecars of partial downloads
+        media.CACHE_SUFFIX,
+        ffprobe.CACHE_SUFFIX,
+        taskcounts.LOG_NAME,
+        f"{taskcounts.HISTORY_NAME}.json",
+        EXPORT_STATE_SUFFIX,
+    )
+    for encoding_suffix in ('', *(e.suffix for e in jsonfiles.ENCODINGS.values()))
+)
 
 
 @dataclass
 class ProjectListWriter:
     projects: List[models.ProjectListItem]
     destination_path: pathlib.Path
+    json_format: jsonfiles.JsonFormat = jsonfiles.JsonFormat()
 
     def to_dict(self):
         return {
-            'projects': [asdict(p) for p in self.projects],
+            'projects': [p.to_dict() for p in self.projects],
         }
 
     def download_previews(
-        self, requests_headers: Optional[Dict] = None, force=False, display_progress=True
+        self,
+        requests_headers: Optional[Dict] = None,
+        force=False,
+        display_progress=True,
+        downloader: Optional[media.MediaDownloader] = None,
+        revalidate=False,
     ):
-        # Set a variable that semantically matches tqdm API (the inverse of what we want our API to do)
-        disable_progress = not display_progress
-        for p in tqdm(
+        downloader = downloader or media.MediaDownloader()
+        downloader.download_thumbnails(
             self.projects,
+            self.destination_path,
+            path=pathlib.Path('projects-list') / 'previews',
+            headers=requests_headers,
+            force=force,
             desc="Downloading Project thumbnails",
-            disable=disable_progress,
-            ascii=' >=',
-        ):
-            path = pathlib.Path('projects-list') / 'previews'
-            p.download_and_assign_thumbnail(
-                self.destination_path,
-                path=path,
-                requests_headers=requests_headers,
-                force=force,
-            )
+            display_progress=display_progress,
+            revalidate=revalidate,
+        )
 
     def write_as_json(self):
-        dst = self.destination_path / 'data/projects-list/index.json'
-        dst.parent.mkdir(parents=True, exist_ok=True)
-        with open(dst, 'w') as outfile:
-            json.dump(self.to_dict(), outfile, indent=2)
+        manifest = jsonfiles.Manifest.load(
+            self.destination_path / 'data/projects-list', self.json_format
+        )
+        manifest.write_json('index.json', self.to_dict())
+        manifest.save()
 
 
 class AbstractProjectListWriter(ABC):
+    # How JSON documents are written
+    json_format: jsonfiles.JsonFormat = jsonfiles.JsonFormat()
+
     @abstractmethod
     def get_project_list(self) -> List[models.ProjectListItem]:
         pass
@@ -59,9 +86,24 @@ class AbstractProjectListWriter(ABC):
         return ProjectListWriter(
             projects=self.get_project_list(),
             destination_path=destination_path,
+            json_format=self.json_format,
         )
 
 
+# The JSON documents written for each project
+PROJECT_DOCUMENTS = ('project', 'edits', 'assets', 'shots', 'sequences', 'casting', 'task_counts')
+# The entities, besides the project itself, that each document is built from
+DOCUMENT_SOURCES = {
+    'project': set(),
+    'edits': {'edits'},
+    'assets': {'assets'},
+    'shots': {'shots'},
+    'sequences': {'sequences'},
+    'casting': {'sequences', 'shots', 'assets'},
+    'task_counts': set(),
+}
+
+
 @dataclass
 class ProjectWriter:
     """Saves a project and all its data as JSON files."""
@@ -75,163 +117,169 @@ class ProjectWriter:
     destination_path: pathlib.Path
     # task_counts: Optional[List[models.TaskCount]] = None
     task_counts: Optional[List] = None
+    task_count_history: Optional[taskcounts.TaskCountHistory] = None
+    json_format: jsonfiles.JsonFormat = jsonfiles.JsonFormat()
 
-    def dump_data(self, name, data):
-        dst = self.destination_path / f"data/projects/{self.project.id}/{name}.json"
-        dst.parent.mkdir(parents=True, exist_ok=True)
-        with open(dst, 'w') as outfile:
-            json.dump(data, outfile, indent=2)
-        logging.debug(f"Saved {name} data for project {self.project.id}")
+    def get_manifest(self) -> jsonfiles.Manifest:
+        return jsonfiles.Manifest.load(
+            self.destination_path / f"data/projects/{self.project.id}", self.json_format
+        )
+
+    def _write_document(self, name, write, manifest: Optional[jsonfiles.Manifest]):
+        save_manifest = manifest is None
+        manifest = manifest or self.get_manifest()
+        if write(manifest, f"{name}.json"):
+            logging.debug(f"Saved {name} data for project {self.project.id}")
+        if save_manifest:
+            manifest.save()
+
+    def dump_data(self, name, data, manifest: Optional[jsonfiles.Manifest] = None):
+        """Write a JSON document of the project, unless it is unchanged.
+
+        If a manifest is given, it is updated but not saved.
+        """
+        self._write_document(name, lambda m, filename: m.write_json(filename, data), manifest)
+
+    def dump_list(self, name, items: Iterable, manifest: Optional[jsonfiles.Manifest] = None):
+        """Like dump_data, for a list produced and serialized one item at a time."""
+        self._write_document(name, lambda m, filename: m.write_json_list(filename, items), manifest)
 
     @staticmethod
-    def count_tasks(entities_list, timestamp):
+    def count_tasks(entities_list, timestamp, *other_entities_lists):
         """Given a structured entities_list, count tasks.
 
-        An example for the structure can be found in the unit tests.
+        An example for the structure can be found in the unit tests. More lists can be
+        given to count them together, for example shots and assets.
         """
-        task_type_status_dict = defaultdict(lambda: defaultdict(list))
-
         if isinstance(timestamp, datetime):
             timestamp = timestamp.isoformat()
-        for entity in entities_list:
+
+        # Count tasks by type, episode and status, one entity at a time. The Counter keeps
+        # the order in which keys are first found, which is the order of the output.
+        counts = Counter()
+        for entity in itertools.chain(entities_list, *other_entities_lists):
             episode_id = entity.get('episode_id')
-            for task in entity.get('tasks', []):
-                task_type_id = task.get('task_type_id')
-                task_status_id = task.get('task_status_id')
-
-                if task_type_id and task_status_id:
-                    # If we already encountered this task type in this status, increment the count
-                    if task_status_id in task_type_status_dict[(task_type_id, episode_id)]:
-                        task_type_status_dict[(task_type_id, episode_id)][task_status_id][0][
-                            'count'
-                        ] += 1
-                    # Otherwise, add it for the first time
-                    else:
-                        task_type_status_dict[(task_type_id, episode_id)][task_status_id].append(
-                            {'timestamp': timestamp, 'count': 1}
-                        )
-
-        parsed_data = []
-        for (task_type_id, episode_id), status_dict in task_type_status_dict.items():
-            task_statuses = [
-                {
-                    'task_status_id': status_id,
-                    'data': [{'timestamp': ts['timestamp'], 'count': ts['count']} for ts in tasks],
-                }
-                for status_id, tasks in status_dict.items()
-            ]
-            parsed_data.append(
-                {
+            counts.update(
+                [
+                    (task.get('task_type_id'), episode_id, task.get('task_status_id'))
+                    for task in entity.get('tasks', ())
+                ]
+            )
+
+        task_counts = {}
+        for (task_type_id, episode_id, task_status_id), count in counts.items():
+            if not task_type_id or not task_status_id:
+                continue
+            task_count = task_counts.get((task_type_id, episode_id))
+            if task_count is None:
+                task_count = task_counts[(task_type_id, episode_id)] = {
                     'task_type_id': task_type_id,
                     'episode_id': episode_id,
-                    'task_statuses': task_statuses,
+                    'task_statuses': [],
+                }
+            task_count['task_statuses'].append(
+                {
+                    'task_status_id': task_status_id,
+                    'data': [{'timestamp': timestamp, 'count': count}],
                 }
             )
+        return list(task_counts.values())
 
-        return parsed_data
-
-    @staticmethod
-    def _merge_task_count_dicts(initial, update) -> list:
-        # Convert initial to a dictionary for easier lookup
-        initial_dict = {}
-        for entry in initial:
-            key = (entry['task_type_id'], entry['episode_id'])
-            initial_dict[key] = entry
-
-        # Process each update
-        for update_entry in update:
-            key = (update_entry['task_type_id'], update_entry['episode_id'])
-
-            if key in initial_dict:
-                # Entry exists in initial, so update it
-                initial_task_statuses = initial_dict[key]['task_statuses']
-                update_task_statuses = update_entry['task_statuses']
-
-                # Convert task_counts in initial to a dictionary for easier lookup
-                task_status_dict = {
-                    task_status['task_status_id']: task_status
-                    for task_status in initial_task_statuses
-                }
+    def merge_task_counts(
+        self,
+        new_counts: Optional[List],
+        retention: taskcounts.RetentionPolicy = taskcounts.RetentionPolicy(),
+    ):
+        """Add new counts to the task count history, save it, and build task_counts from it.
 
-                for update_task_status in update_task_statuses:
-                    status_id = update_task_status['task_status_id']
-                    if status_id in task_status_dict:
-                        # If status_id exists, append the new data
-                        task_status_dict[status_id]['data'].extend(update_task_status['data'])
-                    else:
-                        # If status_id does not exist, add the new task_count
-                        task_status_dict[status_id] = update_task_status
-
-                # Convert the task_counts dictionary back to a list
-                initial_dict[key]['task_statuses'] = list(task_status_dict.values())
-            else:
-                # Entry does not exist in initial, so add it
-                initial_dict[key] = update_entry
-
-        # Convert initial_dict back to the list format
-        return list(initial_dict.values())
-
-    def merge_task_counts(self, new_counts):
-        # Create a dictionary for existing task counts based on task_status_id
-        existing_counts_src = (
-            self.destination_path / f"data/projects/{self.project.id}/task_counts.json"
+        If new_counts is None, the counts did not change since the previous export (see
+        taskcounts.update_history).
+        """
+        self.task_count_history = taskcounts.update_history(
+            self.destination_path / f"data/projects/{self.project.id}", new_counts, retention
         )
-        if existing_counts_src.is_file():
-            existing_counts = json.loads(existing_counts_src.read_text())
-        else:
-            existing_counts = {}
+        self.task_counts = self.task_count_history.to_task_counts()
 
-        self.task_counts = self._merge_task_count_dicts(existing_counts, new_counts)
+    def download_previews(
+        self,
+        requests_headers: Optional[Dict] = None,
+        force=False,
+        downloader: Optional[media.MediaDownloader] = None,
+        revalidate=False,
+    ):
+        """Download the thumbnails of shots, assets and team members concurrently."""
+        downloader = downloader or media.MediaDownloader()
+        downloader.download_thumbnails(
+            [*self.shots, *self.assets, *self.project.team],
+            self.destination_path,
+            path=pathlib.Path('projects') / self.project.id / 'previews',
+            headers=requests_headers,
+            force=force,
+            desc="Downloading Shot, Asset and User thumbnails",
+            revalidate=revalidate,
+        )
 
-    def download_previews(self, requests_headers: Optional[Dict] = None, force=False):
-        path = pathlib.Path('projects') / self.project.id / 'previews'
-        for s in tqdm(self.shots, desc="Downloading Shot thumbnails", ascii=' >='):
-            s.download_and_assign_thumbnail(
-                self.destination_path,
-                path=path,
-                requests_headers=requests_headers,
-                force=force,
-            )
-        for a in tqdm(self.assets, desc="Downloading Asset thumbnails", ascii=' >='):
-            a.download_and_assign_thumbnail(
-                self.destination_path,
-                path=path,
-                requests_headers=requests_headers,
-                force=force,
-            )
-        for user in tqdm(self.project.team, desc="Downloading User thumbnails", ascii=' >='):
-            user.download_and_assign_thumbnail(
-                self.destination_path,
-                path=path,
-                requests_headers=requests_headers,
-                force=force,
-            )
+    def download_edits(
+        self,
+        requests_headers: Optional[Dict] = None,
+        force=False,
+        revalidate=False,
+        downloader: Optional[media.MediaDownloader] = None,
+        chunk_size: int = media.DEFAULT_CHUNK_SIZE,
+    ):
+        """Download the edit movies.
 
-    def download_edits(self, requests_headers: Optional[Dict] = None, force=False):
+        Interrupted downloads are resumed, and an edit file is only published once it is
+        complete (and matches edit.checksum, if set).
+        """
+        downloader = downloader or media.MediaDownloader()
         for edit in self.edits:
             in_project_path = f"data/projects/{self.project.id}/edit-{edit.id}.mp4"
             dst = self.destination_path / in_project_path
-            models.fetch_and_save_media(
-                edit.sourceName,
+            downloader.fetch(
+                media.DownloadJob(src_url=edit.sourceName, dst=dst),
                 requests_headers,
-                dst,
                 force=force,
+                revalidate=revalidate,
                 display_progress=True,
+                chunk_size=chunk_size,
+                checksum=edit.checksum,
             )
             edit.sourceName = str(in_project_path)
             edit.totalFrames = ffprobe.get_frames_count(dst)
 
-    def write_as_json(self):
-        self.dump_data('project', asdict(self.project))
-        self.dump_data('edits', [e.to_dict() for e in self.edits])
-        self.dump_data('assets', [asdict(a) for a in self.assets])
-        self.dump_data('shots', [asdict(s) for s in self.shots])
-        self.dump_data('sequences', [asdict(s) for s in self.sequences])
-        self.dump_data('casting', [c.to_dict() for c in self.casting])
-        self.dump_data('task_counts', self.task_counts or [])
+    def write_as_json(self, documents: Optional[Collection[str]] = None):
+        """Write the JSON documents of the project, or only the ones listed in documents."""
+        documents = PROJECT_DOCUMENTS if documents is None else documents
+        manifest = self.get_manifest()
+        if 'project' in documents:
+            self.dump_data('project', self.project.to_dict(), manifest)
+        if 'edits' in documents:
+            self.dump_data('edits', [e.to_dict() for e in self.edits], manifest)
+        # Entities are converted to dicts one at a time, while being written
+        if 'assets' in documents:
+            self.dump_list('assets', (a.to_dict() for a in self.assets), manifest)
+        if 'shots' in documents:
+            self.dump_list('shots', (s.to_dict() for s in self.shots), manifest)
+        if 'sequences' in documents:
+            self.dump_list('sequences', (s.to_dict() for s in self.sequences), manifest)
+        if 'casting' in documents:
+            self.dump_list('casting', (c.to_dict() for c in self.casting), manifest)
+        if 'task_counts' in documents:
+            # The history is saved by merge_task_counts, outside the manifest. It was
+            # listed, and precompressed, by previous versions.
+            history_name = f"{taskcounts.HISTORY_NAME}.json"
+            manifest.files.pop(history_name, None)
+            for encoding in jsonfiles.ENCODINGS.values():
+                manifest.remove(history_name + encoding.suffix)
+            self.dump_data('task_counts', self.task_counts or [], manifest)
+        manifest.save()
 
 
 class AbstractProjectWriter(ABC):
+    # How JSON documents are written
+    json_format: jsonfiles.JsonFormat = jsonfiles.JsonFormat()
+
     @abstractmethod
     def get_project(self, project_id) -> models.Project:
         pass
@@ -266,13 +314,23 @@ class AbstractProjectWriter(ABC):
     def get_project_edits(self, project: models.Project) -> List[models.Edit]:
         pass
 
-    def _get_project_writer(self, project_id, destination_path: pathlib.Path):
+    def _get_project_writer(
+        self,
+        project_id,
+        destination_path: pathlib.Path,
+        documents: Optional[Collection[str]] = None,
+    ):
+        """Fetch the project data, or only the data needed to build documents."""
+        documents = PROJECT_DOCUMENTS if documents is None else documents
+        sources = set().union(*(DOCUMENT_SOURCES[d] for d in documents))
         project = self.get_project(project_id)
-        sequences = self.get_project_sequences(project)
-        shots = self.get_project_shots(project)
-        assets = self.get_project_assets(project)
-        casting = self.get_project_casting(project, sequences, shots, assets)
-        edits = self.get_project_edits(project)
+        sequences = self.get_project_sequences(project) if 'sequences' in sources else []
+        shots = self.get_project_shots(project) if 'shots' in sources else []
+        assets = self.get_project_assets(project) if 'assets' in sources else []
+        casting = []
+        if 'casting' in documents:
+            casting = self.get_project_casting(project, sequences, shots, assets)
+        edits = self.get_project_edits(project) if 'edits' in sources else []
 
         return ProjectWriter(
             project=project,
@@ -282,46 +340,205 @@ class AbstractProjectWriter(ABC):
             edits=edits,
             casting=casting,
             destination_path=destination_path,
+            json_format=self.json_format,
         )
 
 
+@dataclass
+class ProjectExportResult:
+    project_id: str
+    duration: float  # In seconds
+    error: Optional[Exception] = None
+
+
 class AbstractWriter(AbstractProjectListWriter, AbstractProjectWriter, ABC):
+    # Number of thumbnails downloaded at the same time
+    download_workers: int = 8
+    # Optional limit of download requests per second, per host
+    download_rate_limit: Optional[float] = None
+    # Shared by all the media downloaders of a writer, created on first use
+    _download_rate_limiter: Optional[media.HostRateLimiter] = None
+    _download_rate_limiter_lock = threading.Lock()
+    # Check if already downloaded media changed upstream, using conditional requests
+    revalidate_media: bool = False
+    # How long task count snapshots are kept at an hourly and daily resolution
+    task_count_retention: taskcounts.RetentionPolicy = taskcounts.RetentionPolicy()
+
     @property
     @abstractmethod
     def request_headers(self) -> Optional[Dict]:
         pass
 
-    def write_project(self, project_id, destination_path: pathlib.Path):
-        project_writer = self._get_project_writer(project_id, destination_path)
-        project_writer.download_previews(self.request_headers)
-        project_writer.download_edits(self.request_headers)
-        current_task_count = self.get_task_count(project_id)
-        project_writer.merge_task_counts(current_task_count)
-        project_writer.write_as_json()
+    def get_download_rate_limiter(self) -> media.HostRateLimiter:
+        """Get the rate limiter of all downloads, so that the limit per host holds across
+        downloaders, and projects exported at the same time."""
+        with self._download_rate_limiter_lock:
+            if self._download_rate_limiter is None:
+                self._download_rate_limiter = media.HostRateLimiter(self.download_rate_limit)
+            return self._download_rate_limiter
+
+    def get_media_downloader(self) -> media.MediaDownloader:
+        return media.MediaDownloader(
+            workers=self.download_workers, rate_limiter=self.get_download_rate_limiter()
+        )
+
+    def write_project(
+        self,
+        project_id,
+        destination_path: pathlib.Path,
+        documents: Optional[Collection[str]] = None,
+        count_tasks: bool = True,
+    ):
+        """Export a project. If documents is specified, only those documents (see
+        PROJECT_DOCUMENTS) are built and written, the other ones are left untouched.
+
+        If count_tasks is False, tasks are known not to have changed since the previous
+        export: task_counts is extended with the latest counts, rather than counted again.
+        """
+        documents = PROJECT_DOCUMENTS if documents is None else documents
+        self._write_project_documents(project_id, destination_path, documents, count_tasks)
+
+    def _write_project_documents(
+        self,
+        project_id,
+        destination_path: pathlib.Path,
+        documents: Collection[str],
+        count_tasks: bool = True,
+    ):
+        project_writer = self._get_project_writer(project_id, destination_path, documents)
+        project_writer.download_previews(
+            self.request_headers,
+            downloader=self.get_media_downloader(),
+            revalidate=self.revalidate_media,
+        )
+        if 'edits' in documents:
+            project_writer.download_edits(
+                self.request_headers,
+                revalidate=self.revalidate_media,
+                downloader=self.get_media_downloader(),
+            )
+        if 'task_counts' in documents:
+            current_task_count = self.get_task_count(project_id) if count_tasks else None
+            project_writer.merge_task_counts(current_task_count, self.task_count_retention)
+        project_writer.write_as_json(documents)
+
+    def _write_project_timed(self, project_id, destination_path) -> ProjectExportResult:
+        start = time.perf_counter()
+        error = None
+        try:
+            self.write_project(project_id, destination_path)
+        except Exception as e:
+            # A failing project should not prevent the other ones from being exported
+            logging.exception(f"Error exporting project {project_id}")
+            error = e
+        return ProjectExportResult(
+            project_id=project_id, duration=time.perf_counter() - start, error=error
+        )
+
+    def write_projects(
+        self, project_ids: List[str], destination_path: pathlib.Path, jobs: int = 1
+    ) -> List[ProjectExportResult]:
+        """Export several projects, up to `jobs` of them at the same time.
 
-    def write_all(self, destination_path: pathlib.Path):
+        Failures are isolated: every project is attempted, and the result of each one
+        (including how long it took) is logged in a summary and returned.
+        """
+        if jobs > 1 and len(project_ids) > 1:
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                results = list(
+                    executor.map(
+                        lambda project_id: self._write_project_timed(project_id, destination_path),
+                        project_ids,
+                    )
+                )
+        else:
+            results = [self._write_project_timed(p, destination_path) for p in project_ids]
+
+        logging.info("Export summary:")
+        for result in results:
+            status = f"failed ({result.error!r})" if result.error else "ok"
+            logging.info(f"\t{result.project_id}\t{result.duration:.1f}s\t{status}")
+        return results
+
+    def write_all(self, destination_path: pathlib.Path, jobs: int = 1) -> List[ProjectExportResult]:
         project_list_writer = self._get_project_list_writer(destination_path)
-        project_list_writer.download_previews(self.request_headers)
+        project_list_writer.download_previews(
+            self.request_headers,
+            downloader=self.get_media_downloader(),
+            revalidate=self.revalidate_media,
+        )
         project_list_writer.write_as_json()
-        for p in project_list_writer.projects:
-            self.write_project(p.id, destination_path)
+        return self.write_projects(
+            [p.id for p in project_list_writer.projects], destination_path, jobs=jobs
+        )
 
 
 @dataclass
 class WatchtowerBundler:
     @staticmethod
-    def bundle(destination_path: pathlib.Path):
+    def get_sync_manifest_path(destination_path: pathlib.Path, dst: pathlib.Path) -> pathlib.Path:
+        """Get the manifest of the synchronization of dst, which is kept out of the bundle.
+
+        The manifest written in dst by previous versions is moved there.
+        """
+        name = dst.relative_to(destination_path).as_posix().replace('/', '-')
+        path = destination_path / f".{name}{bundling.MANIFEST_NAME}"
+        published_path = dst / bundling.MANIFEST_NAME
+        if published_path.exists():
+            os.replace(published_path, path)
+        return path
+
+    @staticmethod
+    def unlist_pipeline_files(data_path: pathlib.Path):
+        """Remove the files only read by the pipeline from the manifests of the documents,
+        in which previous versions listed them."""
+        manifest_paths = [
+            data_path / jsonfiles.MANIFEST_NAME,
+            *data_path.glob(f"projects/*/{jsonfiles.MANIFEST_NAME}"),
+        ]
+        for manifest_path in manifest_paths:
+            manifest = jsonfiles.Manifest.load(manifest_path.parent)
+            names = [name for name in manifest.files if name.endswith(PIPELINE_FILE_SUFFIXES)]
+            for name in names:
+                del manifest.files[name]
+            if names:
+                manifest.save()
+
+    @staticmethod
+    def bundle(destination_path: pathlib.Path, mode: str = 'copy', workers: int = 8):
         """Combine the embedded dist_client_web with the static_path content.
 
-        - copy the content dist_client_web into destination_path
-        - copy the content of destination_path / 'data'  into destination_path
-        - delete destination_path / 'data'
+        - synchronize destination_path / 'watchtower' with dist_client_web
+        - synchronize destination_path / 'watchtower' / 'data' with
+          destination_path / 'data', transferring files according to mode (see
+          bundling.MODES). Files only read by the pipeline, such as caches and export
+          states, are left out, and removed from the manifests of the documents.
+
+        destination_path / 'data' is kept, so that the next export only downloads and
+        transfers what changed. The manifests of the synchronization are kept next to it,
+        out of the published bundle.
         """
-        dist_client_web_src = pathlib.Path(__file__).parent.parent / 'dist_client_web'
         dist_client_web_dst = destination_path / 'watchtower'
-        shutil.copytree(dist_client_web_src, dist_client_web_dst, dirs_exist_ok=True)
-        shutil.copytree(destination_path / 'data', dist_client_web_dst / 'data', dirs_exist_ok=True)
-        shutil.rmtree(destination_path / 'data')
+        WatchtowerBundler.unlist_pipeline_files(destination_path / 'data')
+        bundling.sync_tree(
+            DIST_CLIENT_WEB_PATH,
+            dist_client_web_dst,
+            workers=workers,
+            manifest_path=WatchtowerBundler.get_sync_manifest_path(
+                destination_path, dist_client_web_dst
+            ),
+        )
+        stats = bundling.sync_tree(
+            destination_path / 'data',
+            dist_client_web_dst / 'data',
+            mode=mode,
+            workers=workers,
+            excluded_suffixes=PIPELINE_FILE_SUFFIXES,
+            manifest_path=WatchtowerBundler.get_sync_manifest_path(
+                destination_path, dist_client_web_dst / 'data'
+            ),
+        )
+        logging.info(f"Bundled data: {stats}")
         logging.info(f"Watchtower bundle ready at {dist_client_web_dst}")
         logging.info(f"You can preview it with the following command:")
         logging.info(f"\tpython -m http.server --directory {dist_client_web_dst}")